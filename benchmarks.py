@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite reproducing the scaling study of the ACM MMSys 2021 experiments on reduced durations: step throughput
+of the RedirectedWalker versus the number of users, the number of walls and the duration, and throughput of the
+short-term prediction (window extraction and predictors). All cases use fixed seeds, every case is timed over several
+repeats after a warm-up run, and the results are stored as JSON. A run can be compared against a stored baseline, so
+that performance regressions of the hot path show up before deploying.
+
+Usage: python benchmarks.py [-k name] [--output results.json] [--baseline baseline.json] [--tolerance 0.2]
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import argparse
+import functools
+import json
+import math
+import os
+import platform
+import sys
+import time
+import numpy as np
+import environment
+import algorithm
+import simulation
+import prediction
+import spatial
+from result_sink import write_json
+from sweep import MMSYS_PARAMETERS, expand_grid
+from user import User
+
+
+BENCHMARKS = {}
+KERNELS = {'reference': simulation.reference_step, 'vectorized': simulation.vectorized_step}
+
+
+# Registers a benchmark, run for every combination of its parameter grid (see sweep.expand_grid). A benchmark is
+# called with the parameters of a case, does its (untimed) setup and returns the function to time together with the
+# amount of work it does and the unit of that work, from which the throughput is derived.
+def register_benchmark(name, **grid):
+	def register(benchmark):
+		BENCHMARKS[name] = (benchmark, grid)
+		return benchmark
+	return register
+
+
+# Simulation of num_users users in the environment, with initial locations and random virtual paths drawn from seed
+def make_simulation(env, num_users, num_steps, seed, kernel='vectorized', threshold=100, **rdw_arguments):
+	rdw = algorithm.RedirectedWalker(env=env, **dict(MMSYS_PARAMETERS, duration=num_steps // MMSYS_PARAMETERS['steps_per_second']), **rdw_arguments)
+	rng = np.random.default_rng(seed)
+	lower = np.min(rdw.walls, axis=(0, 1))
+	upper = np.max(rdw.walls, axis=(0, 1))
+	users = []
+	for identity in range(1, num_users + 1):
+		initial_loc = rng.uniform(lower, upper)
+		while not environment.is_inside(env, initial_loc):
+			initial_loc = rng.uniform(lower, upper)
+		user = User(initial_loc, 1.0, identity)
+		user.fill_virtual_path(rdw.steps, rdw.delta_t, None, rng)
+		users.append(user)
+	return simulation.Simulation(rdw, users, threshold, KERNELS[kernel])
+
+
+# Steps of all users per second versus the number of users, in a square room growing with the number of users so that
+# the density stays close to the one of the MMSys experiments (the reference kernel is limited to small groups). With a
+# user_cutoff, only the users within this distance repel each other (cell-list culling, see spatial.NeighborGrid).
+@register_benchmark('step_users', num_users=[1, 2, 4, 8, 16, 32, 64, 128, 200], kernel=['reference', 'vectorized'], user_cutoff=[None, 3.0])
+def bench_step_users(num_users, kernel, user_cutoff):
+	if kernel == 'reference' and (num_users > 16 or user_cutoff is not None):
+		return None
+	num_steps = 200 if num_users <= 32 else 50
+	user_index = spatial.NeighborGrid(user_cutoff) if user_cutoff is not None else None
+	sim = make_simulation(environment.define_square(max(10.0, 2.5 * math.sqrt(num_users))), num_users, num_steps, 0, kernel, user_index=user_index)
+	return sim.run, (num_steps - 2) * num_users, 'user steps'
+
+
+# Steps of all users per second versus the number of walls (warehouses with rows x rows shelves of 4 walls each)
+@register_benchmark('step_walls', rows=[0, 2, 5, 10, 20], kernel=['vectorized'])
+def bench_step_walls(rows, kernel):
+	size = max(10.0, 3.0 * rows)
+	env = environment.define_warehouse(size, size, rows, rows, 1.0, 1.0) if rows else environment.define_square(size)
+	sim = make_simulation(env, 4, 200, 0, kernel)
+	return sim.run, 198 * 4, 'user steps'
+
+
+# Steps per second versus the duration of the run, which should stay flat (no cost growing with the history)
+@register_benchmark('step_duration', duration=[10, 60, 300], kernel=['vectorized'])
+def bench_step_duration(duration, kernel):
+	num_steps = duration * MMSYS_PARAMETERS['steps_per_second']
+	sim = make_simulation(environment.define_square(10.0), 4, num_steps, 0, kernel)
+	return sim.run, (num_steps - 2) * 4, 'user steps'
+
+
+# Physical path of a single user walking for num_steps steps, shared by the prediction benchmarks
+@functools.lru_cache(maxsize=None)
+def walked_path(num_steps):
+	sim = make_simulation(environment.define_square(10.0), 1, num_steps, 0).run()
+	return sim.users[0].get_phy_path().copy()
+
+
+# Windows per second extracted from a trajectory by split_series. The windows are views, so they are copied into
+# contiguous X and y arrays ('copy') or gathered in shuffled batches as for training ('shuffled', see iter_windows), as
+# creating the views alone does not touch the data.
+@register_benchmark('split_series', length=[1000, 10000, 100000], mode=['copy', 'shuffled'])
+def bench_split_series(length, mode):
+	path = np.cumsum(np.random.default_rng(0).normal(0, 0.1, size=(length, 2)), axis=0)
+	if mode == 'copy':
+		function = lambda: [np.ascontiguousarray(part) for part in prediction.split_series(path, 9, 1)]
+	else:
+		function = lambda: sum(len(X) for X, y in prediction.iter_windows(path, 9, 1, shuffle=True))
+	return function, length - 9, 'windows'
+
+
+# Predictions per second of the predictors that do not need TensorFlow, on the path of a ten-minute walk
+@register_benchmark('predictor', predictor=['constant_velocity', 'kalman', 'ridge'])
+def bench_predictor(predictor):
+	path = walked_path(6000)
+	num_tests = len(path) - 10 - int(0.8 * (len(path) - 10))
+	return lambda: prediction.make_and_evaluate_predictions(path, 9, 1, 2, predictor = predictor), num_tests, 'predictions'
+
+
+# Times one case of a benchmark: a warm-up run and repeat timed samples. Each call is timed after a fresh setup, and
+# a sample averages as many calls as needed to last at least min_time, so that very short cases are not dominated by
+# the timer resolution and noise. Returns None for the cases the benchmark skips.
+def run_case(name, parameters, repeat=5, min_time=0.05):
+	benchmark = BENCHMARKS[name][0]
+	case = benchmark(**parameters)
+	if case is None:
+		return None
+
+	function, work, unit = case
+	start = time.perf_counter()
+	function()
+	loops = max(1, int(math.ceil(min_time / max(time.perf_counter() - start, 1e-9))))
+
+	times = []
+	for sample in range(repeat):
+		total = 0.0
+		for loop in range(loops):
+			function = benchmark(**parameters)[0]
+			start = time.perf_counter()
+			function()
+			total += time.perf_counter() - start
+		times.append(total / loops)
+
+	median = float(np.median(times))
+	return {'benchmark': name, 'parameters': parameters, 'loops': loops, 'times': times, 'min': min(times), 'median': median,
+			'mean': float(np.mean(times)), 'stddev': float(np.std(times)), 'work': work, 'unit': unit,
+			'throughput': work / median}
+
+
+# Runs all cases of the benchmarks whose name contains one of the selections (all by default)
+def run_benchmarks(selection=None, repeat=5, verbose=True):
+	results = []
+	for name, (benchmark, grid) in BENCHMARKS.items():
+		if selection and not any(selected in name for selected in selection):
+			continue
+		for parameters in expand_grid(grid):
+			result = run_case(name, parameters, repeat)
+			if result is not None:
+				results.append(result)
+				if verbose:
+					print('{:<14} {:<45} {:>10.4f} s {:>14.1f} {}/s'.format(name, case_label(parameters), result['median'], result['throughput'], result['unit']))
+	return {'machine': machine_info(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': repeat, 'results': results}
+
+
+def case_label(parameters):
+	return ', '.join(name + '=' + str(value) for name, value in parameters.items())
+
+
+# Description of the machine and of the versions, stored with the results since timings only compare on the same setup
+def machine_info():
+	return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+			'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+# Cases of the results that are slower than in the baseline by more than tolerance. The fastest samples are compared,
+# which are the least affected by other load on the machine. Returns one row per case present in both, with the ratio
+# of the times and whether it is a regression.
+def compare(results, baseline, tolerance=0.2):
+	reference = {(result['benchmark'], case_label(result['parameters'])): result for result in baseline['results']}
+	rows = []
+	for result in results['results']:
+		key = (result['benchmark'], case_label(result['parameters']))
+		if key in reference:
+			ratio = result['min'] / reference[key]['min']
+			rows.append({'benchmark': key[0], 'parameters': result['parameters'], 'ratio': ratio, 'regression': ratio > 1 + tolerance})
+	return rows
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks of the simulation and prediction hot paths')
+	parser.add_argument('-k', dest='selection', action='append', help='only run the benchmarks whose name contains this')
+	parser.add_argument('--repeat', type=int, default=5, help='timed runs per case')
+	parser.add_argument('--output', help='JSON file in which the results are stored')
+	parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+	parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown reported as a regression')
+	arguments = parser.parse_args()
+
+	results = run_benchmarks(arguments.selection, arguments.repeat)
+	if arguments.output:
+		write_json(arguments.output, results)
+
+	if arguments.baseline:
+		with open(arguments.baseline) as baseline_file:
+			rows = compare(results, json.load(baseline_file), arguments.tolerance)
+		for row in rows:
+			print('{:<14} {:<45} {:>6.2f}x {}'.format(row['benchmark'], case_label(row['parameters']), row['ratio'], 'REGRESSION' if row['regression'] else ''))
+		if any(row['regression'] for row in rows):
+			sys.exit(1)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for checkpointing long simulation runs, so that an interrupted run (e.g. a preempted cluster job) resumes
+where it stopped instead of starting over. A checkpoint directory holds the per-step history of the simulation in
+preallocated memory-mapped .npy files, to which each checkpoint only writes the steps taken since the previous one, and
+a small state.json file with everything else the next steps depend on: the latest two steps (the moving rates depend
+on the previous locations), the reset schedule and adaptive step size state, the number of virtual locations pulled
+from streamed trajectory models, and the states of the result sink and of the online metrics, with the accumulated
+reset metrics. The state file is replaced atomically after the history is written, so a crash during a checkpoint
+leaves the previous one intact.
+
+A run is resumed by setting it up exactly as the interrupted one (same environment, seeds, users and sink directory)
+and restoring the checkpoint into it, after which it continues bit-identically to an uninterrupted run.
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import json
+import os
+import time
+import numpy as np
+from result_sink import write_json
+
+
+CHECKPOINT_FORMAT = 1
+
+# Per-step arrays of the Simulation stored in the history files
+HISTORY = ('positions', 'resets', 'step_lengths')
+
+
+# Checkpoints of a Simulation in directory, taken by update at most every interval seconds of wall time (see
+# Simulation.run) and by save whenever needed. elapsed is the wall time spent on the run in the earlier sessions.
+class Checkpoint:
+	def __init__(self, directory, interval=60.0):
+		self.directory = directory
+		self.interval = interval
+		self.state_path = os.path.join(directory, 'state.json')
+		self.history = None
+		self.saved_iter = None # Latest step stored in the history files
+		self.elapsed = 0.0
+		self.started = time.perf_counter()
+		self.last_save = self.started
+
+	@property
+	def exists(self):
+		return os.path.exists(self.state_path)
+
+	# Called by the simulation after every step, saves a checkpoint if the latest one is older than interval
+	def update(self, sim):
+		if time.perf_counter() - self.last_save >= self.interval:
+			self.save(sim)
+
+	def save(self, sim):
+		os.makedirs(self.directory, exist_ok=True)
+		if sim.keep_history:
+			history = self.open_history(sim)
+			start = 0 if self.saved_iter is None else self.saved_iter + 1
+			for name, array in history.items():
+				array[start:sim.time_iter + 1] = getattr(sim, name)[start:sim.time_iter + 1]
+				array.flush()
+
+		rows = [(sim.time_iter - 1) % len(sim.positions), sim.time_iter % len(sim.positions)]
+		schedule = sim.reset_schedule
+		state = {
+			'format': CHECKPOINT_FORMAT, 'time_iter': sim.time_iter, 'num_steps': sim.num_steps, 'num_users': len(sim.users),
+			'elapsed': self.elapsed + time.perf_counter() - self.started,
+			'latest': {name: getattr(sim, name)[rows].tolist() for name in HISTORY},
+			'reset_schedule': {'next_checks': schedule.next_checks.tolist(), 'next_bounds': schedule.next_bounds.tolist(),
+							   'backoffs': schedule.backoffs.tolist(), 'num_checks': schedule.num_checks},
+			'next_substeps': sim.next_substeps, 'substeps_backoff': sim.substeps_backoff,
+			'virtual_pulls': [user.virt_stream.count if user.virt_stream is not None else 0 for user in sim.users],
+			'sink': sim.sink.checkpoint_state() if sim.sink is not None else None,
+			'metrics': sim.metrics.checkpoint_state() if sim.metrics is not None else None,
+		}
+		write_json(self.state_path, state)
+		self.saved_iter = sim.time_iter
+		self.last_save = time.perf_counter()
+
+	# Memory-mapped (num_steps,...) history files, created with the first checkpoint of a run
+	def open_history(self, sim):
+		if self.history is None:
+			mode = 'w+' if self.saved_iter is None else 'r+'
+			self.history = {name: np.lib.format.open_memmap(os.path.join(self.directory, name + '.npy'), mode=mode,
+															 dtype=getattr(sim, name).dtype, shape=getattr(sim, name).shape)
+							for name in HISTORY}
+		return self.history
+
+	# Restores the latest checkpoint into sim, which has to be set up as the checkpointed simulation (same
+	# RedirectedWalker, users with the same initial locations and virtual paths or trajectory models and seeds, and a
+	# sink on the same directory opened with resume). Returns False if there is no checkpoint to resume from.
+	def restore(self, sim):
+		if not self.exists:
+			return False
+		with open(self.state_path) as state_file:
+			state = json.load(state_file)
+		if state['format'] != CHECKPOINT_FORMAT or state['num_steps'] != sim.num_steps or state['num_users'] != len(sim.users):
+			raise ValueError("The checkpoint in " + self.directory + " does not match the simulation")
+
+		time_iter = state['time_iter']
+		self.saved_iter = time_iter
+		rows = [(time_iter - 1) % len(sim.positions), time_iter % len(sim.positions)]
+		if sim.keep_history:
+			for name, array in self.open_history(sim).items():
+				getattr(sim, name)[:time_iter + 1] = array[:time_iter + 1]
+		else:
+			for name in HISTORY:
+				getattr(sim, name)[rows] = state['latest'][name]
+		sim.time_iter = time_iter
+
+		# Physical trajectories as stored by the simulation, virtual ones by pulling the same locations again
+		for index, user in enumerate(sim.users):
+			user.phy_locations.clear()
+			user.phy_locations.extend(sim.positions[:time_iter + 1, index] if sim.keep_history else sim.positions[rows, index])
+			if user.virt_stream is not None:
+				for pull in range(state['virtual_pulls'][index] - user.virt_stream.count):
+					user.advance_virtual_path()
+
+		schedule = sim.reset_schedule
+		for name in ('next_checks', 'next_bounds', 'backoffs'):
+			getattr(schedule, name)[...] = state['reset_schedule'][name]
+		schedule.num_checks = state['reset_schedule']['num_checks']
+		sim.next_substeps = state['next_substeps']
+		sim.substeps_backoff = state['substeps_backoff']
+
+		if sim.sink is not None:
+			sim.sink.restore(state['sink'])
+		if sim.metrics is not None:
+			sim.metrics.restore(state['metrics'])
+		self.elapsed = state['elapsed']
+		self.started = time.perf_counter()
+		self.last_save = self.started
+		return True
+
+
+# Resumes sim from the checkpoint in directory if there is one, and runs it to the end while checkpointing every
+# interval seconds. Returns the checkpoint, whose elapsed is the wall time of the earlier sessions.
+def resume(sim, directory, interval=60.0):
+	checkpoint = Checkpoint(directory, interval)
+	checkpoint.restore(sim)
+	sim.run(checkpoint)
+	return checkpoint
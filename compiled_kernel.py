@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library implementing a compiled step kernel. The complete step of the APF-RDW and APF-R algorithms (force vectors,
+moving rates, next physical steps and resets) is written as plain scalar loops over the users, mirroring the per-user
+methods of the RedirectedWalker, and compiled with Numba when it is installed. Without Numba, the simulation falls back
+to the NumPy kernel (see default_step_kernel), the loops then only run as plain Python for checking the parity.
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import math
+import numpy as np
+import simulation
+from user import User
+
+try:
+	import numba
+	jit = numba.njit(cache=True, error_model='numpy') # NaN/inf on division by zero, as in NumPy
+except ImportError:
+	numba = None
+	# Without Numba the kernel stays plain (slow) Python
+	def jit(function):
+		return function
+
+
+# Complete step of all users of B independent batches. Positions and previous are (B,U,2), has_history and speeds (B,U),
+# walls (W,2,2) and thresholds (B,U), the users with an infinite threshold not being checked for a reset. The (B,U,2)
+# steps and (B,U) reset flags are written into steps and resets. Rounding follows the reference implementation, except
+# for the dot products that np.dot may fuse, so results agree to a few ulps.
+@jit
+def compiled_steps(positions, previous, has_history, speeds, walls, gamma, delta_t, base_rate, max_move_rate,
+				   velocity_thresh, radius, scale_multiplier, t_a_norm, thresholds, steps, resets):
+	num_batches, num_users = positions.shape[0], positions.shape[1]
+	num_walls = walls.shape[0]
+	d_x = np.empty(num_walls)
+	d_y = np.empty(num_walls)
+	d_norm = np.empty(num_walls)
+
+	for b in range(num_batches):
+		for i in range(num_users):
+			p_x, p_y = positions[b, i, 0], positions[b, i, 1]
+
+			# Vectors from the nearest point of each wall, see get_vector_from_segment
+			for w in range(num_walls):
+				s_x, s_y = walls[w, 0, 0], walls[w, 0, 1]
+				e_x, e_y = walls[w, 1, 0] - s_x, walls[w, 1, 1] - s_y
+				t = ((p_x - s_x) * e_x + (p_y - s_y) * e_y) / (math.sqrt(e_x * e_x + e_y * e_y) ** 2)
+				if t < 0:
+					t = 0.0
+				elif t > 1:
+					t = 1.0
+				d_x[w] = p_x - (s_x + t * e_x)
+				d_y[w] = p_y - (s_y + t * e_y)
+				d_norm[w] = math.sqrt(d_x[w] * d_x[w] + d_y[w] * d_y[w])
+
+			# Equation 5
+			sum_distance = 0.0
+			for w in range(num_walls):
+				sum_distance += d_norm[w]
+			for j in range(num_users):
+				h_x, h_y = p_x - positions[b, j, 0], p_y - positions[b, j, 1]
+				sum_distance += math.sqrt(h_x * h_x + h_y * h_y)
+
+			# Equation 6, together with the reset check of reset_if_needed
+			threshold = thresholds[b, i]
+			check = threshold < math.inf
+			reset = False
+			env_x, env_y = 0.0, 0.0
+			for w in range(num_walls):
+				v_x = (d_x[w] / d_norm[w]) * (sum_distance / d_norm[w])
+				v_y = (d_y[w] / d_norm[w]) * (sum_distance / d_norm[w])
+				env_x += v_x
+				env_y += v_y
+				if check and math.sqrt(v_x * v_x + v_y * v_y) > threshold:
+					reset = True
+
+			# Equations 3 and 7
+			dir_x, dir_y = p_x - previous[b, i, 0], p_y - previous[b, i, 1]
+			dir_norm = math.sqrt(dir_x * dir_x + dir_y * dir_y)
+			users_x, users_y = 0.0, 0.0
+			for j in range(num_users):
+				if j == i:
+					continue
+				h_x, h_y = p_x - positions[b, j, 0], p_y - positions[b, j, 1]
+				h_norm = math.sqrt(h_x * h_x + h_y * h_y)
+				kappa = 0.0
+				if has_history[b, i]:
+					other_x, other_y = positions[b, j, 0] - previous[b, j, 0], positions[b, j, 1] - previous[b, j, 1]
+					cos_user = (-h_x * dir_x + -h_y * dir_y) / (h_norm * dir_norm)
+					cos_other = (h_x * other_x + h_y * other_y) / (h_norm * math.sqrt(other_x * other_x + other_y * other_y))
+					theta_user = 0.0 if abs(cos_user) > 1 else math.acos(cos_user)
+					theta_other = 0.0 if abs(cos_other) > 1 else math.acos(cos_other)
+					kappa = math.cos(theta_user) + math.cos(theta_other) / 2
+					if kappa < 0:
+						kappa = 0.0
+					elif kappa > 1:
+						kappa = 1.0
+				v_x = kappa * (h_x / h_norm) * (sum_distance / (h_norm * gamma))
+				v_y = kappa * (h_y / h_norm) * (sum_distance / (h_norm * gamma))
+				users_x += v_x
+				users_y += v_y
+				if check and math.sqrt(v_x * v_x + v_y * v_y) > threshold:
+					reset = True
+
+			# Equation 1
+			force_x, force_y = env_x + users_x, env_y + users_y
+			force_norm = math.sqrt(force_x * force_x + force_y * force_y)
+
+			if reset:
+				# Move towards force vector
+				steps[b, i, 0] = delta_t * force_x / force_norm
+				steps[b, i, 1] = delta_t * force_y / force_norm
+				resets[b, i] = True
+				continue
+			resets[b, i] = False
+
+			# Moving rate of calculate_max_rotations
+			linear_velocity = dir_norm / delta_t if has_history[b, i] else speeds[b, i]
+			moving_rate = linear_velocity / radius if linear_velocity >= velocity_thresh else 0.0
+
+			# Next physical step, see calculate_next_physical_step (the comparisons mirror the min/max of Rates)
+			user_dir = math.atan2(dir_y, dir_x) % (2 * math.pi)
+			desired_dir = math.atan2(force_y, force_x) % (2 * math.pi)
+			desired_rotation = (desired_dir - user_dir + math.pi) % (2 * math.pi) - math.pi
+
+			moving_rate = moving_rate * (force_norm * scale_multiplier / t_a_norm)
+			if max_move_rate < moving_rate:
+				moving_rate = max_move_rate
+			best_rate = (moving_rate if moving_rate > base_rate * delta_t else base_rate * delta_t) * delta_t
+
+			if best_rate >= abs(desired_rotation):
+				step_x, step_y = force_x, force_y
+			else:
+				possible_rotation = user_dir - best_rate if desired_rotation < 0 else user_dir + best_rate
+				step_x, step_y = math.cos(possible_rotation), math.sin(possible_rotation)
+			step_norm = math.sqrt(step_x * step_x + step_y * step_y)
+			steps[b, i, 0] = delta_t * step_x / step_norm
+			steps[b, i, 1] = delta_t * step_y / step_norm
+
+
+# Same interface as RedirectedWalker.calculate_steps, for (...,U,2) positions with any leading dimensions
+def calculate_steps(rdw, positions, previous, threshold, has_history=None, speeds=1.0):
+	positions = np.asarray(positions, dtype=float)
+	shape = positions.shape
+	has_history = np.ones(shape[:-1], dtype=bool) if has_history is None else has_history
+
+	steps = np.empty((int(np.prod(shape[:-2], dtype=int)),) + shape[-2:])
+	resets = np.empty(steps.shape[:-1], dtype=bool)
+	compiled_steps(positions.reshape(steps.shape), np.asarray(previous, dtype=float).reshape(steps.shape),
+				   np.broadcast_to(has_history, shape[:-1]).reshape(resets.shape),
+				   np.broadcast_to(np.asarray(speeds, dtype=float), shape[:-1]).reshape(resets.shape),
+				   rdw.walls, float(rdw.gamma), float(rdw.delta_t), float(rdw.base_rate), float(rdw.max_move_rate),
+				   float(rdw.velocity_thresh), float(rdw.radius), float(rdw.scale_multiplier), float(rdw.t_a_norm),
+				   np.broadcast_to(np.asarray(threshold, dtype=float), shape[:-1]).reshape(resets.shape), steps, resets)
+	return steps.reshape(shape), resets.reshape(shape[:-1])
+
+
+# Step kernel for the Simulation (see simulation.reference_step). The approximations of the RedirectedWalker (wall index,
+# wall field, user index) are not compiled, with any of them the NumPy kernel is used instead.
+def compiled_step(rdw, users, threshold):
+	if rdw.wall_index is not None or rdw.wall_field is not None or rdw.user_index is not None:
+		return simulation.vectorized_step(rdw, users, threshold)
+	positions = np.array([user.get_phy_loc() for user in users])
+	previous = np.array([user.get_phy_loc(-1) for user in users])
+	return calculate_steps(rdw, positions, previous, threshold)
+
+compiled_step.batched_resets = True # See simulation.ResetSchedule
+
+
+# Fastest step kernel available: the compiled one if Numba is installed, the NumPy one otherwise
+def default_step_kernel():
+	return compiled_step if numba is not None else simulation.vectorized_step
+
+
+# Compares the compiled kernel to the reference implementation (simulation.reference_step, which runs the per-user
+# methods of the original simulation loop) on num_checks random states of num_users users within the environment of
+# rdw. Returns the largest absolute difference between the steps and the number of differing reset decisions.
+def check_parity(rdw, num_users, threshold, num_checks=100, rng=None):
+	rng = np.random.default_rng(rng)
+	lower = np.min(rdw.walls, axis=(0, 1))
+	upper = np.max(rdw.walls, axis=(0, 1))
+
+	max_difference = 0.0
+	reset_mismatches = 0
+	for check in range(num_checks):
+		previous = rng.uniform(lower, upper, size=(num_users, 2))
+		positions = previous + rng.normal(0, rdw.delta_t, size=(num_users, 2))
+		users = []
+		for identity in range(num_users):
+			user = User(previous[identity], 1.0, identity + 1)
+			user.phy_locations.append(positions[identity])
+			users.append(user)
+
+		reference_steps, reference_resets = simulation.reference_step(rdw, users, threshold)
+		steps, resets = calculate_steps(rdw, positions, previous, threshold)
+		max_difference = max(max_difference, float(np.max(np.abs(steps - reference_steps))))
+		reset_mismatches += int(np.count_nonzero(resets != reference_resets))
+
+	return max_difference, reset_mismatches
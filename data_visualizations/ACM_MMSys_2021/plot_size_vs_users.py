@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Regenerates the figures of the data_users_*.py scripts (resets, distances between resets and prediction errors per user,
+and execution times, for each size of the squared environment) from the stored results of a sweep over env_size and
+num_users, e.g. the one of examples/acm_mmsys_size_vs_users_full.py. Without stored results, the data_users_*.py files
+are converted once into the same format (see results.convert_legacy_results), next to this script.
+
+Usage: python plot_size_vs_users.py [sweep directory]
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0,parentdir)
+
+import matplotlib.pyplot as plt
+import numpy as np
+import results
+
+# Limits of the y axes of the resets and distances, per environment size
+resets_limits = {5.0: [500, 800], 7.5: [200, 600], 10.0: [200, 450], 12.5: [100, 400]}
+distance_limits = {5.0: [0, 10], 7.5: [0, 15], 10.0: [0, 30], 12.5: [0, 100], 15.0: [0, 400]}
+color = "#045a8d"
+
+legacy_files = {5.0: 'data_users_5x5.py', 7.5: 'data_users_7.5x7.5.py', 10.0: 'data_users_10x10.py',
+				12.5: 'data_users_12.5x12.5.py', 15.0: 'data_users_15x15.py'}
+
+
+# Loads the sweep from the given directory, or converts the legacy results files if there is none
+def load_sweep(directory=None):
+	if directory is not None:
+		return results.open_sweep(directory)
+	directory = os.path.join(currentdir, 'results_size_vs_users')
+	if os.path.exists(os.path.join(directory, 'sweep.json')):
+		return results.open_sweep(directory)
+	return results.convert_legacy_results({size: os.path.join(currentdir, name) for size, name in legacy_files.items()}, directory)
+
+
+# Resets, distances between resets and prediction errors per user, for all numbers of users in one environment size
+def plot_size(env_size, cells, runs):
+	fig = plt.figure()
+	label = ('%g' % env_size) + 'x' + ('%g' % env_size)
+
+	# Users of the same experiment are next to each other, experiments are separated by an empty position
+	positions = []
+	ticks = []
+	for run in runs:
+		start = positions[-1] + 2 if positions else 1
+		positions.append(start)
+		positions += list(range(start + 1, start + run['num_users']))
+		ticks.append(start + (run['num_users'] - 1) / 2)
+	positions = np.array(positions)
+
+	ax1 = plt.subplot(311)
+	plt.bar(positions, np.concatenate([results.resets_per_user(run) for run in runs]), width=0.8, facecolor=color)
+	if env_size in resets_limits:
+		plt.ylim(resets_limits[env_size])
+	plt.ylabel("# resets", fontsize=12)
+	plt.title("Squared environment, " + label + " m$^2$", fontsize=12)
+	plt.grid()
+
+	for subplot, name, limits, ylabel in ((312, 'distances', distance_limits.get(env_size), "Distance [m]"),
+										  (313, 'mse', [0, .05], "MSE [m$^2$]")):
+		ax = plt.subplot(subplot, sharex = ax1)
+		stats = [stat for run in runs for stat in results.box_stats(run, name)]
+		if len(stats) == len(positions):
+			box = ax.bxp(stats, positions = positions, shownotches=True, patch_artist=True)
+			plt.setp(box["boxes"], facecolor=color)
+			plt.setp(box["fliers"], markeredgecolor=color)
+		if limits is not None:
+			plt.ylim(limits)
+		plt.ylabel(ylabel, fontsize=12)
+		plt.grid()
+
+	for ax in fig.get_axes():
+		ax.label_outer()
+
+	plt.xlabel("Number of users", fontsize=12)
+	plt.yticks(fontsize=10)
+	plt.xticks(ticks, [str(cell['parameters']['num_users']) for cell in cells], fontsize=10)
+	plt.show()
+
+
+# Execution times without and with the short-term predictions, for all numbers of users in one environment size
+def plot_time(env_size, table):
+	plt.figure()
+	label = ('%g' % env_size) + 'x' + ('%g' % env_size)
+	positions = 2 * np.arange(len(table)) + 1
+
+	box1 = plt.bar(positions, table['time'], width=0.8)
+	box2 = plt.bar(positions + 1, table['time_full'], width=0.8)
+
+	plt.title('Execution time (' + label + ' m^2)', fontsize=12)
+	plt.ylabel('Exec. time [sec]', fontsize=12)
+	plt.xlabel('Number of users', fontsize=12)
+	plt.xticks(positions + 0.5, [str(num_users) for num_users in table['num_users']], fontsize=10)
+	plt.legend((box1[0], box2[0]), ('Without short-term prediction', 'With short-term prediction'), fontsize=12)
+
+	plt.grid()
+	plt.show()
+
+
+if __name__ == '__main__':
+	sweep = load_sweep(sys.argv[1] if len(sys.argv) > 1 else None)
+	runs = results.open_cells(sweep)
+	table = results.aggregate_sweep(sweep)
+
+	for env_size in sorted(set(table['env_size'])):
+		rows = [row for row in np.flatnonzero(table['env_size'] == env_size)]
+		rows.sort(key=lambda row: table['num_users'][row])
+		plot_size(env_size, [sweep['cells'][row] for row in rows], [runs[row] for row in rows])
+		plot_time(env_size, table[rows])
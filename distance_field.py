@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for precomputing the wall terms of the APF-RDW force field on a grid. Environments do not change during a run,
+so the signed distance to the nearest wall, the direction away from it, the sum of the distances to all walls
+(Equation 5) and the sum of the per-wall vectors d/|d|^2 (Equation 6, up to the sum of distances) are rasterized once
+per environment at a configurable resolution and interpolated bilinearly, which gives the wall terms in O(1) per user.
+Fields can be cached on disk, since building them costs one exact evaluation per grid node.
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import hashlib
+import math
+import os
+import tempfile
+import numpy as np
+import environment
+from algorithm import batched_norm, get_vectors_from_segments
+
+
+FIELD_FORMAT = 2 # Bump to invalidate all cached fields when the channels change
+
+# Channels of the field: signed distance to the nearest wall (positive inside the environment), unit vector pointing
+# away from the nearest wall, sum of the distances to all walls and sum of d/|d|^2 over all walls
+DISTANCE, DIRECTION, SUM_DISTANCE, ENV_FORCE = 0, slice(1, 3), 3, slice(4, 6)
+NUM_CHANNELS = 6
+
+
+# Field of the (W,2,2) walls on a grid with the given resolution (in meters), covering the bounds of the walls extended
+# by margin. Points outside the grid and points closer than exact_within to a wall (two cell diagonals by default, where
+# the 1/|d| terms are too steep to interpolate) are evaluated exactly.
+class DistanceField:
+	def __init__(self, walls, resolution=0.1, margin=1.0, exact_within=None, values=None):
+		self.walls = np.asarray(walls, dtype=float).reshape(-1, 2, 2)
+		self.resolution = resolution
+		self.margin = margin
+		self.exact_within = 2 * resolution * math.sqrt(2) if exact_within is None else exact_within
+
+		self.lower = np.min(self.walls, axis=(0, 1)) - margin
+		upper = np.max(self.walls, axis=(0, 1)) + margin
+		self.shape = np.ceil((upper - self.lower) / resolution).astype(int) # Number of cells along x and y
+
+		if values is None:
+			x = self.lower[0] + np.arange(self.shape[0] + 1) * resolution
+			y = self.lower[1] + np.arange(self.shape[1] + 1) * resolution
+			nodes = np.stack(np.meshgrid(x, y, indexing='ij'), axis=-1).reshape(-1, 2)
+			values = np.concatenate([self.exact(nodes[block:block + 4096]) for block in range(0, len(nodes), 4096)])
+		self.values = values.reshape(self.shape[0] + 1, self.shape[1] + 1, NUM_CHANNELS)
+
+	# Loads the field of the walls from the cache directory, or builds it and stores it there
+	@classmethod
+	def cached(cls, walls, directory, resolution=0.1, margin=1.0, exact_within=None):
+		walls = np.asarray(walls, dtype=float).reshape(-1, 2, 2)
+		fingerprint = hashlib.sha256(str((FIELD_FORMAT, resolution, margin)).encode())
+		fingerprint.update(np.ascontiguousarray(walls).tobytes())
+		path = os.path.join(directory, fingerprint.hexdigest() + '.npy')
+
+		if os.path.exists(path):
+			return cls(walls, resolution, margin, exact_within, values=np.load(path))
+
+		field = cls(walls, resolution, margin, exact_within)
+		os.makedirs(directory, exist_ok=True)
+		# Written to a temporary file first, so that concurrent sweep workers never load a partial field
+		handle, temporary = tempfile.mkstemp(dir=directory, suffix='.npy')
+		with os.fdopen(handle, 'wb') as field_file:
+			np.save(field_file, field.values)
+		os.replace(temporary, path)
+		return field
+
+	# Exact channels at the (...,2) points, computed over all walls (with plain element-wise arithmetic, which is much
+	# faster than the batched helpers of the algorithm for the millions of node-wall pairs of a large environment)
+	def exact(self, points):
+		points = np.asarray(points, dtype=float)
+		values = np.empty(points.shape[:-1] + (NUM_CHANNELS,))
+		x = points[..., 0, None]
+		y = points[..., 1, None]
+		s1 = self.walls[:, 0]
+		wall = self.walls[:, 1] - s1
+		with np.errstate(divide='ignore', invalid='ignore'):
+			t = np.clip(((x - s1[:, 0]) * wall[:, 0] + (y - s1[:, 1]) * wall[:, 1]) / (wall[:, 0] ** 2 + wall[:, 1] ** 2), 0, 1)
+			d_x = x - (s1[:, 0] + t * wall[:, 0])
+			d_y = y - (s1[:, 1] + t * wall[:, 1])
+			d_norm = np.sqrt(d_x ** 2 + d_y ** 2)
+			nearest = np.argmin(d_norm, axis=-1)[..., None]
+			distance = np.take_along_axis(d_norm, nearest, axis=-1)[..., 0]
+			values[..., DISTANCE] = np.where(environment.are_inside(self.walls, points), distance, -distance)
+			values[..., 1] = np.take_along_axis(d_x, nearest, axis=-1)[..., 0] / distance
+			values[..., 2] = np.take_along_axis(d_y, nearest, axis=-1)[..., 0] / distance
+			values[..., SUM_DISTANCE] = np.sum(d_norm, axis=-1)
+			values[..., 4] = np.sum(d_x / d_norm ** 2, axis=-1)
+			values[..., 5] = np.sum(d_y / d_norm ** 2, axis=-1)
+		return values
+
+	# Channels at the (...,2) points, interpolated bilinearly between the grid nodes (or exact, see above)
+	def sample(self, points):
+		points = np.asarray(points, dtype=float)
+		position = (points - self.lower) / self.resolution
+		cell = np.clip(np.floor(position).astype(int), 0, self.shape - 1)
+		t = (position - cell)[..., None]
+		i, j = cell[..., 0], cell[..., 1]
+
+		values = ((1 - t[..., 0, :]) * ((1 - t[..., 1, :]) * self.values[i, j] + t[..., 1, :] * self.values[i, j + 1])
+				  + t[..., 0, :] * ((1 - t[..., 1, :]) * self.values[i + 1, j] + t[..., 1, :] * self.values[i + 1, j + 1]))
+
+		exact = np.any((position < 0) | (position > self.shape), axis=-1) | ~(np.abs(values[..., DISTANCE]) >= self.exact_within)
+		if np.any(exact):
+			values[exact] = self.exact(points[exact])
+		with np.errstate(invalid='ignore'):
+			values[..., DIRECTION] /= batched_norm(values[..., DIRECTION])[..., None]
+		return values
+
+	# Wall terms of the force field at the (...,2) points: the unsigned distance to the nearest wall, the (...,2) unit
+	# vector pointing away from it, the sum of the distances to all walls and the (...,2) sum of d/|d|^2 over all walls
+	def env_terms(self, points):
+		values = self.sample(points)
+		return np.abs(values[..., DISTANCE]), values[..., DIRECTION], values[..., SUM_DISTANCE], values[..., ENV_FORCE]
+
+	# Accuracy of the field against the exact computation at num_points random points inside the environment. The
+	# interpolated distance (and the sum of distances) are Lipschitz with constant 1 (W), so their error is at most half
+	# a cell diagonal (W times that). The force term is only compared empirically, relative to the sum of 1/|d| over
+	# all walls (the magnitude it would have without any cancellation between opposite walls).
+	def error_report(self, num_points=10000, rng=None):
+		rng = np.random.default_rng(rng)
+		points = rng.uniform(np.min(self.walls, axis=(0, 1)), np.max(self.walls, axis=(0, 1)), size=(num_points, 2))
+		points = points[environment.are_inside(self.walls, points)]
+
+		sampled = self.sample(points)
+		exact = self.exact(points)
+		interpolated = np.abs(exact[:, DISTANCE]) >= self.exact_within # Points mostly not handled by the exact fallback
+		cos = np.clip(np.sum(sampled[:, DIRECTION] * exact[:, DIRECTION], axis=-1), -1, 1)
+		scale = np.sum(1 / batched_norm(get_vectors_from_segments(points[:, None, :], self.walls[:, 0], self.walls[:, 1])), axis=-1)
+		force_error = batched_norm(sampled[:, ENV_FORCE] - exact[:, ENV_FORCE]) / scale
+
+		return {
+			'resolution': self.resolution,
+			'num_points': len(points),
+			'exact_fraction': 1 - np.mean(interpolated),
+			'distance_bound': self.resolution * math.sqrt(2) / 2,
+			'max_distance_error': np.max(np.abs(sampled[:, DISTANCE] - exact[:, DISTANCE]), initial=0),
+			'sum_distance_bound': len(self.walls) * self.resolution * math.sqrt(2) / 2,
+			'max_sum_distance_error': np.max(np.abs(sampled[:, SUM_DISTANCE] - exact[:, SUM_DISTANCE]), initial=0),
+			# The direction flips across the medial axis (points equally far from two walls), so the maximum is up to pi
+			'mean_direction_error': np.mean(np.arccos(cos)) if len(points) else 0.0, # radians
+			'max_relative_force_error': np.max(force_error, initial=0),
+			'mean_relative_force_error': np.mean(force_error) if len(points) else 0.0,
+		}
@@ -3,7 +3,8 @@
 
 """
 Library for defining the shape and size of an environment. Each environment has to be a bounded shape 
-and is defined by the end points of the shape.
+and is defined by the end points of the shape. Environments can have holes (pillars, furniture, partition walls) and
+can be loaded from a simple text format, see load_environment.
 """
 
 __author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
@@ -45,45 +46,131 @@ def define_rectangle(x_size, y_size):
 	return env
 
 
+# Creates an environment bounded by the given polygon, with the given holes (pillars, furniture, ...) inside it. The
+# outline and each hole are lists of (x,y) vertices, the polygons are closed automatically. A "hole" with only two
+# vertices is a single free-standing wall (e.g. a partition).
+def define_polygon(vertices, holes = ()):
+
+	env = []
+	for polygon in [vertices] + list(holes):
+		points = [np.array(point, dtype=float) for point in polygon]
+		if len(points) == 2:
+			env.append([points[0], points[1]])
+			continue
+		for start, stop in zip(points, points[1:] + points[:1]):
+			env.append([start, stop])
+
+	return env
+
+
+# Axis aligned box of the given size centered at (x,y), as a hole of define_polygon
+def define_box(x, y, x_size, y_size):
+	return [[x + x_size / 2, y + y_size / 2], [x + x_size / 2, y - y_size / 2], [x - x_size / 2, y - y_size / 2], [x - x_size / 2, y + y_size / 2]]
+
+
+# Creates an L-shaped environment: an x_size by y_size rectangle centered at (0,0), with the cut_x by cut_y corner at
+# its upper right removed
+def define_l_shape(x_size, y_size, cut_x, cut_y):
+
+	x, y = x_size / 2, y_size / 2
+	return define_polygon([[x, y - cut_y], [x, -y], [-x, -y], [-x, y], [x - cut_x, y], [x - cut_x, y - cut_y]])
+
+
+# Creates a warehouse-like environment: an x_size by y_size hall centered at (0,0) with rows x columns of shelves in
+# it, each shelf being a shelf_x by shelf_y box, evenly spread over the hall. Yields 4 * (rows * columns + 1) walls.
+def define_warehouse(x_size, y_size, rows, columns, shelf_x, shelf_y):
+
+	xs = (np.arange(columns) + 0.5) * x_size / columns - x_size / 2
+	ys = (np.arange(rows) + 0.5) * y_size / rows - y_size / 2
+	shelves = [define_box(x, y, shelf_x, shelf_y) for y in ys for x in xs]
+
+	return define_polygon(define_box(0, 0, x_size, y_size), shelves)
+
+
+# Loads an environment from a text file. Polygons are given as blocks of "x, y" lines separated by blank lines, the
+# first block being the outline of the environment and the following ones its holes (see define_polygon). Lines
+# starting with # are comments.
+def load_environment(path):
+
+	polygons = [[]]
+	with open(path) as env_file:
+		for line in env_file:
+			line = line.split('#')[0].strip()
+			if not line:
+				if polygons[-1]:
+					polygons.append([])
+				continue
+			polygons[-1].append([float(value) for value in line.replace(',', ' ').split()])
+	polygons = [polygon for polygon in polygons if polygon]
+
+	return define_polygon(polygons[0], polygons[1:])
+
+
+# Returns a boolean (W,) mask of the walls that lie on closed rings (the outline and the holes). Open walls, e.g. the
+# 2-vertex partitions of define_polygon, bound no area and are found by repeatedly dropping the walls with an end-point
+# that no other remaining wall shares.
+def ring_walls(env):
+
+	walls = np.asarray(env, dtype=float).reshape(-1, 2, 2)
+	_, ends = np.unique(walls.reshape(-1, 2), axis=0, return_inverse=True)
+	ends = ends.reshape(-1, 2)
+	on_ring = np.ones(len(walls), dtype=bool)
+	while True:
+		degree = np.bincount(ends[on_ring].ravel(), minlength=np.max(ends, initial=-1) + 1)
+		dangling = on_ring & np.any(degree[ends] < 2, axis=1)
+		if not np.any(dangling):
+			return on_ring
+		on_ring &= ~dangling
+
+
+# Checks whether the point is inside the environment (i.e., inside its outline and outside its holes), by counting
+# the ring walls crossed by a horizontal ray from the point (even-odd rule). Open walls are ignored, see ring_walls.
+def is_inside(env, point):
+	return bool(are_inside(env, point))
+
+
+# Vectorized is_inside for (...,2) points, returns a boolean (...) array
+def are_inside(env, points):
+
+	walls = np.asarray(env, dtype=float).reshape(-1, 2, 2)
+	walls = walls[ring_walls(walls)]
+	points = np.asarray(points, dtype=float)[..., None, :]
+	s1 = walls[:, 0]
+	s2 = walls[:, 1]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		crossing = (s1[:, 1] > points[..., 1]) != (s2[:, 1] > points[..., 1])
+		x_cross = s1[:, 0] + (points[..., 1] - s1[:, 1]) * (s2[:, 0] - s1[:, 0]) / (s2[:, 1] - s1[:, 1])
+	return np.count_nonzero(crossing & (x_cross > points[..., 0]), axis=-1) % 2 == 1
+
+
 # The ones below are used for relatively specialized problems discussed in [].
 
-# Creates a relatively unstructured environment  
+# Creates a relatively unstructured environment: a rectangular room with a pillar in its center
 def define_weirdness_1(x_size, y_size):
 
-	p1 = [np.array([ x_size / 2,  y_size / 2]), np.array([ x_size / 2, -y_size / 2])]
-	p2 = [np.array([ x_size / 2, -y_size / 2]), np.array([-x_size / 2, -y_size / 2])]
-	p3 = [np.array([-x_size / 2, -y_size / 2]), np.array([-x_size / 2,  y_size / 2])]
-	p4 = [np.array([-x_size / 2,  y_size / 2]), np.array([ x_size / 2,  y_size / 2])]
-
-	# Environment is defined with a set of straight walls, where each wall is defined by its end-points
-	env = [p1, p2, p3, p4]
+	pillar = define_box(0, 0, x_size / 10, y_size / 10)
 
-	return env
+	return define_polygon(define_box(0, 0, x_size, y_size), [pillar])
 
 
-# Creates a relatively unstructured environment  
+# Creates a relatively unstructured environment: an L-shaped room (the upper right quarter is missing) with a
+# partition wall in its lower left part
 def define_weirdness_2(x_size, y_size):
 
-	p1 = [np.array([ x_size / 2,  y_size / 2]), np.array([ x_size / 2, -y_size / 2])]
-	p2 = [np.array([ x_size / 2, -y_size / 2]), np.array([-x_size / 2, -y_size / 2])]
-	p3 = [np.array([-x_size / 2, -y_size / 2]), np.array([-x_size / 2,  y_size / 2])]
-	p4 = [np.array([-x_size / 2,  y_size / 2]), np.array([ x_size / 2,  y_size / 2])]
-
-	# Environment is defined with a set of straight walls, where each wall is defined by its end-points
-	env = [p1, p2, p3, p4]
+	env = define_l_shape(x_size, y_size, x_size / 2, y_size / 2)
+	env.append([np.array([-x_size / 2, -y_size / 4]), np.array([-x_size / 4, -y_size / 4])])
 
 	return env
 
 
-# Creates a relatively unstructured environment  
+# Creates a relatively unstructured environment: a rectangular room furnished with tables of various sizes
 def define_weirdness_3(x_size, y_size):
 
-	p1 = [np.array([ x_size / 2,  y_size / 2]), np.array([ x_size / 2, -y_size / 2])]
-	p2 = [np.array([ x_size / 2, -y_size / 2]), np.array([-x_size / 2, -y_size / 2])]
-	p3 = [np.array([-x_size / 2, -y_size / 2]), np.array([-x_size / 2,  y_size / 2])]
-	p4 = [np.array([-x_size / 2,  y_size / 2]), np.array([ x_size / 2,  y_size / 2])]
-
-	# Environment is defined with a set of straight walls, where each wall is defined by its end-points
-	env = [p1, p2, p3, p4]
+	furniture = [
+		define_box(-x_size / 4,  y_size / 4, x_size / 8, y_size / 12),
+		define_box( x_size / 4,  y_size / 5, x_size / 12, y_size / 6),
+		define_box(-x_size / 5, -y_size / 4, x_size / 6, y_size / 10),
+		define_box( x_size / 4, -y_size / 4, x_size / 10, y_size / 10),
+	]
 
-	return env
\ No newline at end of file
+	return define_polygon(define_box(0, 0, x_size, y_size), furniture)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for running the RedirectedWalker live, in front of a tracking system instead of precomputed trajectories.
+The LiveEngine consumes position updates of the users as they arrive (from a TCP connection or an asyncio queue),
+and at every tick computes the steering and reset decisions of all tracked users from their latest locations and
+publishes them back. Ticks are scheduled at a fixed rate. A tick that overruns its latency budget makes the next one
+reuse the latest force vectors without checking for resets, as the predictor of the adaptive time-stepping does (see
+RedirectedWalker.calculate_macro_steps), but never two ticks in a row. Ticks that are already over when the engine gets to them are skipped, so
+that decisions are always made on the newest locations instead of queueing up. The latency of every tick is
+summarized online (see online_metrics) and reported as percentiles.
+
+Messages are JSON objects, one per line. The tracker sends {"user": identity, "t": time, "position": [x, y]} for
+every update of a user. The engine answers every tick with {"tick": n, "t": time, "compute": seconds, "decisions":
+[{"user": identity, "stale": false, "rotation": radians, "direction": [x, y], "reset": bool}, ...]}. The rotation is
+the signed angle between the latest heading of the user and the steered walking direction, a unit vector. Users
+without any update since the previous tick are not steered, their decision is {"user": identity, "stale": true,
+"reset": false}. A ReplayTracker serving recorded paths stands in for the tracking system.
+
+Usage: python live.py [--users 4] [--rate 10] [--duration 30] [--budget 0.02] [--tracker host:port]
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import algorithm
+import environment
+import simulation
+from online_metrics import StreamingDistribution
+from sweep import MMSYS_PARAMETERS
+
+
+LATENCY_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+LATENCY_EDGES = np.geomspace(1e-5, 1.0, 51) # Histogram bins of the latencies, in seconds
+
+
+def encode(message):
+	return (json.dumps(message) + '\n').encode()
+
+# Messages read from a stream, until the connection is closed
+async def read_messages(reader):
+	while True:
+		line = await reader.readline()
+		if not line:
+			return
+		yield json.loads(line)
+
+# Messages taken from an asyncio queue, until None is put into it
+async def queue_messages(queue):
+	while True:
+		message = await queue.get()
+		if message is None:
+			return
+		yield message
+
+
+# Live steering of the users with the given identities, at tick_rate ticks per second (rdw.steps_per_second by
+# default, the rates of the RedirectedWalker assume one tick per delta_t). The latency budget of a tick (half of its
+# period by default) is measured from its scheduled time until its decisions are published.
+class LiveEngine:
+	def __init__(self, rdw, identities, threshold, tick_rate=None, latency_budget=None):
+		self.rdw = rdw
+		self.identities = list(identities)
+		self.index = {identity: index for index, identity in enumerate(self.identities)}
+		self.threshold = threshold
+		self.tick_rate = tick_rate or rdw.steps_per_second
+		self.period = 1.0 / self.tick_rate
+		self.latency_budget = self.period / 2 if latency_budget is None else latency_budget
+
+		self.positions = np.full((len(self.identities), 2), np.nan) # Latest tracked location of each user
+		self.latest = np.full((len(self.identities), 2), np.nan) # Location of each user at its latest decision
+		self.previous = np.full((len(self.identities), 2), np.nan) # Location of each user at the decision before
+		self.user_updates = np.zeros(len(self.identities), dtype=int) # Number of updates received for each user
+		self.decided_updates = np.zeros(len(self.identities), dtype=int) # Number of them at its latest decision
+		self.force_vectors = None # Force vectors of the latest full tick, and the users they were computed for
+		self.force_users = None
+		self.late = False # Whether the previous tick overran its latency budget
+		self.held = False # Whether the previous tick reused the force vectors
+		self.tick = 0
+		self.num_updates = 0
+		self.num_overruns = 0
+		self.num_held = 0
+		self.num_skipped = 0
+		self.latency = StreamingDistribution(1, LATENCY_EDGES, LATENCY_QUANTILES)
+		self.compute = StreamingDistribution(1, LATENCY_EDGES, LATENCY_QUANTILES)
+
+	# Stores a position update, updates of unknown users are ignored
+	def receive(self, update):
+		index = self.index.get(update['user'])
+		if index is not None:
+			self.positions[index] = update['position']
+			self.user_updates[index] += 1
+			self.num_updates += 1
+
+	# Steering and reset decisions of all tracked users for the current tick, with the batched methods of the
+	# RedirectedWalker. Users tracked for the first time have no heading yet and are treated as in the first step of a
+	# simulation (see calculate_force_field). Stale users, without any update since the previous tick, still repel the
+	# others from their latest location and keep their latest heading, but are not steered or reset.
+	def decide(self):
+		rdw = self.rdw
+		tracked = ~np.isnan(self.positions[:, 0])
+		updated = self.user_updates > self.decided_updates
+		self.previous[updated] = self.latest[updated]
+		self.latest[updated] = self.positions[updated]
+		self.decided_updates[updated] = self.user_updates[updated]
+		stale = ~updated[tracked]
+		positions = self.latest[tracked]
+		has_history = ~np.isnan(self.previous[tracked, 0])
+		previous = np.where(has_history[:, None], self.previous[tracked], positions)
+
+		# After an overrun, one tick reuses the latest force vectors (and skips the reset checks) to catch up
+		self.held = self.late and not self.held and self.force_users is not None and np.array_equal(tracked, self.force_users)
+		if self.held:
+			force_vectors = self.force_vectors
+			resets = np.zeros(len(positions), dtype=bool)
+			self.num_held += 1
+		else:
+			force_vectors, env_vectors, user_vectors = algorithm.calculate_force_field(positions, previous, rdw.walls, rdw.gamma, has_history,
+																					   rdw.wall_index, rdw.wall_field, rdw.user_index)
+			resets = rdw.resets_needed(env_vectors, user_vectors, self.threshold) & ~stale
+			self.force_vectors = force_vectors
+			self.force_users = tracked
+
+		moving_rates = rdw.calculate_moving_rates(positions, previous, has_history)
+		steps = rdw.calculate_next_physical_steps(positions, previous, moving_rates, force_vectors)
+		with np.errstate(invalid='ignore'):
+			directions = np.where(resets[:, None], force_vectors / algorithm.batched_norm(force_vectors)[:, None], steps / rdw.delta_t)
+		heading = positions - previous
+		rotations = np.where(has_history, np.arctan2(heading[:, 0] * directions[:, 1] - heading[:, 1] * directions[:, 0],
+													 algorithm.batched_dot(heading, directions)), 0.0)
+
+		self.tick += 1
+		identities = [self.identities[index] for index in np.flatnonzero(tracked)]
+		return {'tick': self.tick, 'decisions': [{'user': identity, 'stale': True, 'reset': False} if is_stale else
+												 {'user': identity, 'stale': False, 'rotation': float(rotation), 'direction': direction.tolist(), 'reset': bool(reset)}
+												 for identity, is_stale, rotation, direction, reset in zip(identities, stale, rotations, directions, resets)]}
+
+	async def consume(self, updates):
+		async for update in updates:
+			self.receive(update)
+
+	# Runs the ticks until the updates end (or num_ticks ticks were published). Updates is an async iterator of
+	# position updates (see read_messages and queue_messages), publish an async function taking the message of a tick.
+	async def run(self, updates, publish, num_ticks=None):
+		loop = asyncio.get_running_loop()
+		receiver = asyncio.ensure_future(self.consume(updates))
+		start = loop.time()
+		try:
+			while not receiver.done() and (num_ticks is None or self.tick < num_ticks):
+				deadline = start + (self.tick + self.num_skipped + 1) * self.period
+				await asyncio.sleep(max(deadline - loop.time(), 0.0))
+				if not np.any(~np.isnan(self.positions[:, 0])):
+					self.num_skipped += 1
+					continue
+
+				compute_start = time.perf_counter()
+				message = self.decide()
+				message['t'] = deadline - start
+				message['compute'] = time.perf_counter() - compute_start
+				await publish(message)
+
+				latency = loop.time() - deadline
+				self.latency.update(np.zeros(1, dtype=int), [latency])
+				self.compute.update(np.zeros(1, dtype=int), [message['compute']])
+				self.late = latency > self.latency_budget
+				self.num_overruns += self.late
+				self.num_skipped += int((loop.time() - deadline) // self.period)
+		finally:
+			receiver.cancel()
+		return self.report()
+
+	# Counters of the session and percentiles of the tick latencies and compute times, in seconds
+	def report(self):
+		latency = self.latency.summary()
+		compute = self.compute.summary()
+		report = {'ticks': self.tick, 'updates': self.num_updates, 'overruns': self.num_overruns, 'held': self.num_held,
+				  'skipped': self.num_skipped, 'tick_rate': self.tick_rate, 'latency_budget': self.latency_budget,
+				  'latency_max': latency['max'][0], 'compute_max': compute['max'][0]}
+		for quantile, latency_estimate, compute_estimate in zip(LATENCY_QUANTILES, latency['quantile_estimates'][0], compute['quantile_estimates'][0]):
+			report['latency_p' + ('%g' % (100 * quantile))] = latency_estimate
+			report['compute_p' + ('%g' % (100 * quantile))] = compute_estimate
+		return report
+
+
+# Connects the engine to a tracker at host:port, reading the updates from and writing the decisions to the connection
+async def run_tcp(engine, host, port, num_ticks=None):
+	reader, writer = await asyncio.open_connection(host, port)
+
+	async def publish(message):
+		writer.write(encode(message))
+		await writer.drain()
+
+	try:
+		return await engine.run(read_messages(reader), publish, num_ticks)
+	finally:
+		writer.close()
+		await writer.wait_closed()
+
+
+# Stand-in for a tracking system: a TCP server sending the (N,U,2) recorded paths of the users with the given
+# identities (1..U by default) at rate updates per second to every client, one message per user and update, and
+# collecting the messages sent back. The paths are replayed as recorded, the decisions do not change them.
+class ReplayTracker:
+	def __init__(self, paths, identities=None, rate=10.0):
+		self.paths = np.asarray(paths, dtype=float)
+		self.identities = list(identities) if identities is not None else list(range(1, self.paths.shape[1] + 1))
+		self.rate = rate
+		self.received = []
+		self.server = None
+		self.sessions = [] # Tasks serving the clients
+
+	# Starts serving, returns the address of the server (port 0 picks a free port)
+	async def start(self, host='127.0.0.1', port=0):
+		self.server = await asyncio.start_server(self.handle, host, port)
+		return self.server.sockets[0].getsockname()[:2]
+
+	# Stops serving, after the sessions of the clients have ended
+	async def stop(self):
+		self.server.close()
+		await asyncio.gather(*self.sessions)
+		await self.server.wait_closed()
+
+	async def handle(self, reader, writer):
+		self.sessions.append(asyncio.current_task())
+		loop = asyncio.get_running_loop()
+		collector = asyncio.ensure_future(self.collect(reader))
+		start = loop.time()
+		for row, locations in enumerate(self.paths):
+			await asyncio.sleep(max(start + row / self.rate - loop.time(), 0.0))
+			for identity, location in zip(self.identities, locations):
+				writer.write(encode({'user': identity, 't': row / self.rate, 'position': location.tolist()}))
+			await writer.drain()
+
+		# Only the sending side is closed, the decisions of the latest ticks are still collected
+		writer.write_eof()
+		await collector
+		writer.close()
+
+	async def collect(self, reader):
+		async for message in read_messages(reader):
+			self.received.append(message)
+
+
+# Replays the paths through a local ReplayTracker to a LiveEngine over TCP. Returns the report of the engine and the
+# tracker with the received decisions.
+async def replay_session(rdw, paths, threshold, tick_rate=None, latency_budget=None):
+	tracker = ReplayTracker(paths, rate=tick_rate or rdw.steps_per_second)
+	host, port = await tracker.start()
+	try:
+		engine = LiveEngine(rdw, tracker.identities, threshold, tick_rate, latency_budget)
+		report = await run_tcp(engine, host, port)
+	finally:
+		await tracker.stop()
+	return report, tracker
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Live steering of tracked users by the APF-RDW algorithm')
+	parser.add_argument('--users', type=int, default=4, help='number of users')
+	parser.add_argument('--rate', type=float, default=10.0, help='ticks (and replayed updates) per second')
+	parser.add_argument('--duration', type=float, default=30.0, help='duration of the replayed session in seconds')
+	parser.add_argument('--budget', type=float, help='latency budget of a tick in seconds (half of its period by default)')
+	parser.add_argument('--env-size', type=float, default=10.0, help='size of the squared environment in meters')
+	parser.add_argument('--threshold', type=float, default=100, help='reset threshold')
+	parser.add_argument('--tracker', help='host:port of a tracking system to connect to, instead of replaying simulated paths')
+	arguments = parser.parse_args()
+
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(arguments.env_size), **dict(MMSYS_PARAMETERS, duration=arguments.duration,
+									 steps_per_second=arguments.rate))
+	if arguments.tracker:
+		host, port = arguments.tracker.rsplit(':', 1)
+		engine = LiveEngine(rdw, range(1, arguments.users + 1), arguments.threshold, latency_budget=arguments.budget)
+		report = asyncio.run(run_tcp(engine, host, int(port)))
+	else:
+		# Physical paths of an offline simulation stand in for the tracked locations
+		paths = simulation.ReplicaSimulation.random(rdw, 1, arguments.users, arguments.threshold, 0,
+													   num_steps=int(round(rdw.steps))).run().positions[:, 0]
+		report = asyncio.run(replay_session(rdw, paths, arguments.threshold, latency_budget=arguments.budget))[0]
+
+	for name, value in report.items():
+		print('{:<16} {}'.format(name, value))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for capturing the macro-scale performance metrics of a simulation online, in constant memory. Instead of
+storing every distance between resets (see Simulation.distance_between_resets_per_user), the distributions of the
+distances between resets, of the resets per minute and of the step lengths are summarized per user while the
+simulation runs: count, mean and variance (Welford's algorithm, in its parallel form by Chan et al.), quantiles
+estimated by a merging t-digest (Dunning and Ertl, 2019) and histograms over fixed bins. New values go into a small
+buffer per user, which is merged into the summaries whenever it is full, so every step costs the same, however long
+the run, and the summaries are updated with a few array operations per buffer instead of per value. The exact
+distances can still be kept alongside, e.g. for checking the estimates.
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import numpy as np
+
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Default histogram bin edges of the metrics (values below the first or above the last edge are counted separately)
+DISTANCE_EDGES = np.geomspace(0.01, 1000.0, 51)
+RESETS_PER_MINUTE_EDGES = np.arange(0.0, 101.0)
+STEP_LENGTH_EDGES = np.linspace(0.0, 0.5, 51)
+
+
+# Count, mean, variance, minimum and maximum of the values of each of num_users users. Values are merged in chunks,
+# combining the mean and the sum of squared differences of a chunk with the ones of the earlier values.
+class RunningStats:
+	def __init__(self, num_users):
+		self.count = np.zeros(num_users, dtype=int)
+		self.mean = np.zeros(num_users)
+		self.m2 = np.zeros(num_users) # Sum of the squared differences from the mean
+		self.min = np.full(num_users, np.inf)
+		self.max = np.full(num_users, -np.inf)
+
+	# Adds a chunk of values of one user
+	def merge(self, user, values):
+		count = self.count[user] + len(values)
+		mean = np.mean(values)
+		delta = mean - self.mean[user]
+		self.m2[user] += np.sum((values - mean) ** 2) + delta ** 2 * self.count[user] * len(values) / count
+		self.mean[user] += delta * len(values) / count
+		self.count[user] = count
+		self.min[user] = min(self.min[user], np.min(values))
+		self.max[user] = max(self.max[user], np.max(values))
+
+	# Variance of the values of each user (NaN without values), with ddof as in np.var
+	def variance(self, ddof=0):
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+
+
+# Quantiles of the values of each of num_users users, estimated by a merging t-digest. The values of each user are
+# summarized by at most compression / 2 weighted centroids, which are small in the tails and large around the median,
+# following the arcsine scale function k(q) = compression / (2 pi) asin(2q - 1): a chunk of values is sorted together
+# with the centroids, and the items whose cumulative weights fall within the same unit interval of k are merged.
+class TDigest:
+	def __init__(self, num_users, quantiles=QUANTILES, compression=200):
+		self.quantiles = np.asarray(quantiles, dtype=float)
+		self.compression = compression
+		size = int(compression) // 2 + 1
+		self.means = np.zeros((num_users, size))
+		self.weights = np.zeros((num_users, size))
+		self.min = np.full(num_users, np.inf)
+		self.max = np.full(num_users, -np.inf)
+
+	def scale(self, q):
+		return self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+
+	# Adds a chunk of values of one user
+	def merge(self, user, values):
+		used = self.weights[user] > 0
+		means = np.concatenate([self.means[user, used], values])
+		weights = np.concatenate([self.weights[user, used], np.ones(len(values))])
+		order = np.argsort(means, kind='stable')
+		means = means[order]
+		weights = weights[order]
+
+		cumulative = np.cumsum(weights)
+		centroids = np.floor(self.scale((cumulative - weights / 2) / cumulative[-1]) - self.scale(0.0)).astype(int)
+		centroids = np.minimum(centroids, self.means.shape[1] - 1)
+		self.weights[user] = np.bincount(centroids, weights, minlength=self.means.shape[1])
+		sums = np.bincount(centroids, weights * means, minlength=self.means.shape[1])
+		self.means[user] = np.divide(sums, self.weights[user], out=np.zeros_like(sums), where=self.weights[user] > 0)
+		self.min[user] = min(self.min[user], means[0])
+		self.max[user] = max(self.max[user], means[-1])
+
+	# (U,Q) estimated quantiles, interpolated between the centroids and the extreme values, at the ranks of np.quantile
+	# (exact as long as every centroid holds a single value), NaN for the users without values
+	def estimates(self):
+		estimates = np.full((len(self.means), len(self.quantiles)), np.nan)
+		for user in np.flatnonzero(np.any(self.weights > 0, axis=1)):
+			used = self.weights[user] > 0
+			weights = self.weights[user, used]
+			cumulative = np.cumsum(weights)
+			centers = np.concatenate([[0.0], cumulative - (weights + 1) / 2, [cumulative[-1] - 1]])
+			means = np.concatenate([[self.min[user]], self.means[user, used], [self.max[user]]])
+			estimates[user] = np.interp(self.quantiles * (cumulative[-1] - 1), centers, means)
+		return estimates
+
+
+# Counts of the values of each of num_users users in the bins between the given edges, with an additional bin below
+# the first edge and one above the last edge (the (U,B+1) counts)
+class Histogram:
+	def __init__(self, num_users, edges):
+		self.edges = np.asarray(edges, dtype=float)
+		self.counts = np.zeros((num_users, len(self.edges) + 1), dtype=int)
+
+	# Adds a chunk of values of one user
+	def merge(self, user, values):
+		self.counts[user] += np.bincount(np.searchsorted(self.edges, values, 'right'), minlength=self.counts.shape[1])
+
+
+# Arrays holding the state of the parts of a StreamingDistribution
+STATE_ARRAYS = {'stats': ('count', 'mean', 'm2', 'min', 'max'), 'sketch': ('means', 'weights', 'min', 'max'),
+				'histogram': ('counts',)}
+
+
+# Streaming summary of the distribution of a metric per user: running statistics, quantile estimates and a histogram.
+# The values are buffered per user, up to buffer_size values, before being merged into all three.
+class StreamingDistribution:
+	def __init__(self, num_users, edges, quantiles=QUANTILES, buffer_size=256):
+		self.stats = RunningStats(num_users)
+		self.sketch = TDigest(num_users, quantiles)
+		self.histogram = Histogram(num_users, edges)
+		self.buffer = np.empty((num_users, buffer_size))
+		self.buffered = np.zeros(num_users, dtype=int)
+
+	# Adds one value for each of the given users (an index array without duplicates)
+	def update(self, users, values):
+		buffered = self.buffered[users]
+		self.buffer[users, buffered] = values
+		self.buffered[users] = buffered + 1
+		if buffered.max() + 1 == self.buffer.shape[1]:
+			self.flush()
+
+	# Merges the buffered values into the summaries
+	def flush(self):
+		for user in np.flatnonzero(self.buffered):
+			values = self.buffer[user, :self.buffered[user]]
+			self.stats.merge(user, values)
+			self.sketch.merge(user, values)
+			self.histogram.merge(user, values)
+		self.buffered[:] = 0
+
+	# JSON-serializable state of the arrays of all parts (and of the buffered values), to be restored when resuming a
+	# checkpoint
+	def checkpoint_state(self):
+		state = {part + '.' + name: getattr(getattr(self, part), name).tolist() for part, names in STATE_ARRAYS.items() for name in names}
+		state.update(buffer=self.buffer[:, :self.buffered.max()].tolist(), buffered=self.buffered.tolist())
+		return state
+
+	def restore(self, state):
+		for part, names in STATE_ARRAYS.items():
+			for name in names:
+				getattr(getattr(self, part), name)[...] = state[part + '.' + name]
+		self.buffered[...] = state['buffered']
+		self.buffer[:, :self.buffered.max()] = state['buffer']
+
+	# JSON-serializable summary, with one value (or one list of values) per user
+	def summary(self):
+		self.flush()
+		return {'count': self.stats.count.tolist(), 'mean': self.stats.mean.tolist(), 'std': np.sqrt(self.stats.variance()).tolist(),
+				'min': self.stats.min.tolist(), 'max': self.stats.max.tolist(), 'quantiles': self.sketch.quantiles.tolist(),
+				'quantile_estimates': self.sketch.estimates().tolist(), 'edges': self.histogram.edges.tolist(),
+				'histogram': self.histogram.counts.tolist()}
+
+
+# Online macro-scale metrics of a simulation of num_users users with time step delta_t, updated by the simulation with
+# the reset flags and step lengths of every step from the first redirected step on (see Simulation). Distances between
+# resets follow Simulation.distance_between_resets_per_user: a reset closes the current distance and starts the next
+# one with the length of the reset step. Resets per minute are counted over consecutive full minutes of simulated time.
+# With exact, all distances are kept in lists per user as well.
+class OnlineMetrics:
+	def __init__(self, num_users, delta_t, quantiles=QUANTILES, distance_edges=DISTANCE_EDGES,
+				 resets_per_minute_edges=RESETS_PER_MINUTE_EDGES, step_length_edges=STEP_LENGTH_EDGES, exact=False):
+		self.num_users = num_users
+		self.steps_per_minute = int(round(60.0 / delta_t))
+		self.distances = StreamingDistribution(num_users, distance_edges, quantiles)
+		self.resets_per_minute = StreamingDistribution(num_users, resets_per_minute_edges, quantiles)
+		self.step_lengths = StreamingDistribution(num_users, step_length_edges, quantiles)
+		self.all_users = np.arange(num_users)
+
+		self.num_resets = np.zeros(num_users, dtype=int)
+		self.open_distances = np.zeros(num_users) # Distance since the latest reset of each user
+		self.minute_resets = np.zeros(num_users, dtype=int)
+		self.minute_steps = 0
+		self.closed = False
+		self.exact = [[] for user in range(num_users)] if exact else None
+
+	# Adds the (U,) reset flags and (U,) step lengths of the next step
+	def update(self, resets, step_lengths):
+		if np.any(resets):
+			users = np.flatnonzero(resets)
+			self.close_distances(users)
+			self.num_resets[users] += 1
+			self.minute_resets[users] += 1
+		self.open_distances += step_lengths
+		self.step_lengths.update(self.all_users, step_lengths)
+
+		self.minute_steps += 1
+		if self.minute_steps == self.steps_per_minute:
+			self.resets_per_minute.update(self.all_users, self.minute_resets)
+			self.minute_resets[:] = 0
+			self.minute_steps = 0
+
+	def close_distances(self, users):
+		self.distances.update(users, self.open_distances[users])
+		if self.exact is not None:
+			for user in users:
+				self.exact[user].append(float(self.open_distances[user]))
+		self.open_distances[users] = 0.0
+
+	# Closes the latest distance of each user, at the end of the simulation
+	def close(self):
+		if not self.closed:
+			self.close_distances(self.all_users)
+			self.closed = True
+
+	def checkpoint_state(self):
+		state = {name: getattr(self, name).checkpoint_state() for name in ('distances', 'resets_per_minute', 'step_lengths')}
+		state.update(num_resets=self.num_resets.tolist(), open_distances=self.open_distances.tolist(), minute_resets=self.minute_resets.tolist(),
+					 minute_steps=self.minute_steps, closed=self.closed, exact=self.exact)
+		return state
+
+	def restore(self, state):
+		for name in ('distances', 'resets_per_minute', 'step_lengths'):
+			getattr(self, name).restore(state[name])
+		self.num_resets[...] = state['num_resets']
+		self.open_distances[...] = state['open_distances']
+		self.minute_resets[...] = state['minute_resets']
+		self.minute_steps = state['minute_steps']
+		self.closed = state['closed']
+		self.exact = state['exact']
+
+	# JSON-serializable summary of all metrics (closing the latest distances first), with the exact distances if kept
+	def summary(self):
+		self.close()
+		summary = {'num_resets': self.num_resets.tolist(), 'distances': self.distances.summary(),
+				   'resets_per_minute': self.resets_per_minute.summary(), 'step_lengths': self.step_lengths.summary()}
+		if self.exact is not None:
+			summary['exact_distances'] = self.exact
+		return summary
@@ -14,76 +14,358 @@ __email__ = "filip.lemic@uantwerpen.be"
 __status__ = "Development"
 
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
 import numpy as np
-import pandas
-import tensorflow as tf
-
 np.random.seed(7)
 
 
-# Given a Pandas DataFrame, this method will generate a training array X consisting of n_past 
-# observations, as well as a testing array y of consisting of n_future predicted values  
+# ---------- Backends ----------------------------
+# The LSTM is implemented by a backend that is only loaded on the first call that needs it, so that importing this
+# module (e.g. for the lightweight predictors, or in sweep workers that never predict) does not load TensorFlow.
+
+# Keras/TensorFlow implementation of the LSTM-related functionality
+class KerasBackend:
+	def __init__(self):
+		import tensorflow as tf
+		self.tf = tf
+
+	# Builds the encoder-decoder LSTM used for the short-term predictions
+	def build_model(self, n_past, n_future, n_features):
+		tf = self.tf
+
+		encoder_inputs = tf.keras.layers.Input(shape=(n_past, n_features))
+		encoder = tf.keras.layers.LSTM(60, activation = 'tanh', return_state=True)
+		encoder_outputs = encoder(encoder_inputs)
+
+		encoder_states = encoder_outputs[1:]
+
+		decoder_inputs = tf.keras.layers.RepeatVector(n_future)(encoder_outputs[0])
+
+		decoder = tf.keras.layers.LSTM(60, activation = 'tanh', return_sequences = True)(decoder_inputs, initial_state = encoder_states)
+		decoder_outputs = tf.keras.layers.TimeDistributed(tf.keras.layers.Dense(n_features))(decoder)
+
+		model = tf.keras.models.Model(encoder_inputs, decoder_outputs)
+		model.compile(loss = tf.keras.losses.MeanSquaredError(), optimizer = 'adam', metrics = ['mean_squared_error'])
+
+		return model
+
+	def train_model(self, model, train, validation, epochs = 50):
+		reduce_lr = self.tf.keras.callbacks.LearningRateScheduler(lambda x: 1e-4 * 0.90 ** x)
+		if isinstance(train, tuple):
+			return model.fit(train[0], train[1], epochs = epochs, validation_data = validation, batch_size = 32, verbose = 0, callbacks = [reduce_lr])
+		return model.fit(train, epochs = epochs, validation_data = validation, verbose = 0, callbacks = [reduce_lr])
+
+	def predict(self, model, X):
+		return model.predict(X)
+
+	def save_model(self, model, path):
+		model.save(path)
+
+	def load_model(self, path):
+		return self.tf.keras.models.load_model(path)
+
+	def make_window_dataset(self, series, n_past, n_future, batch_size = 32, shuffle = False):
+		tf = self.tf
+		n_features = np.shape(series)[1]
+		signature = (tf.TensorSpec(shape = (None, n_past, n_features), dtype = tf.float64),
+					 tf.TensorSpec(shape = (None, n_future, n_features), dtype = tf.float64))
+		return tf.data.Dataset.from_generator(lambda: iter_windows(series, n_past, n_future, batch_size, shuffle),
+											  output_signature = signature).prefetch(2)
+
+	def set_threads(self, num_threads):
+		self.tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+		self.tf.config.threading.set_inter_op_parallelism_threads(num_threads)
+
+
+BACKENDS = {'keras': KerasBackend}
+loaded_backends = {}
+
+# Returns the backend of the given name, loading it on first use
+def get_backend(name = 'keras'):
+	if name not in loaded_backends:
+		loaded_backends[name] = BACKENDS[name]()
+	return loaded_backends[name]
+
+
+# Given an (N,n_features) array, this method will generate a training array X consisting of n_past 
+# observations, as well as a testing array y of consisting of n_future predicted values. Both are read-only strided
+# views into the series (sliding windows), so no data is copied.
 def split_series(series, n_past, n_future):
 	# n_past - number of past observations
 	# n_future - number of future observations 
 
-	X, y = list(), list()
-	for window_start in range(len(series)):
-		past_end = window_start + n_past
-		future_end = past_end + n_future
-	
-		if future_end > len(series):
-  			break
+	windows = sliding_windows(series, n_past + n_future)
+
+	# slicing the past and future parts of the windows
+	return windows[:, :n_past], windows[:, n_past:]
+
+
+# (N-width+1,width,n_features) read-only view of all windows of width consecutive observations of the series
+def sliding_windows(series, width):
+	series = np.asarray(series)
+	num_windows = max(len(series) - width + 1, 0)
+	return np.lib.stride_tricks.as_strided(series, shape = (num_windows, width) + series.shape[1:],
+										   strides = (series.strides[0],) + series.strides, writeable = False)
+
+
+# Streams the windows of split_series in batches of batch_size windows, optionally in a random order, so that only a
+# batch at a time has to be materialized
+def iter_windows(series, n_past, n_future, batch_size = 1024, shuffle = False):
+	X, y = split_series(series, n_past, n_future)
+	if shuffle:
+		order = np.random.permutation(len(X))
+		for start in range(0, len(X), batch_size):
+			indices = np.sort(order[start:start + batch_size])
+			yield X[indices], y[indices]
+	else:
+		for start in range(0, len(X), batch_size):
+			yield X[start:start + batch_size], y[start:start + batch_size]
+
+
+# tf.data pipeline over the windows of the series, see iter_windows
+def make_window_dataset(series, n_past, n_future, batch_size = 32, shuffle = False):
+	return get_backend().make_window_dataset(series, n_past, n_future, batch_size, shuffle)
+
+
+# Divides the dataset into training and test sets
+def split_dataset(dataset, split_rate = 0.8):
+
+	# Dataset should be an (N,n_features) array, e.g. the trajectory view returned by User.get_phy_path
+	dataset = np.asarray(dataset, dtype=float)
+
+	return dataset[0:int(len(dataset) * split_rate)], dataset[int(len(dataset) * split_rate):]
+
+
+# Divides the dataset into training and test sets, and both of them into chunks of observations
+def make_windows(dataset, n_past, n_future, split_rate = 0.8):
+
+	train_set, test_set = split_dataset(dataset, split_rate)
+
+	# Divide both training and test sets into chunks of observations. 
+	X_train, y_train = split_series(train_set, n_past, n_future)
+	X_test, y_test = split_series(test_set, n_past, n_future)
+
+	return X_train, y_train, X_test, y_test
+
+
+# Builds the encoder-decoder LSTM used for the short-term predictions
+def build_model(n_past, n_future, n_features):
+	return get_backend().build_model(n_past, n_future, n_features)
+
 
-		# slicing the past and future parts of the window
-		past, future = series[window_start:past_end, :], series[past_end:future_end, :]
-		X.append(past)
-		y.append(future)
-	return np.array(X), np.array(y)
+# Trains the model on the training windows, given either as an (X, y) tuple of arrays or as a tf.data.Dataset of
+# batches (see make_window_dataset), and validates it on the test windows given in the same way
+def train_model(model, train, validation, epochs = 50):
+	return get_backend().train_model(model, train, validation, epochs)
 
 
-def make_and_evaluate_predictions(dataset, n_past, n_future, n_features, split_rate = 0.8):
+# Mean squared error of each prediction, averaged over the predicted values
+def evaluate_mse(y_test, y_pred):
+
+	# Flattened per prediction with an explicit size, as -1 cannot be inferred without test windows
+	y_test = y_test.reshape((len(y_test), int(np.prod(y_test.shape[1:]))))
+	y_pred = y_pred.reshape((len(y_pred), int(np.prod(y_pred.shape[1:]))))
+
+	mse = (np.square(y_test - y_pred)).mean(axis = 1)
+
+	return mse.tolist()
+
+
+def make_and_evaluate_predictions(dataset, n_past, n_future, n_features, split_rate = 0.8, stream = False, predictor = 'lstm', cache = None):
 	# n_past - number of past observations
 	# n_future - number of future observations 
 	# n_features - number of features to be predicted (usually 2, i.e., x and y coordinates)s
+	# stream - feed the windows to TensorFlow in batches instead of as a whole (for very long trajectories, LSTM only)
+	# predictor - name of the predictor in PREDICTORS
+	# cache - optional PredictionCache, results (and trained LSTMs) of previous calls with the same inputs are reused
 
-	# Dataset should be a Pandas DataFraame object
-	dataset = pandas.DataFrame(dataset)
-	dataset.index.name = 'id'
+	key = None
+	if cache is not None:
+		key = cache.make_key(dataset, predictor = predictor, n_past = n_past, n_future = n_future, n_features = n_features, split_rate = split_rate, stream = stream)
+		mse = cache.load_result(key)
+		if mse is not None:
+			return mse
 
-	# Divide into training and test sets
-	train_df, test_df = dataset[0:int(len(dataset) * split_rate)], dataset[int(len(dataset) * split_rate):] 
+	if predictor == 'lstm':
+		train_set, test_set = split_dataset(dataset, split_rate)
+		y_test = split_series(test_set, n_past, n_future)[1]
+		if stream:
+			train = make_window_dataset(train_set, n_past, n_future, shuffle = True)
+			validation = make_window_dataset(test_set, n_past, n_future)
+			X_test = validation.map(lambda X, y: X)
+		else:
+			train = split_series(train_set, n_past, n_future)
+			validation = (split_series(test_set, n_past, n_future)[0], y_test)
+			X_test = validation[0]
+		model = fit_lstm(n_past, n_future, n_features, train, validation, cache, key)
+		y_pred = get_backend().predict(model, X_test)
+	else:
+		X_train, y_train, X_test, y_test = make_windows(dataset, n_past, n_future, split_rate)
+		y_pred = PREDICTORS[predictor](X_train, y_train, X_test, y_test)
 
-	# Divide both training and test sets into chunks of observations. 
-	X_train, y_train = split_series(train_df.values, n_past, n_future)
-	X_test, y_test = split_series(test_df.values, n_past, n_future)
+	mse = evaluate_mse(y_test, y_pred)
 
+	if cache is not None:
+		cache.save_result(key, mse)
 
-	encoder_inputs = tf.keras.layers.Input(shape=(n_past, n_features))
-	encoder = tf.keras.layers.LSTM(60, activation = 'tanh', return_state=True)
-	encoder_outputs = encoder(encoder_inputs)
+	return mse
 
-	encoder_states = encoder_outputs[1:]
 
-	decoder_inputs = tf.keras.layers.RepeatVector(n_future)(encoder_outputs[0])
+# Builds and trains the LSTM, or loads it from the cache if it was trained on the same inputs before
+def fit_lstm(n_past, n_future, n_features, train, validation, cache = None, key = None):
+	model = cache.load_model(key, get_backend()) if cache is not None else None
+	if model is None:
+		model = build_model(n_past, n_future, n_features)
+		train_model(model, train, validation)
+		if cache is not None:
+			cache.save_model(key, model, get_backend())
+	return model
 
-	decoder = tf.keras.layers.LSTM(60, activation = 'tanh', return_sequences = True)(decoder_inputs, initial_state = encoder_states)
-	decoder_outputs = tf.keras.layers.TimeDistributed(tf.keras.layers.Dense(n_features))(decoder)
 
-	model = tf.keras.models.Model(encoder_inputs, decoder_outputs)
+# ---------- Predictors ----------------------------
+# A predictor takes the (n,n_past,n_features) training windows X_train with their (n,n_future,n_features) future values
+# y_train, and the test windows X_test, and returns the predicted (m,n_future,n_features) future values of the test
+# windows. The true future values y_test are only passed for validation purposes. Apart from the LSTM, all predictors
+# are vectorized over the windows and take milliseconds even for hour-long trajectories.
 
-	reduce_lr = tf.keras.callbacks.LearningRateScheduler(lambda x: 1e-4 * 0.90 ** x)
-	model.compile(loss = tf.keras.losses.MeanSquaredError(), optimizer = 'adam', metrics = ['mean_squared_error'])
-	history = model.fit(X_train, y_train, epochs = 50, validation_data = (X_test, y_test), batch_size = 32, verbose = 0, callbacks = [reduce_lr])
+PREDICTORS = {}
 
-	y_pred = model.predict(X_test)
+def register_predictor(name):
+	def register(predictor):
+		PREDICTORS[name] = predictor
+		return predictor
+	return register
 
-	y_test = y_test.reshape((len(y_test), 2))
-	y_pred = y_pred.reshape((len(y_pred), 2))
 
-	mse = (np.square(y_test - y_pred)).mean(axis = 1)
+# The seq2seq LSTM of Hou et al., trained for 50 epochs
+@register_predictor('lstm')
+def predict_lstm(X_train, y_train, X_test, y_test):
+	model = fit_lstm(X_train.shape[1], y_train.shape[1], X_train.shape[2], (X_train, y_train), (X_test, y_test))
+	return get_backend().predict(model, X_test)
 
-	return mse.tolist()
 
+# Steps 1..n_future ahead, shaped to broadcast over the predicted values
+def future_steps(n_future):
+	return np.arange(1, n_future + 1)[None, :, None]
+
+
+# The user stays at the last observed location
+@register_predictor('constant_position')
+def predict_constant_position(X_train, y_train, X_test, y_test):
+	return np.repeat(X_test[:, -1:], y_train.shape[1], axis = 1)
+
+
+# The user keeps the last observed velocity
+@register_predictor('constant_velocity')
+def predict_constant_velocity(X_train, y_train, X_test, y_test):
+	velocity = X_test[:, -1] - X_test[:, -2]
+	return X_test[:, -1:] + future_steps(y_train.shape[1]) * velocity[:, None]
+
+
+# The user keeps the last observed acceleration
+@register_predictor('constant_acceleration')
+def predict_constant_acceleration(X_train, y_train, X_test, y_test):
+	velocity = X_test[:, -1] - X_test[:, -2]
+	acceleration = X_test[:, -1] - 2 * X_test[:, -2] + X_test[:, -3]
+	k = future_steps(y_train.shape[1])
+	return X_test[:, -1:] + k * velocity[:, None] + k * (k + 1) / 2 * acceleration[:, None]
+
+
+# Kalman filter with a constant velocity model per coordinate, run over the past observations of all windows at once
+# and extrapolated n_future steps ahead. Process_noise and measurement_noise are the variances of the acceleration
+# (per step) and of the observed locations.
+@register_predictor('kalman')
+def predict_kalman(X_train, y_train, X_test, y_test, process_noise = 1e-4, measurement_noise = 1e-6):
+	transition = np.array([[1.0, 1.0], [0.0, 1.0]])
+	noise = process_noise * np.array([[0.25, 0.5], [0.5, 1.0]])
+
+	# State (location, velocity) and covariance of every window and coordinate
+	state = np.stack([X_test[:, 0], np.zeros(X_test.shape[::2])], axis = -1)
+	covariance = np.broadcast_to(np.diag([measurement_noise, 1.0]), X_test.shape[::2] + (2, 2)).copy()
+
+	for observation in np.moveaxis(X_test[:, 1:], 1, 0):
+		# Predict
+		state = state @ transition.T
+		covariance = transition @ covariance @ transition.T + noise
+		# Update with the observed location
+		gain = covariance[..., :, 0] / (covariance[..., 0, 0] + measurement_noise)[..., None]
+		state = state + gain * (observation - state[..., 0])[..., None]
+		covariance = covariance - gain[..., :, None] * covariance[..., None, 0, :]
+
+	k = future_steps(y_train.shape[1])
+	return state[:, None, :, 0] + k * state[:, None, :, 1]
+
+
+# Closed-form ridge regression of the future values on the past observations (an AR(p) model with p = n_past),
+# relative to the last observed location so that the model does not depend on where in the environment a user is
+@register_predictor('ridge')
+def predict_ridge(X_train, y_train, X_test, y_test, regularization = 1e-6):
+	# Without training windows (series shorter than the window), there is nothing to fit, and without test windows
+	# nothing to predict
+	if len(X_train) == 0 or len(X_test) == 0:
+		return np.full((len(X_test),) + y_train.shape[1:], np.nan)
+
+	def features(X):
+		return np.column_stack([(X - X[:, -1:]).reshape(len(X), -1), np.ones(len(X))])
+
+	phi = features(X_train)
+	targets = (y_train - X_train[:, -1:]).reshape(len(y_train), -1)
+	weights = np.linalg.solve(phi.T @ phi + regularization * np.eye(phi.shape[1]), phi.T @ targets)
+
+	return X_test[:, -1:] + (features(X_test) @ weights).reshape((len(X_test),) + y_train.shape[1:])
+
+
+# Limits the number of threads used by TensorFlow in this process
+def set_tf_threads(num_threads):
+	get_backend().set_threads(num_threads)
+
+
+# Captures the micro-scale metric for several trajectories (e.g. all users of an experiment) at once, returning the
+# list of per-trajectory MSE lists in the same format as make_and_evaluate_predictions. Two modes are supported:
+# - 'pooled': a single model is trained on the windows of all trajectories (windows never span two trajectories) and
+#   evaluated on the test windows of each trajectory, which costs about as much as training one per-user model
+# - 'parallel': a separate model is trained for each trajectory, as in make_and_evaluate_predictions, concurrently in
+#   a pool of max_workers processes that are each limited to tf_threads TensorFlow threads
+def make_and_evaluate_predictions_batch(datasets, n_past, n_future, n_features, split_rate = 0.8, mode = 'pooled', max_workers = None, tf_threads = 1, predictor = 'lstm', cache = None):
+
+	# The lightweight predictors are fast enough to simply be evaluated one trajectory after the other
+	if predictor != 'lstm':
+		return [make_and_evaluate_predictions(dataset, n_past, n_future, n_features, split_rate, predictor = predictor, cache = cache) for dataset in datasets]
+
+	if mode == 'parallel':
+		# TensorFlow is not fork-safe, so the workers are started from scratch
+		context = multiprocessing.get_context('spawn')
+		with ProcessPoolExecutor(max_workers = max_workers, mp_context = context, initializer = set_tf_threads, initargs = (tf_threads,)) as executor:
+			futures = [executor.submit(make_and_evaluate_predictions, np.array(dataset), n_past, n_future, n_features, split_rate, cache = cache) for dataset in datasets]
+			return [future.result() for future in futures]
+
+	if mode != 'pooled':
+		raise ValueError("Unknown prediction mode: " + str(mode))
+
+	key = None
+	if cache is not None:
+		key = cache.make_key(list(datasets), predictor = predictor, mode = mode, n_past = n_past, n_future = n_future, n_features = n_features, split_rate = split_rate)
+		result = cache.load_result(key)
+		if result is not None:
+			return result
+
+	windows = [make_windows(dataset, n_past, n_future, split_rate) for dataset in datasets]
+	X_train = np.concatenate([window[0] for window in windows])
+	y_train = np.concatenate([window[1] for window in windows])
+	X_test = np.concatenate([window[2] for window in windows])
+	y_test = np.concatenate([window[3] for window in windows])
+
+	model = fit_lstm(n_past, n_future, n_features, (X_train, y_train), (X_test, y_test), cache, key)
+
+	mse = evaluate_mse(y_test, get_backend().predict(model, X_test))
+
+	# Split the predictions back per trajectory
+	bounds = np.cumsum([0] + [len(window[2]) for window in windows])
+	result = [mse[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+	if cache is not None:
+		cache.save_result(key, result)
 
+	return result
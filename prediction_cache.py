@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for caching the short-term prediction results (and the trained models) on disk. Entries are keyed by the
+predictor and its hyperparameters, together with a fingerprint of the input trajectories, so that re-running an
+analysis or extending a sweep only trains and evaluates what is new. The cache is bounded in size, the least recently
+used entries are evicted first.
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+CACHE_FORMAT = 1 # Bump to invalidate all existing entries when the predictors change
+
+
+class PredictionCache:
+	def __init__(self, directory, max_bytes = 2 ** 30):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		os.makedirs(directory, exist_ok = True)
+
+	# Key of an entry. Datasets is a single (N,n_features) trajectory or a list of them, parameters are the predictor
+	# name and hyperparameters (n_past, n_future, split_rate, ...), which have to be JSON serializable.
+	def make_key(self, datasets, **parameters):
+		fingerprint = hashlib.sha256(json.dumps(dict(parameters, cache_format = CACHE_FORMAT), sort_keys = True).encode())
+		for dataset in (datasets if isinstance(datasets, list) else [datasets]):
+			dataset = np.ascontiguousarray(dataset, dtype = float)
+			fingerprint.update(str(dataset.shape).encode())
+			fingerprint.update(dataset.tobytes())
+		return fingerprint.hexdigest()
+
+	def entry(self, key):
+		return os.path.join(self.directory, key)
+
+	# Marks the entry as recently used
+	def touch(self, key):
+		try:
+			os.utime(self.entry(key))
+		except FileNotFoundError:
+			pass
+
+	# Returns the stored MSE list(s) of the entry, or None if it is not in the cache
+	def load_result(self, key):
+		try:
+			with open(os.path.join(self.entry(key), 'result.json')) as result_file:
+				result = json.load(result_file)
+		except (FileNotFoundError, ValueError):
+			return None
+		self.touch(key)
+		return result
+
+	def save_result(self, key, result):
+		os.makedirs(self.entry(key), exist_ok = True)
+		# Written to a temporary file first, so that concurrent sweep workers never see a partial result
+		handle, path = tempfile.mkstemp(dir = self.entry(key))
+		with os.fdopen(handle, 'w') as result_file:
+			json.dump(result, result_file)
+		os.replace(path, os.path.join(self.entry(key), 'result.json'))
+		self.evict()
+
+	# Returns the stored model of the entry (loaded through the given prediction backend), or None
+	def load_model(self, key, backend):
+		path = os.path.join(self.entry(key), 'model')
+		if not os.path.exists(path):
+			return None
+		self.touch(key)
+		return backend.load_model(path)
+
+	def save_model(self, key, model, backend):
+		os.makedirs(self.entry(key), exist_ok = True)
+		path = os.path.join(self.entry(key), 'model')
+		shutil.rmtree(path, ignore_errors = True)
+		backend.save_model(model, path)
+		self.evict()
+
+	# Total size of all files of an entry in bytes
+	def entry_size(self, key):
+		size = 0
+		for root, directories, files in os.walk(self.entry(key)):
+			size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+		return size
+
+	# Removes the least recently used entries until the cache fits into max_bytes
+	def evict(self):
+		keys = [key for key in os.listdir(self.directory) if os.path.isdir(self.entry(key))]
+		sizes = {key: self.entry_size(key) for key in keys}
+		total = sum(sizes.values())
+		for key in sorted(keys, key = lambda key: os.path.getmtime(self.entry(key))):
+			if total <= self.max_bytes:
+				break
+			shutil.rmtree(self.entry(key), ignore_errors = True)
+			total -= sizes[key]
+
+	def clear(self):
+		for key in os.listdir(self.directory):
+			shutil.rmtree(self.entry(key), ignore_errors = True)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for profiling the phases of a simulation. When enabled, a Profiler wraps the hot-path functions (force vectors,
+moving rates, next physical steps, reset checks, path appends, result streaming, predictions) with counters and
+timers, and restores the original functions when disabled, so that profiling costs nothing at all while it is off.
+The per-phase breakdown can be printed as a table, and a cProfile (or, if installed, pyinstrument) profile of the same
+run can be recorded alongside, for tools such as pstats or snakeviz.
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import cProfile
+import functools
+import time
+import algorithm
+import compiled_kernel
+import prediction
+import simulation
+from result_sink import ResultSink
+from user import Trajectory
+
+try:
+	import pyinstrument
+except ImportError:
+	pyinstrument = None
+
+
+# Phases timed by the profiler, as phase name -> (owner, attribute) of the wrapped function. Phases are inclusive:
+# e.g. force_field is part of force_vectors, and all the simulation phases are part of simulation_step. The per-user
+# phases are the ones of the reference kernel, the batched ones (next_physical_steps, ...) the ones of the vectorized
+# kernel, and compiled_steps is the whole step of the compiled kernel, whose phases cannot be wrapped.
+PHASES = {
+	'simulation_step': (simulation.Simulation, 'step'),
+	'force_vectors': (algorithm.RedirectedWalker, 'calculate_force_vectors'),
+	'force_field': (algorithm, 'calculate_force_field'),
+	'max_rotations': (algorithm.RedirectedWalker, 'calculate_max_rotations'),
+	'next_physical_step': (algorithm.RedirectedWalker, 'calculate_next_physical_step'),
+	'reset_if_needed': (algorithm.RedirectedWalker, 'reset_if_needed'),
+	'moving_rates': (algorithm.RedirectedWalker, 'calculate_moving_rates'),
+	'next_physical_steps': (algorithm.RedirectedWalker, 'calculate_next_physical_steps'),
+	'resets_needed': (algorithm.RedirectedWalker, 'resets_needed'),
+	'safe_steps': (algorithm.RedirectedWalker, 'calculate_safe_steps'),
+	'compiled_steps': (compiled_kernel, 'calculate_steps'),
+	'batched_steps': (algorithm.RedirectedWalker, 'calculate_macro_steps'),
+	'reset_schedule': (simulation.ResetSchedule, 'thresholds'),
+	'path_append': (Trajectory, 'append'),
+	'result_sink': (ResultSink, 'append_step'),
+	'prediction': (prediction, 'make_and_evaluate_predictions'),
+	'prediction_batch': (prediction, 'make_and_evaluate_predictions_batch'),
+	'split_series': (prediction, 'split_series'),
+}
+
+
+# Counters and timers around the given phases (all of PHASES by default). Only one profiler can be enabled at a time,
+# since the wrapped functions are shared. With cprofile, the run is recorded by cProfile as well (or by pyinstrument
+# with cprofile='pyinstrument', if it is installed).
+class Profiler:
+	active = None # Enabled profiler, if any
+
+	def __init__(self, phases=None, cprofile=False):
+		self.phases = {name: PHASES[name] for name in (PHASES if phases is None else phases)}
+		self.cprofile = cprofile
+		self.profile = None
+		self.originals = {}
+		self.reset()
+
+	def reset(self):
+		self.totals = {name: 0.0 for name in self.phases}
+		self.counts = {name: 0 for name in self.phases}
+		self.elapsed = 0.0
+
+	@property
+	def enabled(self):
+		return Profiler.active is self
+
+	def enable(self):
+		if self.enabled:
+			return self
+		if Profiler.active is not None:
+			raise RuntimeError("Another profiler is already enabled")
+		Profiler.active = self
+		for name, (owner, attribute) in self.phases.items():
+			self.originals[name] = vars(owner)[attribute]
+			setattr(owner, attribute, self.timed(name, self.originals[name]))
+
+		if self.cprofile == 'pyinstrument':
+			if pyinstrument is None:
+				raise ImportError("pyinstrument is not installed")
+			self.profile = self.profile or pyinstrument.Profiler()
+			self.profile.start()
+		elif self.cprofile:
+			self.profile = self.profile or cProfile.Profile()
+			self.profile.enable()
+		self.started = time.perf_counter()
+		return self
+
+	def disable(self):
+		if not self.enabled:
+			return self
+		self.elapsed += time.perf_counter() - self.started
+		if self.cprofile == 'pyinstrument':
+			self.profile.stop()
+		elif self.cprofile:
+			self.profile.disable()
+
+		for name, (owner, attribute) in self.phases.items():
+			setattr(owner, attribute, self.originals.pop(name))
+		Profiler.active = None
+		return self
+
+	# Wrapper of the function that accumulates its calls and run time into the given phase
+	def timed(self, name, function):
+		totals = self.totals
+		counts = self.counts
+
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			start = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				totals[name] += time.perf_counter() - start
+				counts[name] += 1
+		return wrapper
+
+	def __enter__(self):
+		return self.enable()
+
+	def __exit__(self, *exception):
+		self.disable()
+
+	# One row per called phase, from the most to the least expensive: number of calls, total and mean time in seconds
+	# and share of the wall time during which the profiler was enabled
+	def breakdown(self):
+		elapsed = self.elapsed + (time.perf_counter() - self.started if self.enabled else 0.0)
+		rows = [{'phase': name, 'calls': self.counts[name], 'total': self.totals[name], 'mean': self.totals[name] / self.counts[name],
+				 'share': self.totals[name] / elapsed if elapsed > 0 else 0.0} for name in self.phases if self.counts[name] > 0]
+		return sorted(rows, key=lambda row: -row['total'])
+
+	# Breakdown as a printable table, with the wall time on the last line
+	def table(self):
+		lines = ['{:<20} {:>10} {:>12} {:>12} {:>8}'.format('phase', 'calls', 'total [s]', 'mean [us]', 'share')]
+		for row in self.breakdown():
+			lines.append('{:<20} {:>10} {:>12.4f} {:>12.2f} {:>7.1%}'.format(row['phase'], row['calls'], row['total'], 1e6 * row['mean'], row['share']))
+		lines.append('{:<20} {:>10} {:>12.4f}'.format('wall time', '', self.elapsed))
+		return '\n'.join(lines)
+
+	# Writes the recorded cProfile stats (readable by pstats, snakeviz, ...) or the pyinstrument session to path
+	def dump_stats(self, path):
+		if self.profile is None:
+			raise ValueError("The profiler was created without cprofile")
+		if self.cprofile == 'pyinstrument':
+			self.profile.last_session.save(path)
+		else:
+			self.profile.dump_stats(path)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for streaming the results of a simulation to disk while it runs. Each run is a directory with one raw binary
+file per column (physical locations, reset events and step lengths per step, distances between resets and prediction
+errors per user) and a metadata.json file describing the run and the shapes of the columns. The columns are appended in
+chunks, so that memory stays flat for arbitrarily long runs, and are loaded back as memory-mapped arrays in
+milliseconds (see open_run). A run can be exported to a single compressed .npz file as well.
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import json
+import os
+import tempfile
+import numpy as np
+
+
+SINK_FORMAT = 1
+
+# Columns of a run, with their dtype and the shape of one row. Per-step columns have one row per simulation step,
+# per-user columns hold the values of all users one after the other, together with the user index of each value.
+STEP_COLUMNS = {'positions': ('<f8', (2,)), 'resets': ('|b1', ()), 'step_lengths': ('<f8', ())}
+USER_COLUMNS = {'distances': '<f8', 'mse': '<f8'}
+
+
+# Writes the results of a simulation of num_users users into directory (created if needed, existing columns are
+# overwritten). Metadata is any JSON-serializable dict describing the run (parameters, seed, ...), identities are the
+# identities of the users (1..U by default). Rows are buffered and written every chunk_size steps. With resume, the
+# existing columns are kept, to be rolled back to the state of a checkpoint (see restore).
+class ResultSink:
+	def __init__(self, directory, num_users, metadata=None, identities=None, chunk_size=1024, resume=False):
+		self.directory = directory
+		self.num_users = num_users
+		self.metadata = dict(metadata or {})
+		self.identities = list(identities) if identities is not None else list(range(1, num_users + 1))
+		self.chunk_size = chunk_size
+		os.makedirs(directory, exist_ok=True)
+
+		self.files = {}
+		for name in list(STEP_COLUMNS) + [name + suffix for name in USER_COLUMNS for suffix in ('', '_users')]:
+			self.files[name] = open(os.path.join(directory, name + '.bin'), 'ab' if resume else 'wb')
+		self.buffers = {name: np.empty((chunk_size, num_users) + shape, dtype=dtype) for name, (dtype, shape) in STEP_COLUMNS.items()}
+		self.buffered = 0
+		self.num_steps = 0
+		self.counts = {name: 0 for name in USER_COLUMNS}
+
+		# Distance since the latest reset of each user, see Simulation.distance_between_resets_per_user
+		self.open_distances = np.zeros(num_users)
+		self.num_resets = np.zeros(num_users, dtype=int)
+		self.closed = False
+		self.write_metadata()
+
+	# Appends the (U,2) locations, (U,) reset flags and (U,) step lengths of the next step. The distances between resets
+	# are tracked from the third step on, the first two being the initial locations and the kick-start step.
+	def append_step(self, positions, resets, step_lengths):
+		self.buffers['positions'][self.buffered] = positions
+		self.buffers['resets'][self.buffered] = resets
+		self.buffers['step_lengths'][self.buffered] = step_lengths
+		self.buffered += 1
+
+		if self.num_steps + self.buffered > 2:
+			resets = np.asarray(resets, dtype=bool)
+			if np.any(resets):
+				users = np.flatnonzero(resets)
+				self.append_user_values('distances', users, self.open_distances[users])
+				self.open_distances[users] = 0.0
+				self.num_resets += resets
+			self.open_distances += step_lengths
+
+		if self.buffered == self.chunk_size:
+			self.flush()
+
+	# Appends the values (e.g. the prediction errors) of the user with the given index to the per-user column
+	def append_user_values(self, name, users, values):
+		values = np.asarray(values, dtype=USER_COLUMNS[name]).reshape(-1)
+		users = np.broadcast_to(np.asarray(users, dtype='<i4'), values.shape)
+		self.files[name].write(values.tobytes())
+		self.files[name + '_users'].write(users.tobytes())
+		self.counts[name] += len(values)
+
+	def append_mse(self, user, mse):
+		self.append_user_values('mse', user, mse)
+
+	# Writes the buffered steps and updates the metadata, so that a crashed run can still be loaded up to this point
+	def flush(self):
+		for name, buffer in self.buffers.items():
+			self.files[name].write(buffer[:self.buffered].tobytes())
+		self.num_steps += self.buffered
+		self.buffered = 0
+		for column_file in self.files.values():
+			column_file.flush()
+		self.write_metadata()
+
+	# Closes the latest distance of each user and marks the run as complete. The number of resets per user and any
+	# additional metadata (e.g. the execution time) are stored with the run.
+	def close(self, **metadata):
+		if self.closed:
+			return
+		if self.num_steps + self.buffered > 0:
+			self.append_user_values('distances', np.arange(self.num_users), self.open_distances)
+		self.metadata.update(metadata, num_resets=self.num_resets.tolist())
+		self.closed = True
+		self.flush()
+		for column_file in self.files.values():
+			column_file.close()
+
+	# State of the sink after flushing it, from which the run can be resumed later on (see checkpoint.Checkpoint)
+	def checkpoint_state(self):
+		self.flush()
+		return {'num_steps': self.num_steps, 'counts': dict(self.counts), 'open_distances': self.open_distances.tolist(),
+				'num_resets': self.num_resets.tolist(), 'sizes': {name: column_file.tell() for name, column_file in self.files.items()}}
+
+	# Rolls the sink back to a state of checkpoint_state, dropping everything written after it
+	def restore(self, state):
+		self.buffered = 0
+		self.num_steps = state['num_steps']
+		self.counts = dict(state['counts'])
+		self.open_distances = np.array(state['open_distances'], dtype=float)
+		self.num_resets = np.array(state['num_resets'], dtype=int)
+		for name, column_file in self.files.items():
+			column_file.truncate(state['sizes'][name])
+		self.write_metadata()
+
+	def write_metadata(self):
+		columns = {name: {'dtype': dtype, 'shape': [self.num_steps, self.num_users] + list(shape)} for name, (dtype, shape) in STEP_COLUMNS.items()}
+		for name, dtype in USER_COLUMNS.items():
+			columns[name] = {'dtype': dtype, 'shape': [self.counts[name]]}
+			columns[name + '_users'] = {'dtype': '<i4', 'shape': [self.counts[name]]}
+		content = {'format': SINK_FORMAT, 'complete': self.closed, 'num_steps': self.num_steps, 'num_users': self.num_users,
+				   'identities': self.identities, 'columns': columns, 'metadata': self.metadata}
+
+		write_json(os.path.join(self.directory, 'metadata.json'), content)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+
+# JSON representation of the values that are not JSON serializable, e.g. environment factories in the parameters
+def describe(value):
+	if callable(value):
+		return getattr(value, '__name__', str(value))
+	if isinstance(value, np.generic):
+		return value.item()
+	return str(value)
+
+
+# Writes the content as JSON to a temporary file first, so that readers never see a partial file
+def write_json(path, content):
+	handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.json')
+	with os.fdopen(handle, 'w') as json_file:
+		json.dump(content, json_file, indent=1, default=describe)
+	os.replace(temporary, path)
+
+
+# Loads a run written by a ResultSink. Returns the metadata.json content, with the columns replaced by read-only
+# memory-mapped arrays (nothing is read from disk until the arrays are accessed).
+def open_run(directory):
+	with open(os.path.join(directory, 'metadata.json')) as metadata_file:
+		run = json.load(metadata_file)
+
+	columns = {}
+	for name, column in run['columns'].items():
+		shape = tuple(column['shape'])
+		if 0 in shape:
+			columns[name] = np.empty(shape, dtype=column['dtype'])
+		else:
+			columns[name] = np.memmap(os.path.join(directory, name + '.bin'), dtype=column['dtype'], mode='r', shape=shape)
+	run['columns'] = columns
+	return run
+
+
+# Per-user values of a per-user column (e.g. 'distances' or 'mse') of an opened run, as a list with one array per user
+def user_values(run, name):
+	users = np.asarray(run['columns'][name + '_users'])
+	values = run['columns'][name]
+	return [np.asarray(values[users == user]) for user in range(run['num_users'])]
+
+
+# Exports a run to a single compressed .npz file, with the metadata as a JSON string in the 'metadata' entry
+def export_npz(directory, path):
+	run = open_run(directory)
+	columns = run.pop('columns')
+	np.savez_compressed(path, metadata=json.dumps(run), **columns)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for loading and aggregating stored sweep results (see sweep.run_sweep and result_sink). The columns of each
+cell are memory-mapped, so only the data needed by an aggregate is read, and the aggregates (resets per user,
+distributions of the distances between resets, quantiles of the prediction errors, execution times) are computed with
+sort-based grouping instead of Python loops over the values. The results printed by the earlier versions of the
+examples (the data_visualizations/ACM_MMSys_2021/data_users_*.py files) can be converted into the same format.
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import json
+import os
+import re
+import numpy as np
+from result_sink import ResultSink, open_run, write_json
+
+
+# Loads the description of a sweep stored by run_sweep (its grid and the parameters and directory of each cell)
+def open_sweep(directory):
+	with open(os.path.join(directory, 'sweep.json')) as sweep_file:
+		sweep = json.load(sweep_file)
+	sweep['directory'] = directory
+	return sweep
+
+
+# Opened runs of all cells of a sweep, in grid order (the columns are memory-mapped, see result_sink.open_run)
+def open_cells(sweep):
+	return [open_run(os.path.join(sweep['directory'], cell['directory'])) for cell in sweep['cells']]
+
+
+# Number of resets per user of a run, from its metadata if stored there, counted from the reset events otherwise
+def resets_per_user(run):
+	if 'num_resets' in run['metadata']:
+		return np.array(run['metadata']['num_resets'])
+	return np.count_nonzero(run['columns']['resets'], axis=0)
+
+
+# Sorts the values of a per-user column by user (and by value within each user). Returns the sorted values and the
+# (U+1,) boundaries of the users in them.
+def sort_by_user(run, name):
+	users = np.asarray(run['columns'][name + '_users'])
+	values = np.asarray(run['columns'][name])
+	order = np.lexsort((values, users))
+	bounds = np.concatenate([[0], np.cumsum(np.bincount(users, minlength=run['num_users']))])
+	return values[order], bounds
+
+
+# Values of a per-user column (e.g. 'distances' or 'mse') as a list with the sorted values of each user
+def values_per_user(run, name):
+	values, bounds = sort_by_user(run, name)
+	return np.split(values, bounds[1:-1])
+
+
+# (U,Q) quantiles of a per-user column (linear interpolation, as np.quantile), NaN for the users without values
+def quantiles_per_user(run, name, quantiles=(0.25, 0.5, 0.75)):
+	values, bounds = sort_by_user(run, name)
+	counts = np.diff(bounds)
+	position = bounds[:-1, None] + np.asarray(quantiles)[None, :] * np.maximum(counts - 1, 0)[:, None]
+	below = np.floor(position).astype(int)
+	above = np.minimum(below + 1, np.maximum(bounds[1:, None] - 1, 0))
+	if len(values) == 0:
+		return np.full(position.shape, np.nan)
+	below = np.minimum(below, len(values) - 1)
+	above = np.minimum(above, len(values) - 1)
+	result = values[below] + (position - below) * (values[above] - values[below])
+	return np.where(counts[:, None] > 0, result, np.nan)
+
+
+# Box plot statistics of a per-user column, as expected by matplotlib's Axes.bxp: quartiles, notches and whiskers at
+# the most extreme values within 1.5 IQR of the box, but not inside of it (as matplotlib.cbook.boxplot_stats), plus the
+# values beyond the whiskers
+def box_stats(run, name):
+	values, bounds = sort_by_user(run, name)
+	q1, median, q3 = quantiles_per_user(run, name, (0.25, 0.5, 0.75)).T
+	iqr = q3 - q1
+	counts = np.diff(bounds)
+
+	stats = []
+	for user in range(run['num_users']):
+		group = values[bounds[user]:bounds[user + 1]]
+		if len(group) == 0:
+			continue
+		low = np.searchsorted(group, q1[user] - 1.5 * iqr[user], 'left')
+		high = np.searchsorted(group, q3[user] + 1.5 * iqr[user], 'right')
+		notch = 1.57 * iqr[user] / np.sqrt(counts[user])
+		stats.append({
+			'label': str(run['identities'][user]), 'med': median[user], 'q1': q1[user], 'q3': q3[user],
+			'cilo': median[user] - notch, 'cihi': median[user] + notch, 'mean': np.mean(group),
+			'whislo': min(group[min(low, len(group) - 1)], q1[user]), 'whishi': max(group[max(high - 1, 0)], q3[user]),
+			'fliers': np.concatenate([group[:low], group[high:]]),
+		})
+	return stats
+
+
+# One row per cell of the sweep with its swept parameters and its aggregates: resets per user and their mean,
+# quantiles of the distances between resets and of the prediction errors per user, and the execution times
+def aggregate_sweep(sweep, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+	names = list(sweep['grid'])
+	fields = [(name, object) for name in names]
+	fields += [('resets', object), ('mean_resets', float), ('distance_quantiles', object), ('mse_quantiles', object),
+			   ('time', float), ('time_full', float)]
+
+	table = np.empty(len(sweep['cells']), dtype=fields)
+	for row, (cell, run) in enumerate(zip(sweep['cells'], open_cells(sweep))):
+		for name in names:
+			table[name][row] = cell['parameters'][name]
+		resets = resets_per_user(run)
+		table['resets'][row] = resets
+		table['mean_resets'][row] = np.mean(resets)
+		table['distance_quantiles'][row] = quantiles_per_user(run, 'distances', quantiles)
+		table['mse_quantiles'][row] = quantiles_per_user(run, 'mse', quantiles)
+		table['time'][row] = run['metadata'].get('time', np.nan)
+		table['time_full'][row] = run['metadata'].get('time_full', np.nan)
+	return table
+
+
+# Parses a results file printed by the earlier versions of the examples (one "name = [values]" line per result, with
+# the sections of the users announced by "# Number of users equals N" comments) into a dict num_users -> results
+def parse_legacy_results(path):
+	sections = {}
+	assignment = re.compile(r'^(time_full|time|resets|dist_usr|mse)_(\d+)(?:_(\d+))? = (.*)$')
+	with open(path) as results_file:
+		for line in results_file:
+			match = assignment.match(line)
+			if match is None:
+				continue
+			name, num_users, identity, value = match.groups()
+			section = sections.setdefault(int(num_users), {'distances': {}, 'mse': {}})
+			value = value.strip()
+			if value.startswith('['):
+				value = np.array(value.strip('[]').split(','), dtype=float) if value.strip('[]') else np.empty(0)
+			else:
+				value = float(value)
+			if name == 'dist_usr':
+				section['distances'][int(identity)] = value
+			elif name == 'mse':
+				section['mse'][int(identity)] = value
+			else:
+				section[name] = value
+	return sections
+
+
+# Converts legacy results files (dict env_size -> path) into a sweep directory over env_size and num_users, which can
+# then be loaded and aggregated like the output of run_sweep
+def convert_legacy_results(paths, output_dir):
+	os.makedirs(output_dir, exist_ok=True)
+	cells = []
+	for env_size, path in sorted(paths.items()):
+		for num_users, section in sorted(parse_legacy_results(path).items()):
+			directory = 'cell_' + str(len(cells))
+			with ResultSink(os.path.join(output_dir, directory), num_users) as sink:
+				for identity in range(1, num_users + 1):
+					sink.append_user_values('distances', identity - 1, section['distances'].get(identity, []))
+					sink.append_mse(identity - 1, section['mse'].get(identity, []))
+				sink.num_resets = np.asarray(section['resets'], dtype=int).reshape(num_users)
+				sink.metadata.update(time=section.get('time'), time_full=section.get('time_full'), source=path)
+			cells.append({'directory': directory, 'parameters': {'env_size': env_size, 'num_users': num_users}})
+
+	grid = {'env_size': sorted(paths), 'num_users': sorted({cell['parameters']['num_users'] for cell in cells})}
+	write_json(os.path.join(output_dir, 'sweep.json'), {'grid': grid, 'cells': cells})
+	return open_sweep(output_dir)
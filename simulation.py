@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library implementing the simulation loop. Given a redirected walking algorithm, a set of users with their virtual
+movement trajectories and a reset threshold, the simulation derives the physical movements of the users step by step
+and captures the macro-scale performance metrics (number of resets and distances between resets per user).
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import math
+import numpy as np
+import algorithm
+import environment
+from user import LATTICE_MOVES
+
+
+# Per-step work of the simulation, implemented with the per-user methods of the RedirectedWalker as in the original
+# simulation loop, whose results it reproduces bit for bit (see tests/test_algorithm.py). Returns the (U,2) physical
+# steps and the (U,) reset flags of all users for the current step, without moving the users. Any function with the
+# same signature can be passed to the Simulation as its step kernel. The threshold is a scalar or a (U,) array, the
+# users with an infinite threshold are known not to need a reset and are not checked (see reset_mode 'event').
+def reference_step(rdw, users, threshold):
+
+	# At each step of the evaluation, calculate force_vectors and moving_rates. Force vectors are used to define the
+	# optimal physical movement direction for each user (i.e., to avoid hitting environmental obstacles and other users).
+	# Moving rates provide constraints on how much the user can be steered in the physical world without noticing it
+	# in the virtual one. Force vectors are (at the moment) calculated using the APF-RDW algorithm
+	force_vectors, env_vectors, user_vectors = rdw.calculate_force_vectors(users)
+	moving_rates = rdw.calculate_max_rotations(users)
+
+	steps = np.empty((len(users), 2))
+	resets = np.zeros(len(users), dtype=bool)
+
+	# Iterate through all users and calculate their next physical step based on the force vectors and moving rates.
+	for iter_temp, user in enumerate(users):
+
+		# step defines the user's physical offset from the current location
+		step = rdw.calculate_next_physical_step(user, moving_rates[iter_temp], force_vectors[iter_temp])
+
+		# (Jakob) Redirection was implemented with a 180 degree rotation. The paper however proposes to rotate towards
+		# the force vector. This moves the user away from all obstacles (walls and other users) optimally meaning
+		# there's no reason to check for users and walls separately.
+		# The following method checks if a collision is about to happen (threshold selected arbitrarily for now)
+		user_threshold = threshold[iter_temp] if np.ndim(threshold) else threshold
+		if np.isinf(user_threshold):
+			steps[iter_temp] = step
+			continue
+		reset_step = rdw.reset_if_needed(force_vectors[iter_temp], env_vectors[iter_temp], user_vectors[iter_temp], threshold = user_threshold)
+
+		if reset_step is not None:
+			step = reset_step
+			resets[iter_temp] = True
+
+		steps[iter_temp] = step
+
+	return steps, resets
+
+
+# Same per-step work as reference_step, computed for all users at once with the batched methods of the RedirectedWalker
+def vectorized_step(rdw, users, threshold):
+	positions = np.array([user.get_phy_loc() for user in users])
+	previous = np.array([user.get_phy_loc(-1) for user in users])
+	return rdw.calculate_steps(positions, previous, threshold)
+
+# Kernels that check the resets of all users at once, see ResetSchedule
+vectorized_step.batched_resets = True
+
+
+RESET_MODES = ('threshold', 'event')
+
+
+# Schedule of the reset checks of the users of a simulation, with (...,U) leading dimensions. With reset_mode 'event',
+# each checked user gets a conservative number of steps during which no reset can be needed (see
+# RedirectedWalker.calculate_safe_steps) and is not checked again before. Users without any safe step (e.g. walking
+# along a wall) are checked at every step, and their bound is evaluated again after an exponential backoff of at most
+# max_backoff steps, so that it is not computed in vain at every step. With reset_mode 'threshold' (or with the
+# interpolated wall terms of a wall_field, for which the bound does not hold) all users are checked at every step.
+# So are they with batched_resets, for the kernels that check the resets of all users at once: these get the vector
+# norms of the checks from their force field anyway, so skipping checks saves them nothing, while the bound made 120 s
+# runs of the vectorized kernel 10-40% slower. The bound can only pay off with per-user checks such as the ones of
+# reference_step.
+class ResetSchedule:
+	def __init__(self, shape, reset_mode='threshold', max_backoff=16, batched_resets=False):
+		if reset_mode not in RESET_MODES:
+			raise ValueError("Unknown reset mode '" + str(reset_mode) + "', expected one of " + ', '.join(RESET_MODES))
+		self.reset_mode = reset_mode
+		self.max_backoff = max_backoff
+		self.batched_resets = batched_resets
+		self.next_checks = np.zeros(shape, dtype=int) # Step from which on each user has to be checked again
+		self.next_bounds = np.zeros(shape, dtype=int) # Step from which on the bound of each user is evaluated again
+		self.backoffs = np.zeros(shape, dtype=int)
+		self.num_checks = 0 # Number of reset checks evaluated so far
+
+	# Thresholds of the users for the step after the (...,U,2) positions of step time_iter, infinite for the users that
+	# are not checked (see reference_step)
+	def thresholds(self, rdw, positions, threshold, time_iter):
+		if self.reset_mode == 'threshold' or self.batched_resets or rdw.wall_field is not None:
+			self.num_checks += self.next_checks.size
+			return threshold
+
+		checked = self.next_checks <= time_iter
+		bounded = checked & (self.next_bounds <= time_iter)
+		if np.any(bounded):
+			safe_steps = rdw.calculate_safe_steps(positions, threshold, bounded)
+			backoffs = np.where(safe_steps > 0, 0, np.minimum(2 * self.backoffs[bounded] + 1, self.max_backoff))
+			self.next_checks[bounded] = time_iter + 1 + safe_steps
+			self.next_bounds[bounded] = time_iter + 1 + backoffs
+			self.backoffs[bounded] = backoffs
+		self.num_checks += np.count_nonzero(checked)
+		return np.where(checked, threshold, np.inf)
+
+
+# Runs the RedirectedWalker on the given users. The physical locations, reset events and step lengths of all users are
+# stored in preallocated (num_steps,U,...) arrays, num_steps being rdw.steps by default. The first step of each user
+# follows its virtual trajectory without redirection to kick-start the algorithm and is not counted in the metrics.
+# With a sink (see result_sink.ResultSink), every step is streamed to it as well (the caller closes the sink). Without
+# keep_history, only the latest two steps are kept in memory (in the arrays and the users' physical trajectories), so
+# that memory stays flat for long runs, and the results have to be read from the sink. With metrics (see
+# online_metrics.OnlineMetrics), the distributions of the metrics are summarized online as well.
+# With reset_mode 'event', the reset checks are skipped until a reset becomes possible (see ResetSchedule), which gives
+# the same resets as checking every user at every step (reset_mode 'threshold'). Step kernels that check all users at
+# once are marked with a batched_resets attribute, and always check every user.
+class Simulation:
+	def __init__(self, rdw, users, threshold, step_kernel=reference_step, num_steps=None, sink=None, keep_history=True,
+				 reset_mode='threshold', metrics=None):
+		self.rdw = rdw
+		self.users = users
+		self.threshold = threshold
+		self.step_kernel = step_kernel
+		self.reset_schedule = ResetSchedule(len(users), reset_mode, batched_resets=getattr(step_kernel, 'batched_resets', False))
+		self.next_substeps = 0 # Step from which on the adaptive step size is evaluated again
+		self.substeps_backoff = 0
+		self.num_steps = rdw.steps if num_steps is None else num_steps
+		self.sink = sink
+		self.metrics = metrics
+		self.keep_history = keep_history
+		rows = self.num_steps if keep_history else 2 # Step t is stored in row t % rows
+
+		self.positions = np.empty((rows, len(users), 2)) # Physical locations of all users
+		self.resets = np.zeros((rows, len(users)), dtype=bool) # Whether a reset occurred in a given step
+		self.step_lengths = np.zeros((rows, len(users))) # Distance passed in a given step
+
+		# Let the first step be taken without redirection to kick-start stuff
+		for user in users:
+			if keep_history:
+				user.phy_locations.reserve(self.num_steps)
+			if len(user.phy_locations) == 1:
+				user.phy_locations.append(user.virt_locations[1])
+		self.positions[0] = [user.get_phy_loc(-1) for user in users]
+		self.positions[1] = [user.get_phy_loc() for user in users]
+		self.time_iter = 1 # Index of the latest stored step
+
+		if sink is not None:
+			for row in (0, 1):
+				sink.append_step(self.positions[row], self.resets[row], self.step_lengths[row])
+
+	# Simulated time in seconds
+	@property
+	def time(self):
+		return self.time_iter * self.rdw.delta_t
+
+	@property
+	def done(self):
+		return self.time_iter >= self.num_steps - 1
+
+	# Advances all users by one step, or by a macro step of several steps with the adaptive time-stepping of the
+	# RedirectedWalker (see calculate_substeps, at most max_substeps steps if given). Macro steps are computed with
+	# calculate_macro_steps instead of the step kernel (which may take fewer steps than asked for), and all their steps
+	# are stored, so the results keep the fixed delta_t resolution. Returns False if the simulation was already finished.
+	def step(self, max_substeps=None):
+		if self.done:
+			return False
+
+		latest = self.time_iter % len(self.positions)
+		threshold = self.reset_schedule.thresholds(self.rdw, self.positions[latest], self.threshold, self.time_iter)
+
+		# Where no macro step is possible or accepted (e.g. in crowded rooms), the step size is evaluated again after an
+		# exponential backoff of at most 16 steps, so that it is not computed in vain at every step
+		num_substeps = 1
+		adaptive = self.rdw.max_substeps > 1 and self.time_iter >= self.next_substeps
+		if adaptive:
+			num_substeps = min(int(self.rdw.calculate_substeps(self.positions[latest], self.threshold)),
+							   self.num_steps - 1 - self.time_iter, max_substeps or self.num_steps)
+		if num_substeps > 1:
+			previous = self.positions[(self.time_iter - 1) % len(self.positions)]
+			steps, resets = self.rdw.calculate_macro_steps(self.positions[latest], previous, threshold, num_substeps)
+			num_substeps = len(steps)
+		else:
+			steps, resets = self.step_kernel(self.rdw, self.users, threshold)
+			steps = steps[None]
+		if adaptive:
+			self.substeps_backoff = 0 if num_substeps > 1 else min(2 * self.substeps_backoff + 1, 16)
+			self.next_substeps = self.time_iter + 1 + self.substeps_backoff
+
+		for substep in range(num_substeps):
+			latest = self.time_iter % len(self.positions)
+			self.time_iter += 1
+			row = self.time_iter % len(self.positions)
+			self.positions[row] = self.positions[latest] + steps[substep]
+			self.resets[row] = resets if substep == 0 else False
+			self.step_lengths[row] = algorithm.batched_norm(steps[substep])
+
+			if self.sink is not None:
+				self.sink.append_step(self.positions[row], self.resets[row], self.step_lengths[row])
+			if self.metrics is not None:
+				self.metrics.update(self.resets[row], self.step_lengths[row])
+
+			# Update the users' physical trajectories with the newest locations
+			for user, location in zip(self.users, self.positions[row]):
+				user.phy_locations.append(location)
+				if not self.keep_history:
+					user.phy_locations.keep_last(2)
+				# Pull the next virtual location for users following a streamed trajectory model
+				user.advance_virtual_path()
+
+		return True
+
+	# Runs the simulation to the end. With a checkpoint (see checkpoint.Checkpoint), its state is saved periodically
+	# while running and once more at the end.
+	def run(self, checkpoint=None):
+		if checkpoint is None:
+			while self.step():
+				pass
+			return self
+		while self.step():
+			checkpoint.update(self)
+		checkpoint.save(self)
+		return self
+
+	# Runs until the simulated time reaches t seconds (or the end of the simulation)
+	def run_until(self, t):
+		while self.time < t and self.step(max(int(math.ceil(round((t - self.time) / self.rdw.delta_t, 9))), 1)):
+			pass
+		return self
+
+	def check_history(self):
+		if not self.keep_history:
+			raise ValueError("The metrics of a simulation without keep_history have to be read from its sink")
+
+	# Definition of the performance metric entitled number of resets per user
+	def num_resets_per_user(self):
+		self.check_history()
+		counts = np.sum(self.resets[:self.time_iter + 1], axis=0)
+		return {user.identity: int(count) for user, count in zip(self.users, counts)}
+
+	# All distances between resets per user. A reset starts a new distance with the length of the reset step, other
+	# steps are added to the latest distance (the first distance starts at 0 with the first redirected step).
+	def distance_between_resets_per_user(self):
+		self.check_history()
+		distances = {}
+		for index, user in enumerate(self.users):
+			resets = self.resets[2:self.time_iter + 1, index]
+			segments = np.cumsum(resets)
+			distances[user.identity] = np.bincount(segments, weights=self.step_lengths[2:self.time_iter + 1, index], minlength=segments[-1] + 1 if len(segments) else 1).tolist()
+		return distances
+
+
+# Runs R independent replicas of the same experiment (e.g. with different random initial locations) in one array pass.
+# Initial locations and first steps are (R,U,2) arrays, the first step of each user being its first virtual step that
+# is taken without redirection. The state of all replicas is advanced at once with the batched methods of the
+# RedirectedWalker, so R replicas cost roughly the interpreter overhead of a single run. Results are stored as in the
+# Simulation, with an additional replica dimension after the step dimension. As the resets are checked in a batch as
+# well, all users are checked at every step with any reset_mode (see ResetSchedule).
+class ReplicaSimulation:
+	def __init__(self, rdw, initial_locations, first_steps, threshold, num_steps=None, reset_mode='threshold'):
+		initial_locations = np.asarray(initial_locations, dtype=float)
+		self.rdw = rdw
+		self.threshold = threshold
+		self.num_steps = rdw.steps if num_steps is None else num_steps
+		self.reset_schedule = ResetSchedule(initial_locations.shape[:-1], reset_mode, batched_resets=True)
+
+		self.positions = np.empty((self.num_steps,) + initial_locations.shape)
+		self.resets = np.zeros((self.num_steps,) + initial_locations.shape[:-1], dtype=bool)
+		self.step_lengths = np.zeros((self.num_steps,) + initial_locations.shape[:-1])
+
+		self.positions[0] = initial_locations
+		self.positions[1] = initial_locations + first_steps
+		self.time_iter = 1
+
+	# Creates num_replicas replicas of num_users users with initial locations drawn uniformly within the environment and
+	# a random first lattice step (or the fixed direction i for user i, as in the MMSys example)
+	@classmethod
+	def random(cls, rdw, num_replicas, num_users, threshold, rng=None, fixed_dir=False, num_steps=None, reset_mode='threshold'):
+		rng = np.random.default_rng(rng)
+		lower = np.min(rdw.walls, axis=(0, 1))
+		upper = np.max(rdw.walls, axis=(0, 1))
+		initial_locations = rng.uniform(lower, upper, size=(num_replicas, num_users, 2))
+		# Redraw the locations that fall within a hole or outside of a non-rectangular environment
+		outside = [index for index in np.ndindex(num_replicas, num_users) if not environment.is_inside(rdw.env, initial_locations[index])]
+		while outside:
+			for index in outside:
+				initial_locations[index] = rng.uniform(lower, upper)
+			outside = [index for index in outside if not environment.is_inside(rdw.env, initial_locations[index])]
+		if fixed_dir:
+			directions = np.broadcast_to(np.where(np.arange(1, num_users + 1) < 4, np.arange(1, num_users + 1), 4), (num_replicas, num_users))
+		else:
+			directions = rng.integers(1, 5, size=(num_replicas, num_users))
+		return cls(rdw, initial_locations, LATTICE_MOVES[directions] * rdw.delta_t, threshold, num_steps, reset_mode)
+
+	@property
+	def time(self):
+		return self.time_iter * self.rdw.delta_t
+
+	@property
+	def done(self):
+		return self.time_iter >= self.num_steps - 1
+
+	def step(self):
+		if self.done:
+			return False
+
+		threshold = self.reset_schedule.thresholds(self.rdw, self.positions[self.time_iter], self.threshold, self.time_iter)
+		steps, resets = self.rdw.calculate_steps(self.positions[self.time_iter], self.positions[self.time_iter - 1], threshold)
+
+		self.time_iter += 1
+		self.positions[self.time_iter] = self.positions[self.time_iter - 1] + steps
+		self.resets[self.time_iter] = resets
+		self.step_lengths[self.time_iter] = algorithm.batched_norm(steps)
+		return True
+
+	def run(self):
+		while self.step():
+			pass
+		return self
+
+	def run_until(self, t):
+		while self.time < t and self.step():
+			pass
+		return self
+
+	# (R,U) array with the number of resets per replica and user
+	def num_resets(self):
+		return np.sum(self.resets[:self.time_iter + 1], axis=0)
+
+	# All distances between resets of a user in a replica, see Simulation.distance_between_resets_per_user
+	def distance_between_resets(self, replica, user):
+		resets = self.resets[2:self.time_iter + 1, replica, user]
+		segments = np.cumsum(resets)
+		return np.bincount(segments, weights=self.step_lengths[2:self.time_iter + 1, replica, user], minlength=segments[-1] + 1 if len(segments) else 1).tolist()
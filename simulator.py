@@ -24,9 +24,11 @@ import environment
 from user import User
 import visualization
 import algorithm
+import trajectory_models
+import simulation
+import profiling
 from algorithm import rad
 import numpy as np
-from collections import defaultdict
 import pprint
 
 
@@ -37,6 +39,7 @@ gamma = 1.4 # Gamma causes the influence of users to fall off exponentially inst
 radius = 7.5 # r is the radius of the arc on which a walking user is being redirected
 movement_threshold = 0.1 # If linear velocity is below a minimum movement threshold moving_rate = 0
 max_move_rate = 15 # Maximum rotational movement the user can tolerate without noticing
+profile = False # If True, the time spent in each phase of the simulation is printed (see profiling.Profiler)
 
 # --------------------------------------------------
 
@@ -57,58 +60,24 @@ usr2.fill_virtual_path(rdw.steps, rdw.delta_t, None)
 usr3 = User([2.0, 0.0], 1.0, 3)
 usr3.fill_virtual_path(rdw.steps, rdw.delta_t, None)
 
+# Alternatively, a virtual movement model can be streamed instead of precomputing rdw.steps points, e.g.:
+# usr3.follow_virtual_model(trajectory_models.CorrelatedRandomWalk(turn_std=rad(10)), rdw.delta_t, keep_history=False)
+
 
 users = [usr1, usr2, usr3]
 
 # --------------------------------------------------
 
 # Iterate through all steps of the simulation (check simulation_time parameter, as it includes the resolution).
-num_resets_per_users = defaultdict(int) # Definition of the performance metric entitled number of resets per user
-distance_between_resets_per_user = defaultdict(int) # Storing all distances between resets per user
-
-for user in users:
-	#Let the first step be taken without redirection to kick-start stuff
-	user.phy_locations.append(user.virt_locations[1])
-	distance_between_resets_per_user[user.identity] = []
-	distance_between_resets_per_user[user.identity].append(0.0) 
-
-for time_iter in range(0, rdw.steps - 2):
-
-	# At each step of the evaluation, calculate force_vectors and moving_rates. Force vectors are used to define the 
-	# optimal physical movement direction for each user (i.e., to avoid hitting environmental obstacles and other users). 
-	# Moving rates provide constraints on how much the user can be steered in the physical world without noticing it 
-	# in the virtual one. Force vectors are (at the moment) calculated using the APF-RDW algorithm
-	force_vectors, env_vectors, user_vectors = rdw.calculate_force_vectors(users)
-	moving_rates = rdw.calculate_max_rotations(users)
-
-	iter_temp = 0
-
-	# Iterate through all users and calculate their next physical step based on the force vectors and moving rates. 
-	for user in users:
-
-		# x_step and y_step define the user's physical offset from the current location
-		step = rdw.calculate_next_physical_step(user, moving_rates[iter_temp], force_vectors[iter_temp])
-
-		# The following method checks if a collision is about to happen (threshold selected arbitrarily for now)
-		reset_step 	= rdw.reset_if_needed(force_vectors[iter_temp], env_vectors[iter_temp], user_vectors[iter_temp], threshold = 50)
-
-		reset_occurred = reset_step is not None
-		if reset_occurred:
-			step = reset_step
-			# Create a new instance in the list representing distances passed without a reset
-			distance_between_resets_per_user[user.identity].append(algorithm.norm(step))  
-		else:
-			# Add the step in latest instance of the list representing distances passed without a reset
-			distance_between_resets_per_user[user.identity][-1] += algorithm.norm(step)  
-
-
-		# This is just for storing the number of rotations per user
-		num_resets_per_users[user.identity] += reset_occurred
-
-		# Update the user's physical trajectory with the newest location
-		user.phy_locations.append(user.get_phy_loc() + step)
-
-		iter_temp += 1
+# The simulation stores the number of resets per user and all distances between resets per user as performance metrics.
+# The threshold for detecting an imminent collision is selected arbitrarily for now.
+sim = simulation.Simulation(rdw, users, threshold = 50)
+profiler = profiling.Profiler()
+if profile:
+	profiler.enable()
+sim.run()
+if profile:
+	print(profiler.disable().table())
 
 
 # ---------- Make your decisions ----------------------------
@@ -117,8 +86,8 @@ for time_iter in range(0, rdw.steps - 2):
 visualization.visualize_paths(rdw.steps, users)
 
 # Macro-scale performance metrics 
-# print(num_resets_per_users) 
-pprint.pprint(distance_between_resets_per_user) 
+# print(sim.num_resets_per_user())
+pprint.pprint(sim.distance_between_resets_per_user())
 
 # Micro-scale performance metrics (!! Substantially longer simulation time !!) 
 print(usr1.get_phy_path())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for spatial queries over the walls of an environment and over the users. A uniform grid is laid over the
+environment and, for each of its cells, the walls that can be the nearest one or that can be within a given radius of a
+point in the cell are precomputed once. Queries then only evaluate these few candidate walls, so that their cost depends
+on the local complexity of the environment and not on its total number of walls (e.g. for warehouse-scale venues).
+Users are binned into a cell list at every step, so that only the users in neighboring cells are considered for the
+user-user terms of the force field (e.g. for arenas with hundreds of concurrent users).
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import math
+import numpy as np
+from algorithm import batched_norm, get_vectors_from_segments, calculate_force_field
+
+
+# Uniform grid index over the (W,2,2) wall end-points. Radius is the distance used by within_radius (e.g. the cutoff
+# beyond which walls do not contribute to the force field), cell_size defaults to roughly one wall per cell. Points
+# outside the grid fall back to all walls, so that the results are always exact.
+class SegmentIndex:
+	def __init__(self, walls, radius=None, cell_size=None, max_cells=2 ** 20):
+		self.walls = np.asarray(walls, dtype=float).reshape(-1, 2, 2)
+		self.radius = radius
+
+		margin = 0.0 if radius is None else radius
+		self.lower = np.min(self.walls, axis=(0, 1)) - margin
+		upper = np.max(self.walls, axis=(0, 1)) + margin
+		extent = np.maximum(upper - self.lower, 1e-9)
+		if cell_size is None:
+			cell_size = math.sqrt(extent[0] * extent[1] / len(self.walls))
+			if radius is not None:
+				cell_size = min(cell_size, radius)
+		cell_size = max(cell_size, math.sqrt(extent[0] * extent[1] / max_cells))
+		self.cell_size = cell_size
+		self.shape = np.maximum(np.ceil(extent / cell_size), 1).astype(int)
+
+		# Distances between the cell centers and all walls, computed in blocks of cells to bound the memory
+		x = self.lower[0] + (np.arange(self.shape[0]) + 0.5) * cell_size
+		y = self.lower[1] + (np.arange(self.shape[1]) + 0.5) * cell_size
+		centers = np.stack(np.meshgrid(x, y, indexing='ij'), axis=-1).reshape(-1, 2)
+		half_diagonal = cell_size * math.sqrt(2) / 2
+
+		nearest_lists = []
+		within_lists = []
+		for block in range(0, len(centers), 4096):
+			distances = self.distances(centers[block:block + 4096])
+			# A wall further than the nearest one plus a cell diagonal from the center cannot be the nearest to any
+			# point in the cell, and one further than radius plus half a diagonal is not within radius of any point
+			closest = np.min(distances, axis=1, keepdims=True)
+			nearest_lists += [np.flatnonzero(row) for row in distances <= closest + 2 * half_diagonal]
+			if radius is not None:
+				within_lists += [np.flatnonzero(row) for row in distances <= radius + half_diagonal]
+
+		# The last row holds all walls, for the points outside the grid
+		all_walls = np.arange(len(self.walls))
+		self.nearest_table = make_table(nearest_lists + [all_walls])
+		self.within_table = make_table(within_lists + [all_walls]) if radius is not None else None
+
+	# (N,W) distances between the (N,2) points and all walls
+	def distances(self, points):
+		return batched_norm(get_vectors_from_segments(points[:, None, :], self.walls[:, 0], self.walls[:, 1]))
+
+	# Flat cell index of the (...,2) points, the extra last row of the tables for the points outside the grid
+	def cells(self, points):
+		ij = np.floor((points - self.lower) / self.cell_size).astype(int)
+		inside = np.all((ij >= 0) & (ij < self.shape), axis=-1)
+		return np.where(inside, ij[..., 0] * self.shape[1] + ij[..., 1], self.shape[0] * self.shape[1])
+
+	# Index of the nearest wall to each of the (...,2) points and the (...,2) vector from its nearest point to the point
+	def nearest(self, points):
+		points = np.asarray(points, dtype=float)
+		candidates = gather(self.nearest_table, self.cells(points))
+		walls = self.walls[np.maximum(candidates, 0)]
+		vectors = get_vectors_from_segments(points[..., None, :], walls[..., 0, :], walls[..., 1, :])
+		distances = np.where(candidates >= 0, batched_norm(vectors), np.inf)
+		best = np.argmin(distances, axis=-1)[..., None]
+		return np.take_along_axis(candidates, best, axis=-1)[..., 0], np.take_along_axis(vectors, best[..., None], axis=-2)[..., 0, :]
+
+	# Indices of the walls within radius of each of the (...,2) points, as a sorted (...,K) array padded with -1. With
+	# include_nearest, the nearest wall is included even if it is further away.
+	def within_radius(self, points, include_nearest=False):
+		points = np.asarray(points, dtype=float)
+		candidates = gather(self.within_table, self.cells(points))
+		walls = self.walls[np.maximum(candidates, 0)]
+		distances = batched_norm(get_vectors_from_segments(points[..., None, :], walls[..., 0, :], walls[..., 1, :]))
+		within = np.where((candidates >= 0) & (distances <= self.radius), candidates, -1)
+		if include_nearest:
+			nearest = self.nearest(points)[0][..., None]
+			nearest = np.where(np.any(within == nearest, axis=-1, keepdims=True), -1, nearest)
+			within = np.sort(np.concatenate([within, nearest], axis=-1), axis=-1)
+		return within
+
+
+# Packs the lists of wall indices of all cells into a (starts, indices) pair, as in a CSR sparse matrix
+def make_table(lists):
+	starts = np.zeros(len(lists) + 1, dtype=int)
+	starts[1:] = np.cumsum([len(row) for row in lists])
+	return starts, np.concatenate(lists).astype(int) if lists else np.empty(0, dtype=int)
+
+
+# Rows of the table for the given (...) cells, as a (...,K) array padded with -1, K being the longest of the rows
+def gather(table, cells):
+	starts, indices = table
+	lengths = starts[cells + 1] - starts[cells]
+	width = max(int(np.max(lengths, initial=0)), 1)
+	offsets = np.arange(width)
+	positions = starts[cells][..., None] + offsets
+	return np.where(offsets < lengths[..., None], indices[np.minimum(positions, max(len(indices) - 1, 0))], -1)
+
+
+# Cell list over the users, with cells of the size of the cutoff radius, so that the neighbors of a user are within the
+# 3x3 cells around it. The cell list is rebuilt at every call, starting from the order of the previous call: users
+# barely move between two steps, so the keys are almost sorted and the stable sort is close to linear.
+class NeighborGrid:
+	def __init__(self, radius):
+		self.radius = radius
+		self.order = None
+
+	# Indices of the other users within radius of each of the (...,U,2) users (any leading dimensions being independent
+	# batches), as a (...,U,K) array in increasing order and padded with -1 at the end
+	def neighbors(self, positions):
+		positions = np.asarray(positions, dtype=float)
+		num_users = positions.shape[-2]
+		points = positions.reshape(-1, 2)
+		batch = np.arange(len(points)) // max(num_users, 1)
+
+		# Key of the cell of each user, the cells of different batches never being adjacent
+		cells = np.floor(points / self.radius).astype(np.int64)
+		lower = np.min(cells, axis=0, initial=0) - 1
+		span = np.max(cells, axis=0, initial=0) - lower + 2
+		keys = (batch * span[1] + cells[:, 1] - lower[1]) * span[0] + cells[:, 0] - lower[0]
+
+		if self.order is None or len(self.order) != len(keys):
+			self.order = np.arange(len(keys))
+		self.order = self.order[np.argsort(keys[self.order], kind='stable')]
+		sorted_keys = keys[self.order]
+
+		# Each row of the 3x3 block of cells is a contiguous range of keys, i.e., of the sorted users
+		starts = np.stack([np.searchsorted(sorted_keys, keys + row * span[0] - 1, 'left') for row in (-1, 0, 1)], axis=-1)
+		stops = np.stack([np.searchsorted(sorted_keys, keys + row * span[0] + 1, 'right') for row in (-1, 0, 1)], axis=-1)
+		counts = stops - starts
+		ends = np.cumsum(counts, axis=-1)
+		offsets = np.arange(max(int(np.max(ends[:, -1], initial=0)), 1))
+		row = np.minimum(np.sum(offsets[None, :, None] >= ends[:, None, :], axis=-1), 2)
+		slot = np.take_along_axis(starts, row, axis=-1) + offsets - np.take_along_axis(ends - counts, row, axis=-1)
+		candidates = self.order[np.minimum(slot, len(self.order) - 1)]
+
+		distances = batched_norm(points[candidates] - points[:, None, :])
+		valid = (offsets < ends[:, -1:]) & (candidates != np.arange(len(points))[:, None]) & (distances <= self.radius)
+
+		# Sort by user index, with the padding last
+		neighbors = np.sort(np.where(valid, candidates - (batch * num_users)[:, None], num_users), axis=-1)
+		neighbors = neighbors[:, :int(np.max(np.sum(valid, axis=-1), initial=0))]
+		neighbors[neighbors == num_users] = -1
+		return neighbors.reshape(positions.shape[:-1] + (neighbors.shape[-1],))
+
+
+# Error of the force field with the given cutoffs (in meters) against the exact one, at the (...,U,2) positions and
+# previous positions of the users (e.g. sim.positions[2:] and sim.positions[1:-1] of a Simulation, to cover all its
+# steps). With threshold, the fraction of the users for which the reset decision differs is reported as well.
+def cutoff_error_report(positions, previous, walls, gamma, user_cutoff=None, wall_cutoff=None, threshold=None):
+	positions = np.asarray(positions, dtype=float)
+	previous = np.asarray(previous, dtype=float)
+	walls = np.asarray(walls, dtype=float).reshape(-1, 2, 2)
+	wall_index = SegmentIndex(walls, wall_cutoff) if wall_cutoff is not None else None
+	user_index = NeighborGrid(user_cutoff) if user_cutoff is not None else None
+
+	exact = calculate_force_field(positions, previous, walls, gamma)
+	approximate = calculate_force_field(positions, previous, walls, gamma, wall_index=wall_index, user_index=user_index)
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		force_error = batched_norm(approximate[0] - exact[0]) / batched_norm(exact[0])
+		cos = np.clip(np.sum(approximate[0] * exact[0], axis=-1) / (batched_norm(approximate[0]) * batched_norm(exact[0])), -1, 1)
+	force_error = force_error[np.isfinite(force_error)]
+	angle_error = np.arccos(cos[np.isfinite(cos)])
+
+	report = {
+		'num_samples': int(np.prod(positions.shape[:-1])),
+		'kept_user_pairs': np.count_nonzero(batched_norm(approximate[2])) / max(np.count_nonzero(batched_norm(exact[2])), 1),
+		'kept_walls': np.count_nonzero(batched_norm(approximate[1])) / max(np.count_nonzero(batched_norm(exact[1])), 1),
+		'max_relative_force_error': np.max(force_error, initial=0),
+		'mean_relative_force_error': np.mean(force_error) if len(force_error) else 0.0,
+		'max_angle_error': np.max(angle_error, initial=0), # radians
+		'mean_angle_error': np.mean(angle_error) if len(angle_error) else 0.0,
+	}
+	if threshold is not None:
+		resets = [np.any(batched_norm(result[1]) > threshold, axis=-1) | np.any(batched_norm(result[2]) > threshold, axis=-1) for result in (exact, approximate)]
+		report['reset_mismatch'] = np.mean(resets[0] != resets[1])
+	return report
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library for running parameter sweeps. A sweep is defined by a grid of parameter values, over any argument of the
+RedirectedWalker constructor, the environment factory and its size, the number of users and the reset threshold. Each
+cell of the grid is an independent simulation, so the cells are run in parallel in a process pool, each with its own
+deterministically derived random seed, and the results are collected into one table.
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import contextlib
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import environment
+import algorithm
+import simulation
+from checkpoint import Checkpoint
+from online_metrics import OnlineMetrics
+import spatial
+from distance_field import DistanceField
+import prediction
+import profiling
+from prediction_cache import PredictionCache
+from result_sink import ResultSink, open_run, write_json
+from user import User
+
+
+# Default settings of a cell, every one of them (as well as any RedirectedWalker argument) can be swept over
+CELL_DEFAULTS = {
+	'env_factory': environment.define_square, # Called with env_size (or with *env_size if it is a tuple)
+	'env_size': 10.0,
+	'num_users': 1,
+	'threshold': 100, # Reset threshold, see RedirectedWalker.reset_if_needed
+	'reset_mode': 'threshold', # 'event' to skip the reset checks until a reset becomes possible, see simulation.Simulation
+	# The reference kernel runs the per-user methods and follows the original simulation loop bit for bit (without wall or
+	# user cutoffs and wall fields, which only exist in the batched kernel). The faster ones (e.g.
+	# compiled_kernel.default_step_kernel()) agree with it per step up to rounding, but whole runs drift apart as the
+	# rounding differences grow with the steps.
+	'step_kernel': simulation.reference_step,
+	'wall_cutoff': None, # If set, only the walls within this distance of a user are considered, see spatial.SegmentIndex
+	'user_cutoff': None, # If set, only the users within this distance of a user are repelling it, see spatial.NeighborGrid
+	'wall_field_resolution': None, # If set, the wall terms are interpolated from a precomputed field, see DistanceField
+	'wall_field_cache': None, # Directory in which the precomputed fields are cached
+	'speed': 1.0, # Initial speed of the users
+	'fixed_dir': False, # If True, user i walks in the fixed direction i as in the MMSys example, otherwise randomly
+	'predict': False, # If True, the micro-scale metric is captured as well (!! Substantially longer simulation time !!)
+	'predictor': 'lstm', # See prediction.PREDICTORS
+	'prediction_cache': None, # Directory of a PredictionCache, so that reruns only predict what is new
+	'prediction_mode': None, # None trains one model per user serially, see make_and_evaluate_predictions_batch otherwise
+	'profile': False, # If True, the time spent in each phase is returned as well, see profiling.Profiler
+	'online_metrics': False, # If True, the distributions of the metrics are summarized online, see online_metrics
+	'checkpoint_interval': None, # If set (seconds), cells with an output directory are checkpointed and resumed, see checkpoint
+	'n_past': 9,
+	'n_future': 1,
+	'split_rate': 0.8,
+}
+
+# Parameters of the RedirectedWalker used in the ACM MMSys 2021 experiments
+MMSYS_PARAMETERS = {
+	'duration': 60 * 60, 'steps_per_second': 10, 'gamma': 1.5, 'base_rate': algorithm.rad(1.5),
+	'max_move_rate': algorithm.rad(15), 'max_head_rate': algorithm.rad(30), 'velocity_thresh': 0.1,
+	'ang_compress_scale': 0.85, 'ang_amplify_scale': 1.3, 'scale_multiplier': 2.5, 'radius': 7.5, 't_a_norm': 15.0,
+}
+
+
+# Expands a grid (dict of parameter name -> list of values) into the list of all its cells, the last parameter
+# varying fastest
+def expand_grid(grid):
+	names = list(grid)
+	return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+# Runs a single cell. Settings holds the RedirectedWalker arguments and the cell settings (see CELL_DEFAULTS), seed is
+# the numpy SeedSequence (or integer seed) from which the initial locations and the virtual paths are drawn. With an
+# output directory, the results are streamed into it (see result_sink) instead of being kept in memory, and only the
+# number of resets per user is returned. With a checkpoint_interval, the simulation state is checkpointed into the
+# output directory while running, and an interrupted cell continues from its latest checkpoint when it is run again.
+def run_cell(settings, seed, output=None):
+	time1 = time.time() # We want to benchmark the execution time of each experiment
+
+	settings = dict(CELL_DEFAULTS, **settings)
+	rng = np.random.default_rng(seed)
+	profiler = profiling.Profiler() if settings['profile'] else None
+	# The profiler is disabled on errors as well, since it patches functions shared with the other cells of the process
+	with profiler if profiler is not None else contextlib.nullcontext():
+		# Define the shape and size of the environment.
+		env_size = settings['env_size']
+		env = settings['env_factory'](*env_size) if isinstance(env_size, tuple) else settings['env_factory'](env_size)
+
+		rdw_arguments = {name: value for name, value in settings.items() if name not in CELL_DEFAULTS}
+		if settings['wall_cutoff'] is not None:
+			rdw_arguments['wall_index'] = spatial.SegmentIndex(env, settings['wall_cutoff'])
+		if settings['user_cutoff'] is not None:
+			rdw_arguments['user_index'] = spatial.NeighborGrid(settings['user_cutoff'])
+		if settings['wall_field_resolution'] is not None:
+			if settings['wall_field_cache'] is not None:
+				rdw_arguments['wall_field'] = DistanceField.cached(env, settings['wall_field_cache'], settings['wall_field_resolution'])
+			else:
+				rdw_arguments['wall_field'] = DistanceField(env, settings['wall_field_resolution'])
+		rdw = algorithm.RedirectedWalker(env=env, **rdw_arguments)
+
+		# Define the users by drawing their initial locations uniformly within the environment (redrawn if they fall
+		# within a hole or outside of a non-rectangular environment)
+		lower = np.min(rdw.walls, axis=(0, 1))
+		upper = np.max(rdw.walls, axis=(0, 1))
+		users = []
+		for identity in range(1, settings['num_users'] + 1):
+			initial_loc = rng.uniform(lower, upper)
+			while not environment.is_inside(env, initial_loc):
+				initial_loc = rng.uniform(lower, upper)
+			user = User(initial_loc, settings['speed'], identity, capacity=rdw.steps if output is None else 1024)
+			user.fill_virtual_path(rdw.steps, rdw.delta_t, identity if settings['fixed_dir'] else None, rng)
+			users.append(user)
+
+		sink = None
+		checkpoint = None
+		if output is not None:
+			if settings['checkpoint_interval'] is not None:
+				checkpoint = Checkpoint(os.path.join(output, 'checkpoint'), settings['checkpoint_interval'])
+			sink = ResultSink(output, len(users), metadata={'settings': settings, 'seed': seed}, identities=[user.identity for user in users],
+							  resume=checkpoint is not None and checkpoint.exists)
+
+		# Without a sink, the history is only kept if the exact distances or the paths for the predictions are needed
+		metrics = OnlineMetrics(len(users), rdw.delta_t) if settings['online_metrics'] else None
+		keep_history = sink is None and (metrics is None or settings['predict'])
+		sim = simulation.Simulation(rdw, users, settings['threshold'], settings['step_kernel'], sink=sink, keep_history=keep_history,
+									 reset_mode=settings['reset_mode'], metrics=metrics)
+		if checkpoint is not None and checkpoint.restore(sim):
+			time1 -= checkpoint.elapsed # Time spent in the earlier sessions
+		sim.run(checkpoint)
+
+		time2 = time.time()
+
+		if sink is None and not keep_history:
+			result = {'resets': metrics.num_resets.tolist(), 'distances': None, 'time': time2 - time1, 'mse': None, 'time_full': time2 - time1}
+		elif sink is None:
+			result = {
+				'resets': list(sim.num_resets_per_user().values()),
+				'distances': list(sim.distance_between_resets_per_user().values()),
+				'time': time2 - time1,
+				'mse': None,
+				'time_full': time2 - time1,
+			}
+			paths = [user.get_phy_path() for user in users]
+		else:
+			sink.flush()
+			result = {'resets': sink.num_resets.tolist(), 'distances': None, 'time': time2 - time1, 'mse': None, 'time_full': time2 - time1}
+			positions = open_run(output)['columns']['positions']
+			paths = [np.array(positions[:, index]) for index in range(len(users))]
+
+		if settings['predict']:
+			cache = None if settings['prediction_cache'] is None else PredictionCache(settings['prediction_cache'])
+			if settings['prediction_mode'] is None:
+				mse = [prediction.make_and_evaluate_predictions(path, settings['n_past'], settings['n_future'], 2,
+					   settings['split_rate'], predictor = settings['predictor'], cache = cache) for path in paths]
+			else:
+				mse = prediction.make_and_evaluate_predictions_batch(paths, settings['n_past'], settings['n_future'], 2,
+					  settings['split_rate'], mode = settings['prediction_mode'], predictor = settings['predictor'], cache = cache)
+			result['time_full'] = time.time() - time1
+			if sink is None:
+				result['mse'] = mse
+			else:
+				for index, user_mse in enumerate(mse):
+					sink.append_mse(index, user_mse)
+
+		result['metrics'] = metrics.summary() if metrics is not None else None
+	result['profile'] = profiler.breakdown() if profiler is not None else None
+
+	if sink is not None:
+		sink.close(time=result['time'], time_full=result['time_full'], profile=result['profile'], metrics=result['metrics'])
+
+	return result
+
+
+# Rough relative cost of a cell, used to start the most expensive cells first so that the wall time of the sweep is
+# close to the one of its longest cell
+def estimate_cost(settings):
+	settings = dict(CELL_DEFAULTS, **settings)
+	return settings['num_users'] * (settings['num_users'] + 4) * settings['duration'] * settings['steps_per_second']
+
+
+# Runs all cells of the grid, on top of the base parameters (RedirectedWalker arguments and cell settings), over
+# max_workers processes (all cores by default, 1 runs the cells in this process). The seed of each cell is spawned
+# from seed in the order of the grid, so that results do not depend on the scheduling. Returns the table of results,
+# with one row per cell, in grid order. With an output directory, the results of cell i are streamed into its
+# subdirectory cell_i (see run_cell), and the grid is described in its sweep.json.
+def run_sweep(grid, base_parameters=MMSYS_PARAMETERS, seed=0, max_workers=None, output_dir=None):
+	cells = [dict(base_parameters, **cell) for cell in expand_grid(grid)]
+	seeds = np.random.SeedSequence(seed).spawn(len(cells))
+	outputs = [None] * len(cells)
+
+	if output_dir is not None:
+		os.makedirs(output_dir, exist_ok=True)
+		outputs = [os.path.join(output_dir, 'cell_' + str(index)) for index in range(len(cells))]
+		write_json(os.path.join(output_dir, 'sweep.json'), {'grid': grid, 'base_parameters': base_parameters, 'seed': seed,
+						'cells': [{'directory': 'cell_' + str(index), 'parameters': cell} for index, cell in enumerate(expand_grid(grid))]})
+
+	if max_workers == 1:
+		results = [run_cell(cell, cell_seed, output) for cell, cell_seed, output in zip(cells, seeds, outputs)]
+	else:
+		order = sorted(range(len(cells)), key=lambda index: -estimate_cost(cells[index]))
+		with ProcessPoolExecutor(max_workers=max_workers) as executor:
+			futures = {index: executor.submit(run_cell, cells[index], seeds[index], outputs[index]) for index in order}
+			results = [futures[index].result() for index in range(len(cells))]
+
+	return make_table(expand_grid(grid), results)
+
+
+# Collects the swept parameters and the results of all cells into a numpy structured array
+def make_table(cells, results):
+	columns = list(cells[0]) if cells else []
+	fields = [(name, object) for name in columns]
+	fields += [('mean_resets', float), ('resets', object), ('distances', object), ('mse', object), ('time', float), ('time_full', float),
+			   ('metrics', object), ('profile', object)]
+
+	table = np.empty(len(cells), dtype=fields)
+	for row, (cell, result) in enumerate(zip(cells, results)):
+		for name in columns:
+			table[name][row] = cell[name]
+		table['mean_resets'][row] = np.mean(result['resets'])
+		for name in ('resets', 'distances', 'mse', 'time', 'time_full', 'metrics', 'profile'):
+			table[name][row] = result[name]
+	return table
@@ -0,0 +1,152 @@
+# Parity of the batched kernels with the per-user methods of the RedirectedWalker, which implement the equations of the
+# original simulator. The reference kernel runs the per-user methods and gives the same results as the original
+# simulator bit for bit. The batched kernels round differently (e.g. np.arccos and math.acos), so their single steps
+# from identical states are compared up to a tolerance.
+
+import numpy as np
+import algorithm
+import environment
+import simulation
+from sweep import MMSYS_PARAMETERS
+from user import User
+
+
+# Users at random locations within the environment, each with a random previous location one step away
+def random_state(rdw, num_users, rng):
+	lower = np.min(rdw.walls, axis=(0, 1))
+	upper = np.max(rdw.walls, axis=(0, 1))
+	previous = rng.uniform(lower, upper, size=(num_users, 2))
+	positions = previous + rng.normal(0, rdw.delta_t, size=(num_users, 2))
+	users = []
+	for identity in range(num_users):
+		user = User(previous[identity], 1.0, identity + 1)
+		user.phy_locations.append(positions[identity])
+		users.append(user)
+	return users, positions, previous
+
+
+# Force vectors, env vectors and user vectors of Equations 1 and 5-7, from the per-user methods as in the original
+# simulator
+def baseline_force_vectors(rdw, users):
+	force_vectors, all_env_vectors, all_user_vectors = [], [], []
+	for user in users:
+		sum_distance = rdw.calculate_sum_distance(user, users)
+		env_vectors = rdw.calculate_env_vectors(user, sum_distance)
+		user_vectors = rdw.calculate_other_users_vector(user, users, sum_distance)
+		force_vectors.append(sum(env_vectors) + sum(user_vectors))
+		all_env_vectors.append(env_vectors)
+		all_user_vectors.append(user_vectors)
+	return force_vectors, all_env_vectors, all_user_vectors
+
+
+# Step of all users as in the loop of the original simulator: the (U,2) steps and (U,) reset flags
+def baseline_step(rdw, users, threshold):
+	force_vectors, env_vectors, user_vectors = baseline_force_vectors(rdw, users)
+	moving_rates = rdw.calculate_max_rotations(users)
+	steps = np.empty((len(users), 2))
+	resets = np.zeros(len(users), dtype=bool)
+	for index, user in enumerate(users):
+		steps[index] = rdw.calculate_next_physical_step(user, moving_rates[index], force_vectors[index])
+		reset_step = rdw.reset_if_needed(force_vectors[index], env_vectors[index], user_vectors[index], threshold=threshold)
+		if reset_step is not None:
+			steps[index] = reset_step
+			resets[index] = True
+	return steps, resets
+
+
+def test_force_field_matches_per_user_methods():
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(10.0), **MMSYS_PARAMETERS)
+	rng = np.random.default_rng(0)
+	for check in range(50):
+		users, positions, previous = random_state(rdw, 6, rng)
+		force_vectors, env_vectors, user_vectors = baseline_force_vectors(rdw, users)
+		batched = algorithm.calculate_force_field(positions, previous, rdw.walls, rdw.gamma)
+		np.testing.assert_allclose(batched[0], force_vectors, rtol=1e-12, atol=1e-12)
+		np.testing.assert_allclose(batched[1], env_vectors, rtol=1e-12, atol=1e-12)
+		np.testing.assert_allclose(batched[2], user_vectors, rtol=1e-12, atol=1e-12)
+
+
+# Whole runs of the reference kernel follow the original simulator exactly, resets included
+def test_reference_step_matches_baseline_loop():
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(10.0), **dict(MMSYS_PARAMETERS, duration=60))
+	rng = np.random.default_rng(0)
+	users = []
+	baseline_users = []
+	for identity in range(1, 5):
+		user = User(rng.uniform(-5, 5, size=2), 1.0, identity, capacity=rdw.steps)
+		user.fill_virtual_path(rdw.steps, rdw.delta_t, None, rng)
+		users.append(user)
+		baseline_user = User(user.get_phy_loc(), 1.0, identity, capacity=rdw.steps)
+		baseline_user.phy_locations.append(user.virt_locations[1])
+		baseline_users.append(baseline_user)
+	sim = simulation.Simulation(rdw, users, 100, simulation.reference_step).run()
+
+	resets = [np.zeros(4, dtype=bool), np.zeros(4, dtype=bool)]
+	for time_iter in range(2, rdw.steps):
+		steps, step_resets = baseline_step(rdw, baseline_users, 100)
+		for user, step in zip(baseline_users, steps):
+			user.phy_locations.append(user.get_phy_loc() + step)
+		resets.append(step_resets)
+
+	np.testing.assert_array_equal(sim.positions, np.stack([np.asarray(user.phy_locations) for user in baseline_users], axis=1))
+	np.testing.assert_array_equal(sim.resets, resets)
+	assert np.any(sim.resets)
+
+
+def test_vectorized_step_matches_baseline_step():
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(10.0), **MMSYS_PARAMETERS)
+	rng = np.random.default_rng(1)
+	for check in range(50):
+		users, positions, previous = random_state(rdw, 6, rng)
+		baseline_steps, baseline_resets = baseline_step(rdw, users, 2.0)
+		steps, resets = simulation.vectorized_step(rdw, users, 2.0)
+		np.testing.assert_allclose(steps, baseline_steps, atol=1e-12)
+		np.testing.assert_array_equal(resets, baseline_resets)
+
+
+# Macro steps of the adaptive time-stepping against single steps, for one user walking a minute in a large room
+def test_macro_steps_follow_single_steps():
+	sims = []
+	for max_substeps in (1, 20):
+		rdw = algorithm.RedirectedWalker(env=environment.define_square(80.0), **dict(MMSYS_PARAMETERS, duration=60, max_substeps=max_substeps))
+		user = User(np.array([10.0, -18.0]), 1.0, 1, capacity=rdw.steps)
+		user.fill_virtual_path(rdw.steps, rdw.delta_t, None, np.random.default_rng(0))
+		sims.append(simulation.Simulation(rdw, [user], 100, simulation.vectorized_step).run())
+	np.testing.assert_array_equal(sims[0].resets, sims[1].resets)
+	assert np.max(algorithm.batched_norm(sims[0].positions - sims[1].positions)) < 0.1
+
+
+# Macro steps of several users end before any reset that single steps from the same state would need. Without the
+# step_tolerance limit, the safe steps of calculate_safe_steps alone bound the macro steps.
+def test_macro_steps_end_before_resets():
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(10.0), **dict(MMSYS_PARAMETERS, max_substeps=40, min_substeps=2, step_tolerance=1e9))
+	rng = np.random.default_rng(0)
+	num_bounded = 0
+	for check in range(100):
+		users, positions, previous = random_state(rdw, 4, rng)
+		num_substeps = rdw.calculate_substeps(positions, 50)
+		for substep in range(rdw.max_substeps):
+			steps, resets = rdw.calculate_steps(positions, previous, 50)
+			if substep > 0 and np.any(resets):
+				assert num_substeps <= substep
+				num_bounded += num_substeps > 1
+				break
+			previous, positions = positions, positions + steps
+	assert num_bounded > 0
+
+
+# Whole runs of several users with macro steps and resets, against single steps
+def test_macro_steps_keep_resets_of_several_users():
+	sims = []
+	for max_substeps in (1, 20):
+		rdw = algorithm.RedirectedWalker(env=environment.define_square(40.0), **dict(MMSYS_PARAMETERS, duration=60, max_substeps=max_substeps))
+		rng = np.random.default_rng(0)
+		users = []
+		for identity in range(1, 5):
+			user = User(rng.uniform(-20, 20, size=2), 1.0, identity, capacity=rdw.steps)
+			user.fill_virtual_path(rdw.steps, rdw.delta_t, None, rng)
+			users.append(user)
+		sims.append(simulation.Simulation(rdw, users, 20, simulation.vectorized_step).run())
+	assert np.count_nonzero(sims[0].resets) > 10
+	np.testing.assert_array_equal(sims[0].resets, sims[1].resets)
+	assert np.max(algorithm.batched_norm(sims[0].positions - sims[1].positions)) < 0.5
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pytest
+import algorithm
+import environment
+import simulation
+from checkpoint import Checkpoint
+from online_metrics import OnlineMetrics
+from result_sink import ResultSink
+from sweep import MMSYS_PARAMETERS
+from test_simulation import make_users
+
+
+# Simulation as set up by sweep.run_cell, streaming into a sink in directory, with online metrics
+def make_simulation(directory, keep_history, resume=False):
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(5.0), **dict(MMSYS_PARAMETERS, duration=150))
+	sink = ResultSink(directory, 3, chunk_size=64, resume=resume)
+	metrics = OnlineMetrics(3, rdw.delta_t, exact=True)
+	return simulation.Simulation(rdw, make_users(rdw, 3, 0), 100, sink=sink, keep_history=keep_history, reset_mode='event', metrics=metrics)
+
+
+def read_columns(directory):
+	columns = {}
+	for name in sorted(os.listdir(directory)):
+		if name.endswith('.bin'):
+			with open(os.path.join(directory, name), 'rb') as column_file:
+				columns[name] = column_file.read()
+	return columns
+
+
+# A run interrupted after its checkpoint (with more steps written to the sink and merged into the metrics after it)
+# and resumed gives the same results as an uninterrupted run, bit for bit
+@pytest.mark.parametrize('keep_history', [False, True])
+def test_resumed_run_matches_uninterrupted_run(tmp_path, keep_history):
+	uninterrupted = make_simulation(str(tmp_path / 'uninterrupted'), keep_history).run()
+	uninterrupted.sink.close()
+
+	directory = str(tmp_path / 'interrupted')
+	sim = make_simulation(directory, keep_history)
+	checkpoint = Checkpoint(os.path.join(directory, 'checkpoint'), interval=np.inf)
+	for step in range(700):
+		sim.step()
+	checkpoint.save(sim)
+	saved_iter = sim.time_iter
+	for step in range(300):
+		sim.step()
+	sim.sink.flush()
+	for column_file in sim.sink.files.values():
+		column_file.close()
+
+	resumed = make_simulation(directory, keep_history, resume=True)
+	checkpoint = Checkpoint(os.path.join(directory, 'checkpoint'), interval=np.inf)
+	assert checkpoint.restore(resumed)
+	assert resumed.time_iter == saved_iter
+	resumed.run(checkpoint)
+	resumed.sink.close()
+
+	assert np.count_nonzero(uninterrupted.sink.num_resets) > 0
+	assert read_columns(directory) == read_columns(str(tmp_path / 'uninterrupted'))
+	assert resumed.metrics.summary() == uninterrupted.metrics.summary()
+	assert resumed.reset_schedule.num_checks == uninterrupted.reset_schedule.num_checks
+	np.testing.assert_array_equal(resumed.positions, uninterrupted.positions)
+	if keep_history:
+		assert resumed.distance_between_resets_per_user() == uninterrupted.distance_between_resets_per_user()
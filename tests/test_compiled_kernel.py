@@ -0,0 +1,58 @@
+# Parity of the compiled step kernel with the per-user methods of the original simulation loop (copied in
+# test_algorithm.baseline_step, and run by simulation.reference_step). Whole runs cannot be compared, as differences of
+# a few ulps per step grow over hundreds of steps, so single steps from identical states are compared instead.
+
+import numpy as np
+import pytest
+import algorithm
+import environment
+import compiled_kernel
+import simulation
+from sweep import MMSYS_PARAMETERS
+from test_algorithm import baseline_step, random_state
+
+if compiled_kernel.numba is None:
+	pytest.skip("Numba is not installed", allow_module_level=True)
+
+
+@pytest.mark.parametrize('num_users', [1, 4, 8])
+def test_compiled_step_matches_reference_step(num_users):
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(10.0), **MMSYS_PARAMETERS)
+	rng = np.random.default_rng(num_users)
+	num_resets = 0
+	for check in range(100):
+		users, positions, previous = random_state(rdw, num_users, rng)
+		# Thresholds at which resets are frequent, with some users not checked at all
+		threshold = rng.choice([0.5, 2.0, np.inf], size=num_users)
+		reference_steps, reference_resets = simulation.reference_step(rdw, users, threshold)
+		steps, resets = compiled_kernel.compiled_step(rdw, users, threshold)
+		assert np.max(np.abs(steps - reference_steps)) < 1e-12
+		np.testing.assert_array_equal(resets, reference_resets)
+		num_resets += np.count_nonzero(reference_resets)
+	assert num_resets > 0
+
+
+@pytest.mark.parametrize('threshold', [0.5, 2.0])
+def test_compiled_step_matches_baseline_step(threshold):
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(10.0), **MMSYS_PARAMETERS)
+	rng = np.random.default_rng(1)
+	num_resets = 0
+	for check in range(100):
+		users, positions, previous = random_state(rdw, 4, rng)
+		baseline_steps, baseline_resets = baseline_step(rdw, users, threshold)
+		steps, resets = compiled_kernel.compiled_step(rdw, users, threshold)
+		assert np.max(np.abs(steps - baseline_steps)) < 1e-12
+		np.testing.assert_array_equal(resets, baseline_resets)
+		num_resets += np.count_nonzero(baseline_resets)
+	assert num_resets > 0
+
+
+def test_check_parity():
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(10.0), **MMSYS_PARAMETERS)
+	max_difference, reset_mismatches = compiled_kernel.check_parity(rdw, 4, 2.0, rng=0)
+	assert max_difference < 1e-12
+	assert reset_mismatches == 0
+
+
+def test_default_step_kernel():
+	assert compiled_kernel.default_step_kernel() is compiled_kernel.compiled_step
@@ -0,0 +1,34 @@
+import numpy as np
+
+import distance_field
+import environment
+
+
+SQUARE = [[5, 5], [5, -5], [-5, -5], [-5, 5]]
+
+
+def test_open_walls_do_not_flip_inside():
+	env = environment.define_polygon(SQUARE, [[[0, -2], [0, 2]]])
+	assert list(environment.ring_walls(env)) == [True, True, True, True, False]
+	assert environment.is_inside(env, [-1, 0])
+	assert environment.is_inside(env, [1, 0])
+	assert not environment.is_inside(env, [6, 0])
+
+	# Partition attached to the outline at one end
+	env = environment.define_weirdness_2(10, 10)
+	assert environment.is_inside(env, [-4, -4])
+	assert environment.is_inside(env, [-4, -2])
+	assert not environment.is_inside(env, [3, 3])
+
+
+def test_holes_are_outside():
+	env = environment.define_polygon(SQUARE, [environment.define_box(0, 0, 2, 2), [[3, -4], [3, 4]]])
+	points = np.array([[0, 0], [2, 0], [4, 0], [-4, 4], [0, 6]])
+	assert list(environment.are_inside(env, points)) == [False, True, True, True, False]
+
+
+def test_distance_field_sign_ignores_open_walls():
+	env = environment.define_polygon(SQUARE, [[[0, -2], [0, 2]]])
+	field = distance_field.DistanceField(env, resolution=0.5)
+	distance = field.exact(np.array([[-1, 0], [1, 0], [-6, 0]]))[:, distance_field.DISTANCE]
+	np.testing.assert_allclose(distance, [1, 1, -1])
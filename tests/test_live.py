@@ -0,0 +1,46 @@
+import asyncio
+import numpy as np
+import algorithm
+import environment
+import live
+from sweep import MMSYS_PARAMETERS
+
+
+def make_engine():
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(10.0), **MMSYS_PARAMETERS)
+	return live.LiveEngine(rdw, [1, 2], threshold=100)
+
+
+def test_stale_users_are_not_steered():
+	engine = make_engine()
+	engine.receive({'user': 1, 'position': [0.0, 0.0]})
+	engine.receive({'user': 2, 'position': [2.0, 2.0]})
+	engine.decide()
+	engine.receive({'user': 1, 'position': [0.1, 0.0]})
+	engine.receive({'user': 2, 'position': [2.0, 2.1]})
+	engine.decide()
+
+	# Only user 1 moves, user 2 keeps its heading from the latest update
+	engine.receive({'user': 1, 'position': [0.2, 0.0]})
+	decisions = engine.decide()['decisions']
+	assert [decision['stale'] for decision in decisions] == [False, True]
+	assert decisions[1] == {'user': 2, 'stale': True, 'reset': False}
+	np.testing.assert_array_equal(engine.previous, [[0.1, 0.0], [2.0, 2.0]])
+
+	# Once user 2 moves again, its heading is taken from its location at its latest decision
+	engine.receive({'user': 2, 'position': [2.0, 2.2]})
+	decisions = engine.decide()['decisions']
+	assert [decision['stale'] for decision in decisions] == [True, False]
+	np.testing.assert_array_equal(engine.previous[1], [2.0, 2.1])
+	heading = np.array([0.0, 0.1])
+	direction = np.array(decisions[1]['direction'])
+	assert np.isclose(decisions[1]['rotation'], np.arctan2(heading[0] * direction[1] - heading[1] * direction[0], np.dot(heading, direction)))
+
+
+def test_replay_session():
+	paths = np.stack([np.linspace([0, 0], [3, 0], 20), np.linspace([-2, 2], [-2, -1], 20)], axis=1)
+	report, tracker = asyncio.run(live.replay_session(make_engine().rdw, paths, 100, tick_rate=50))
+	assert report['ticks'] > 0
+	decisions = [decision for message in tracker.received for decision in message['decisions']]
+	assert any(not decision['stale'] for decision in decisions)
+	assert all('direction' not in decision for decision in decisions if decision['stale'])
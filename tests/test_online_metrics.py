@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import algorithm
+import environment
+import simulation
+from online_metrics import DISTANCE_EDGES, QUANTILES, OnlineMetrics, StreamingDistribution
+from sweep import MMSYS_PARAMETERS
+from test_simulation import make_users
+
+
+# Summary of the values of each user (one array per user), added one at a time as by the simulation
+def summarize(values, buffer_size=256, edges=DISTANCE_EDGES):
+	distribution = StreamingDistribution(len(values), edges, buffer_size=buffer_size)
+	for step in range(max(len(user_values) for user_values in values)):
+		users = np.array([user for user, user_values in enumerate(values) if step < len(user_values)])
+		distribution.update(users, [values[user][step] for user in users])
+	return distribution.summary()
+
+
+def test_exact_distances_match_simulation():
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(5.0), **dict(MMSYS_PARAMETERS, duration=120))
+	metrics = OnlineMetrics(3, rdw.delta_t, exact=True)
+	sim = simulation.Simulation(rdw, make_users(rdw, 3, 0), 100, metrics=metrics).run()
+	summary = metrics.summary()
+	distances = sim.distance_between_resets_per_user()
+	assert sum(len(values) for values in distances.values()) > 10
+	assert summary['exact_distances'] == [distances[1], distances[2], distances[3]]
+	assert summary['num_resets'] == list(sim.num_resets_per_user().values())
+	assert summary['distances']['count'] == [len(distances[1]), len(distances[2]), len(distances[3])]
+
+
+# Running statistics merged over many buffers, against NumPy on all values at once
+def test_running_stats_match_numpy():
+	rng = np.random.default_rng(0)
+	values = [rng.lognormal(0, 1, 1000), rng.normal(5, 2, 777)]
+	summary = summarize(values, buffer_size=16)
+	np.testing.assert_allclose(summary['mean'], [np.mean(user_values) for user_values in values], rtol=1e-12)
+	np.testing.assert_allclose(summary['std'], [np.std(user_values) for user_values in values], rtol=1e-12)
+	assert summary['min'] == [np.min(user_values) for user_values in values]
+	assert summary['max'] == [np.max(user_values) for user_values in values]
+	assert summary['count'] == [1000, 777]
+	for user_values, counts in zip(values, summary['histogram']):
+		assert counts[1:-1] == np.histogram(user_values, DISTANCE_EDGES)[0].tolist()
+
+
+# With fewer values than centroids, every centroid holds a single value and the quantiles are exact
+def test_quantiles_exact_for_few_values():
+	rng = np.random.default_rng(1)
+	values = [rng.pareto(1.5, 60) + 1, rng.uniform(0, 1, 40)]
+	summary = summarize(values)
+	np.testing.assert_allclose(summary['quantile_estimates'], [np.quantile(user_values, QUANTILES) for user_values in values], rtol=1e-12)
+
+
+# The t-digest keeps the quantiles to within about 2 values of their rank: the estimates fall between the np.quantile
+# quantiles 0.01 below and above the requested ones, for a few hundred values as well as for more. The error in value
+# depends on the distribution, e.g. up to 7% at p5 and p95 of 300 Pareto values.
+@pytest.mark.parametrize('num_values', [300, 1000, 10000])
+def test_quantiles_within_rank_tolerance(num_values):
+	rng = np.random.default_rng(num_values)
+	values = [rng.pareto(1.5, num_values) + 1, rng.normal(10, 2, num_values), rng.uniform(0, 1, num_values), rng.lognormal(0, 1, num_values)]
+	summary = summarize(values)
+	quantiles = np.array(QUANTILES)
+	for user_values, estimates in zip(values, summary['quantile_estimates']):
+		assert np.all(estimates >= np.quantile(user_values, np.maximum(quantiles - 0.01, 0)))
+		assert np.all(estimates <= np.quantile(user_values, np.minimum(quantiles + 0.01, 1)))
+	pareto = values[0]
+	np.testing.assert_allclose(summary['quantile_estimates'][0], np.quantile(pareto, QUANTILES), rtol=0.1)
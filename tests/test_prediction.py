@@ -0,0 +1,14 @@
+# Baseline predictors on trajectories too short for the training or test windows, which yield NaN or no MSEs instead
+# of failing
+
+import numpy as np
+import prediction
+
+
+def test_short_series():
+	series = np.cumsum(np.ones((30, 2)), axis=0)
+	for name in ('constant_position', 'constant_velocity', 'constant_acceleration', 'kalman', 'ridge'):
+		assert prediction.make_and_evaluate_predictions(series[:5], 9, 1, 2, predictor=name) == []
+		mse = prediction.make_and_evaluate_predictions(series, 9, 1, 2, split_rate=0.2, predictor=name)
+		assert len(mse) == 15
+		assert np.all(np.isnan(mse)) == (name == 'ridge')
@@ -0,0 +1,27 @@
+import pytest
+import algorithm
+import profiling
+import simulation
+import sweep
+
+
+def failing_factory(size):
+	raise ValueError("No environment")
+
+
+def test_run_cell_disables_profiler_on_error():
+	original = algorithm.RedirectedWalker.calculate_force_vectors
+	with pytest.raises(ValueError):
+		sweep.run_cell(dict(sweep.MMSYS_PARAMETERS, env_factory=failing_factory, profile=True), 0)
+	assert profiling.Profiler.active is None
+	assert algorithm.RedirectedWalker.calculate_force_vectors is original
+
+
+def test_vectorized_kernel_phases():
+	settings = dict(sweep.MMSYS_PARAMETERS, duration=10, num_users=4, profile=True, step_kernel=simulation.vectorized_step)
+	profile = sweep.run_cell(settings, 0)['profile']
+	calls = {row['phase']: row['calls'] for row in profile}
+	for phase in ['simulation_step', 'force_field', 'next_physical_steps', 'resets_needed', 'path_append']:
+		assert calls[phase] > 0
+	assert 'force_vectors' not in calls
+	assert profiling.Profiler.active is None
@@ -0,0 +1,98 @@
+import os
+import numpy as np
+import algorithm
+import environment
+import simulation
+from result_sink import ResultSink, open_run, user_values
+from sweep import MMSYS_PARAMETERS
+from test_simulation import make_users
+
+
+# Random rows of num_steps steps of num_users users, with a few resets
+def random_steps(num_steps, num_users, rng):
+	positions = rng.normal(size=(num_steps, num_users, 2))
+	resets = rng.random((num_steps, num_users)) < 0.1
+	step_lengths = rng.random((num_steps, num_users))
+	return positions, resets, step_lengths
+
+
+def test_round_trip(tmp_path):
+	rng = np.random.default_rng(0)
+	positions, resets, step_lengths = random_steps(50, 3, rng)
+	sink = ResultSink(str(tmp_path), 3, metadata={'seed': 0}, identities=[4, 5, 6], chunk_size=8)
+	for step in range(20):
+		sink.append_step(positions[step], resets[step], step_lengths[step])
+
+	# Only complete chunks are written before a flush
+	run = open_run(str(tmp_path))
+	assert not run['complete']
+	np.testing.assert_array_equal(run['columns']['positions'], positions[:16])
+	sink.flush()
+	np.testing.assert_array_equal(open_run(str(tmp_path))['columns']['resets'], resets[:20])
+
+	for step in range(20, 50):
+		sink.append_step(positions[step], resets[step], step_lengths[step])
+	sink.append_mse(1, [0.5, 0.25])
+	sink.close(time=1.5)
+
+	run = open_run(str(tmp_path))
+	assert run['complete']
+	assert run['num_steps'] == 50
+	assert run['identities'] == [4, 5, 6]
+	assert run['metadata']['seed'] == 0
+	assert run['metadata']['time'] == 1.5
+	assert run['metadata']['num_resets'] == np.sum(resets[2:], axis=0).tolist()
+	np.testing.assert_array_equal(run['columns']['positions'], positions)
+	np.testing.assert_array_equal(run['columns']['resets'], resets)
+	np.testing.assert_array_equal(run['columns']['step_lengths'], step_lengths)
+	assert [list(values) for values in user_values(run, 'mse')] == [[], [0.5, 0.25], []]
+	np.testing.assert_allclose([np.sum(values) for values in user_values(run, 'distances')], np.sum(step_lengths[2:], axis=0))
+
+
+# A sink reopened with resume and restored to a checkpoint drops everything written after it, and continues as if it
+# had never been interrupted
+def test_restore_truncates(tmp_path):
+	rng = np.random.default_rng(1)
+	positions, resets, step_lengths = random_steps(40, 2, rng)
+	directories = [str(tmp_path / 'interrupted'), str(tmp_path / 'uninterrupted')]
+
+	sink = ResultSink(directories[0], 2, chunk_size=8)
+	for step in range(13):
+		sink.append_step(positions[step], resets[step], step_lengths[step])
+	state = sink.checkpoint_state()
+	for step in range(13, 30):
+		sink.append_step(positions[step], resets[step], step_lengths[step])
+	sink.append_mse(0, 1.0)
+	sink.flush()
+	for column_file in sink.files.values():
+		column_file.close()
+
+	sink = ResultSink(directories[0], 2, chunk_size=8, resume=True)
+	sink.restore(state)
+	assert open_run(directories[0])['num_steps'] == 13
+	for step in range(13, 40):
+		sink.append_step(positions[step], resets[step], step_lengths[step])
+	sink.close()
+
+	with ResultSink(directories[1], 2, chunk_size=8) as sink:
+		for step in range(40):
+			sink.append_step(positions[step], resets[step], step_lengths[step])
+
+	for name in sorted(os.listdir(directories[1])):
+		if name.endswith('.bin'):
+			with open(os.path.join(directories[0], name), 'rb') as interrupted, open(os.path.join(directories[1], name), 'rb') as uninterrupted:
+				assert interrupted.read() == uninterrupted.read(), name
+
+
+def test_distances_match_simulation(tmp_path):
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(5.0), **dict(MMSYS_PARAMETERS, duration=60))
+	sink = ResultSink(str(tmp_path), 2, chunk_size=100)
+	sim = simulation.Simulation(rdw, make_users(rdw, 2, 0), 100, sink=sink).run()
+	sink.close()
+
+	run = open_run(str(tmp_path))
+	distances = sim.distance_between_resets_per_user()
+	assert sum(len(values) for values in distances.values()) > 10
+	assert [list(values) for values in user_values(run, 'distances')] == [distances[1], distances[2]]
+	assert run['metadata']['num_resets'] == list(sim.num_resets_per_user().values())
+	np.testing.assert_array_equal(run['columns']['positions'], sim.positions)
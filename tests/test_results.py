@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import results
+
+
+# Run as loaded by open_run with only a per-user column, from one array of values per user
+def make_run(name, values):
+	users = np.concatenate([np.full(len(user_values), user, dtype='<i4') for user, user_values in enumerate(values)])
+	order = np.random.default_rng(0).permutation(len(users)) # Values of all users interleaved, as appended by a sink
+	columns = {name: np.concatenate(values)[order], name + '_users': users[order]}
+	return {'num_users': len(values), 'identities': list(range(1, len(values) + 1)), 'columns': columns, 'metadata': {}}
+
+
+def random_values():
+	rng = np.random.default_rng(1)
+	return [rng.lognormal(0, 1, 200), np.empty(0), np.array([3.0]), rng.normal(0, 1, 57), np.concatenate([rng.normal(0, 1, 40), [15.0, -12.0]]),
+			np.array([1.0, 1.0, 1.0, 2.0])]
+
+
+def test_quantiles_per_user_match_numpy():
+	values = random_values()
+	quantiles = (0.0, 0.05, 0.25, 0.5, 0.75, 0.95, 1.0)
+	estimates = results.quantiles_per_user(make_run('distances', values), 'distances', quantiles)
+	for user_values, user_estimates in zip(values, estimates):
+		if len(user_values):
+			np.testing.assert_allclose(user_estimates, np.quantile(user_values, quantiles), rtol=1e-12, atol=1e-12)
+		else:
+			assert np.all(np.isnan(user_estimates))
+	assert np.all(np.isnan(results.quantiles_per_user(make_run('mse', [np.empty(0), np.empty(0)]), 'mse')))
+
+
+def test_box_stats_match_matplotlib():
+	cbook = pytest.importorskip('matplotlib.cbook')
+	values = random_values()
+	stats = results.box_stats(make_run('distances', values), 'distances')
+	expected = [dict(user_stats, label=str(user + 1)) for user, user_values in enumerate(values) if len(user_values)
+				for user_stats in cbook.boxplot_stats(user_values)]
+	assert len(stats) == len(expected)
+	for user_stats, user_expected in zip(stats, expected):
+		assert user_stats['label'] == user_expected['label']
+		for key in ('med', 'q1', 'q3', 'cilo', 'cihi', 'mean', 'whislo', 'whishi'):
+			np.testing.assert_allclose(user_stats[key], user_expected[key], rtol=1e-12, err_msg=key)
+		np.testing.assert_array_equal(np.sort(user_stats['fliers']), np.sort(user_expected['fliers']))
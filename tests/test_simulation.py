@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import algorithm
+import compiled_kernel
+import environment
+import simulation
+from sweep import MMSYS_PARAMETERS
+from user import User
+
+
+# Users at random initial locations within the square environment of rdw, with random virtual paths
+def make_users(rdw, num_users, seed):
+	rng = np.random.default_rng(seed)
+	size = np.max(rdw.walls)
+	users = []
+	for identity in range(1, num_users + 1):
+		user = User(rng.uniform(-size, size, size=2), 1.0, identity, capacity=rdw.steps)
+		user.fill_virtual_path(rdw.steps, rdw.delta_t, None, rng)
+		users.append(user)
+	return users
+
+
+# The event mode skips checks of the reference kernel, without changing any reset or distance
+@pytest.mark.parametrize('size, num_users', [(10.0, 4), (5.0, 2), (30.0, 8)])
+def test_event_mode_matches_threshold_mode(size, num_users):
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(size), **dict(MMSYS_PARAMETERS, duration=60))
+	sims = [simulation.Simulation(rdw, make_users(rdw, num_users, 0), 100, reset_mode=reset_mode).run() for reset_mode in ('threshold', 'event')]
+	np.testing.assert_array_equal(sims[0].positions, sims[1].positions)
+	np.testing.assert_array_equal(sims[0].resets, sims[1].resets)
+	assert sims[0].num_resets_per_user() == sims[1].num_resets_per_user()
+	assert sims[0].distance_between_resets_per_user() == sims[1].distance_between_resets_per_user()
+	assert sims[1].reset_schedule.num_checks < sims[0].reset_schedule.num_checks
+
+
+# Batched kernels check every user, as their checks cost nothing next to the bound
+@pytest.mark.parametrize('step_kernel', [simulation.vectorized_step, compiled_kernel.compiled_step])
+def test_batched_kernels_check_every_user(step_kernel):
+	rdw = algorithm.RedirectedWalker(env=environment.define_square(10.0), **dict(MMSYS_PARAMETERS, duration=20))
+	sims = [simulation.Simulation(rdw, make_users(rdw, 4, 0), 100, step_kernel, reset_mode=reset_mode).run() for reset_mode in ('threshold', 'event')]
+	np.testing.assert_array_equal(sims[0].positions, sims[1].positions)
+	assert sims[1].reset_schedule.num_checks == sims[0].reset_schedule.num_checks
+
+
+# Each replica of a ReplicaSimulation runs as a Simulation of its users with the batched kernel, resets included
+def test_replicas_match_single_simulations():
+	rdw = algorithm.RedirectedWalker(env=environment.define_weirdness_1(8.0, 8.0), **dict(MMSYS_PARAMETERS, duration=60))
+	replicas = simulation.ReplicaSimulation.random(rdw, 3, 4, 20, rng=0).run()
+	assert np.count_nonzero(replicas.num_resets()) > 0
+	for replica in range(3):
+		users = []
+		for index in range(4):
+			user = User(replicas.positions[0, replica, index], 1.0, index + 1, capacity=rdw.steps)
+			user.phy_locations.append(replicas.positions[1, replica, index])
+			users.append(user)
+		sim = simulation.Simulation(rdw, users, 20, simulation.vectorized_step).run()
+		np.testing.assert_array_equal(replicas.positions[:, replica], sim.positions)
+		np.testing.assert_array_equal(replicas.resets[:, replica], sim.resets)
+		np.testing.assert_array_equal(replicas.num_resets()[replica], list(sim.num_resets_per_user().values()))
+		distances = sim.distance_between_resets_per_user()
+		assert [replicas.distance_between_resets(replica, index) for index in range(4)] == [distances[identity] for identity in range(1, 5)]
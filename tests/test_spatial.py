@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import environment
+import spatial
+
+
+ENVIRONMENTS = {
+	'warehouse': environment.define_warehouse(40, 30, 4, 5, 3, 1.5),
+	'weirdness_2': environment.define_weirdness_2(20, 20),
+	'weirdness_3': environment.define_weirdness_3(20, 10),
+}
+
+
+# Points within and around the environment, the ones outside the grid falling back to all walls
+def random_points(walls, rng, num_points=2000):
+	lower = np.min(walls, axis=(0, 1)) - 5
+	upper = np.max(walls, axis=(0, 1)) + 5
+	return rng.uniform(lower, upper, size=(num_points, 2))
+
+
+@pytest.mark.parametrize('name', sorted(ENVIRONMENTS))
+def test_segment_index_matches_brute_force(name):
+	walls = np.asarray(ENVIRONMENTS[name], dtype=float)
+	rng = np.random.default_rng(0)
+	for radius in (None, 1.0, 4.0):
+		index = spatial.SegmentIndex(walls, radius)
+		points = random_points(walls, rng)
+		distances = index.distances(points)
+
+		nearest, vectors = index.nearest(points)
+		np.testing.assert_array_equal(distances[np.arange(len(points)), nearest], np.min(distances, axis=1))
+		np.testing.assert_allclose(np.linalg.norm(vectors, axis=-1), np.min(distances, axis=1), rtol=1e-12)
+		if radius is None:
+			continue
+
+		for include_nearest, within in ((False, index.within_radius(points)), (True, index.within_radius(points, include_nearest=True))):
+			for point, row in enumerate(within):
+				expected = set(np.flatnonzero(distances[point] <= radius))
+				if include_nearest:
+					expected.add(np.argmin(distances[point]))
+				assert list(row[row >= 0]) == sorted(expected)
+
+
+def test_segment_index_nested_points():
+	walls = np.asarray(ENVIRONMENTS['warehouse'], dtype=float)
+	index = spatial.SegmentIndex(walls, 2.0)
+	points = random_points(walls, np.random.default_rng(1), 60).reshape(3, 4, 5, 2)
+	flat = index.within_radius(points.reshape(-1, 2), include_nearest=True)
+	nested = index.within_radius(points, include_nearest=True)
+	assert nested.shape[:-1] == (3, 4, 5)
+	for row, nested_row in zip(flat, nested.reshape(-1, nested.shape[-1])):
+		assert list(row[row >= 0]) == list(nested_row[nested_row >= 0])
+
+
+# Neighbors of each user of each batch, against all pairs, over calls with moving users (reusing the order of the
+# previous call) and with changing numbers of users
+def test_neighbor_grid_matches_brute_force():
+	rng = np.random.default_rng(2)
+	grid = spatial.NeighborGrid(2.0)
+	for shape in [(30,), (30,), (4, 12), (4, 12), (2, 3, 7), (1,), (2,)]:
+		positions = rng.uniform(-6, 6, size=shape + (2,))
+		for move in range(2):
+			neighbors = grid.neighbors(positions)
+			assert neighbors.shape[:-1] == shape
+			for batch in np.ndindex(shape[:-1]):
+				points = positions[batch]
+				distances = np.linalg.norm(points[:, None, :] - points[None, :, :], axis=-1)
+				for user in range(shape[-1]):
+					expected = [other for other in range(shape[-1]) if other != user and distances[user, other] <= 2.0]
+					row = neighbors[batch + (user,)]
+					assert list(row[row >= 0]) == expected
+					assert np.all(row[len(expected):] == -1)
+			positions = positions + rng.normal(0, 0.1, size=positions.shape)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Library of virtual movement trajectory models. Each model generates the virtual locations of a user lazily, in chunks
+of consecutive positions, so that arbitrarily long (or unbounded) sessions can be simulated in constant memory. A model
+can either be materialized into a fixed-length path or attached to a user as a stream (see User.follow_virtual_model).
+"""
+
+__author__ = "Filip Lemic, Jakob Struye, Jeroen Famaey"
+__copyright__ = "Copyright 2021, Internet Technology and Data Science Lab (IDLab), University of Antwerp - imec"
+__version__ = "1.0.0"
+__maintainer__ = "Filip Lemic"
+__email__ = "filip.lemic@uantwerpen.be"
+__status__ = "Development"
+
+
+import math
+import numpy as np
+from user import LATTICE_MOVES
+
+
+# Base class of all models. Subclasses implement chunks(), a generator yielding (k,2) arrays with the positions that
+# follow the start location, one position per simulation step of length step.
+class TrajectoryModel:
+
+	def chunks(self, start, step, rng=None, chunk_size=1024):
+		raise NotImplementedError
+
+	# Returns a PositionStream handing out the model's positions one at a time
+	def stream(self, start, step, rng=None, chunk_size=1024):
+		return PositionStream(self.chunks(start, step, rng, chunk_size))
+
+	# Materializes the first number_of_points positions (including start) into an (number_of_points,2) array
+	def path(self, start, step, number_of_points, rng=None, chunk_size=1024):
+		path = np.empty((number_of_points, 2))
+		path[0] = start
+		filled = 1
+		for chunk in self.chunks(start, step, rng, min(chunk_size, max(number_of_points - 1, 1))):
+			if filled == number_of_points:
+				break
+			count = min(len(chunk), number_of_points - filled)
+			path[filled:filled + count] = chunk[:count]
+			filled += count
+		return path[:filled]
+
+
+# Buffers the chunks of a model and hands out one position per call to next_loc(). Returns None once a finite model
+# (e.g. a replayed trace) is exhausted.
+class PositionStream:
+	def __init__(self, chunks):
+		self.chunks = chunks
+		self.chunk = np.empty((0, 2))
+		self.position = 0
+		self.count = 0 # Number of locations pulled so far, used to replay the stream when resuming a checkpoint
+
+	def next_loc(self):
+		while self.position == len(self.chunk):
+			self.chunk = next(self.chunks, None)
+			self.position = 0
+			if self.chunk is None:
+				self.chunk = np.empty((0, 2))
+				return None
+		loc = self.chunk[self.position]
+		self.position += 1
+		self.count += 1
+		return loc
+
+
+# Positions reached by walking the given per-step moves from loc, accumulated step by step as in User.fill_virtual_path
+def integrate_moves(loc, moves):
+	return np.cumsum(np.vstack([loc, moves]), axis=0)[1:]
+
+
+# The original 4-direction lattice random walk (or a walk in the fixed direction fixed_dir), see User.fill_virtual_path
+class LatticeRandomWalk(TrajectoryModel):
+	def __init__(self, fixed_dir=None):
+		self.fixed_dir = fixed_dir
+
+	def chunks(self, start, step, rng=None, chunk_size=1024):
+		rng = np.random.default_rng(rng)
+		loc = np.array(start, dtype=float)
+		while True:
+			if self.fixed_dir is None:
+				directions = rng.integers(1, 5, size=chunk_size)
+			else:
+				directions = np.full(chunk_size, self.fixed_dir if self.fixed_dir in (1, 2, 3) else 4)
+			positions = integrate_moves(loc, LATTICE_MOVES[directions] * step)
+			loc = positions[-1]
+			yield positions
+
+
+# Correlated random walk: the heading changes by a normally distributed turn (turn_std in radians) at every step, so
+# that users keep walking roughly in the same direction instead of jittering on a lattice.
+class CorrelatedRandomWalk(TrajectoryModel):
+	def __init__(self, turn_std, initial_heading=None):
+		self.turn_std = turn_std
+		self.initial_heading = initial_heading
+
+	def chunks(self, start, step, rng=None, chunk_size=1024):
+		rng = np.random.default_rng(rng)
+		loc = np.array(start, dtype=float)
+		heading = rng.uniform(0, 2 * math.pi) if self.initial_heading is None else self.initial_heading
+		while True:
+			headings = heading + np.cumsum(rng.normal(0, self.turn_std, size=chunk_size))
+			heading = headings[-1]
+			positions = integrate_moves(loc, step * np.column_stack([np.cos(headings), np.sin(headings)]))
+			loc = positions[-1]
+			yield positions
+
+
+# Levy walk: straight flights in uniformly random directions, with flight lengths drawn from a power law with tail
+# exponent alpha, starting at min_flight and truncated at max_flight (in meters). Users move step meters per step.
+class LevyWalk(TrajectoryModel):
+	def __init__(self, alpha=1.5, min_flight=0.5, max_flight=20.0):
+		self.alpha = alpha
+		self.min_flight = min_flight
+		self.max_flight = max_flight
+
+	def chunks(self, start, step, rng=None, chunk_size=1024):
+		rng = np.random.default_rng(rng)
+		loc = np.array(start, dtype=float)
+		headings = np.empty(0)
+		while True:
+			# Draw flights until a full chunk of per-step headings is available, the rest is kept for the next chunk
+			while len(headings) < chunk_size:
+				lengths = np.minimum(self.min_flight * (1 - rng.random(chunk_size)) ** (-1 / self.alpha), self.max_flight)
+				counts = np.maximum(1, np.rint(lengths / step)).astype(int)
+				headings = np.concatenate([headings, np.repeat(rng.uniform(0, 2 * math.pi, size=chunk_size), counts)])
+			chunk_headings, headings = headings[:chunk_size], headings[chunk_size:]
+			positions = integrate_moves(loc, step * np.column_stack([np.cos(chunk_headings), np.sin(chunk_headings)]))
+			loc = positions[-1]
+			yield positions
+
+
+# Waypoint (point of interest) driven walk: the user walks in straight lines between the (K,2) waypoints, either in the
+# given order or picking the next one at random, and lingers pause_steps steps at each of them. Without loop the walk
+# ends at the last waypoint (only for the sequential order).
+class WaypointWalk(TrajectoryModel):
+	def __init__(self, waypoints, random_order=False, loop=True, pause_steps=0):
+		self.waypoints = np.asarray(waypoints, dtype=float).reshape(-1, 2)
+		if len(self.waypoints) == 0:
+			raise ValueError("A waypoint walk needs at least one waypoint")
+		self.random_order = random_order
+		self.loop = loop
+		self.pause_steps = pause_steps
+
+	def targets(self, rng):
+		if self.random_order:
+			while True:
+				yield self.waypoints[rng.integers(len(self.waypoints))]
+		while True:
+			yield from self.waypoints
+			if not self.loop:
+				return
+
+	def chunks(self, start, step, rng=None, chunk_size=1024):
+		rng = np.random.default_rng(rng)
+		loc = np.array(start, dtype=float)
+		pending = []
+		num_pending = 0
+		for target in self.targets(rng):
+			# Walk to the target at step meters per step, ending exactly on it, then pause there
+			distance = np.linalg.norm(target - loc)
+			num_steps = int(math.ceil(distance / step))
+			if num_steps == 0 and self.pause_steps == 0:
+				# Already at the target, stay for one step so that the walk keeps advancing
+				num_steps = 1
+				pending.append(target[None, :])
+			elif num_steps > 0:
+				fractions = np.minimum(np.arange(1, num_steps + 1) * step / distance, 1.0)
+				pending.append(loc + fractions[:, None] * (target - loc))
+			if self.pause_steps > 0:
+				pending.append(np.repeat(target[None, :], self.pause_steps, axis=0))
+			num_pending += num_steps + self.pause_steps
+			loc = np.array(target)
+
+			while num_pending >= chunk_size:
+				positions = np.concatenate(pending)
+				yield positions[:chunk_size]
+				pending = [positions[chunk_size:]]
+				num_pending -= chunk_size
+
+		if num_pending > 0:
+			yield np.concatenate(pending)
+
+
+# Replay of a recorded (N,2) trace, sampled at the simulation rate (the step argument is ignored). With relative the
+# trace is translated so that it starts at the user's initial location. With loop the trace is replayed over and over,
+# each repetition continuing from where the previous one ended, otherwise the model is exhausted at the end of the trace.
+class TraceReplay(TrajectoryModel):
+	def __init__(self, trace, relative=True, loop=False):
+		self.trace = np.asarray(trace, dtype=float).reshape(-1, 2)
+		if len(self.trace) < 2:
+			raise ValueError("A trace needs at least two points, the first one being the initial location")
+		self.relative = relative
+		self.loop = loop
+
+	def chunks(self, start, step, rng=None, chunk_size=1024):
+		offset = np.array(start, dtype=float) - self.trace[0] if self.relative else np.zeros(2)
+		while True:
+			for chunk_start in range(1, len(self.trace), chunk_size):
+				yield self.trace[chunk_start:chunk_start + chunk_size] + offset
+			if not self.loop:
+				return
+			offset = offset + self.trace[-1] - self.trace[0]
+
+
+# Loads a recorded trace from a .npy/.npz file (the first array in the archive, or the one named key) or from a CSV file
+# with the x and y coordinates in the given columns (a header line is skipped if present).
+def load_trace(path, columns=(0, 1), key=None):
+	if path.endswith('.npy'):
+		trace = np.load(path)
+	elif path.endswith('.npz'):
+		with np.load(path) as archive:
+			trace = archive[key if key is not None else archive.files[0]]
+	else:
+		with open(path) as trace_file:
+			header = trace_file.readline()
+		try:
+			[float(value) for value in header.split(',')]
+			skiprows = 0
+		except ValueError:
+			skiprows = 1
+		trace = np.loadtxt(path, delimiter=',', skiprows=skiprows, ndmin=2)
+	return np.asarray(trace, dtype=float)[:, list(columns)]
@@ -17,15 +17,91 @@ __status__ = "Development"
 import numpy as np
 import random 
 
+# Growable (N,2) float64 buffer for storing a trajectory. Appending is amortized O(1) and all accessors return views
+# into the buffer instead of copies, so a long trajectory is a single array instead of many 2-element ones.
+class Trajectory:
+	def __init__(self, capacity=1024):
+		self.data = np.empty((max(capacity, 1), 2))
+		self.length = 0
+
+	def __len__(self):
+		return self.length
+
+	def __getitem__(self, index):
+		return self.data[:self.length][index]
+
+	def __iter__(self):
+		return iter(self.data[:self.length])
+
+	# Copy of the stored locations as required by the array protocol, a view only with copy=False (see array)
+	def __array__(self, dtype=None, copy=None):
+		data = self.data[:self.length]
+		if dtype is not None:
+			data = data.astype(dtype, copy=False)
+		return data if copy is False else data.copy()
+
+	# (N,2) view of the stored locations, valid until the buffer has to grow
+	@property
+	def array(self):
+		return self.data[:self.length]
+
+	# Makes sure that at least capacity locations fit into the buffer without reallocating
+	def reserve(self, capacity):
+		if capacity > len(self.data):
+			data = np.empty((capacity, 2))
+			data[:self.length] = self.data[:self.length]
+			self.data = data
+
+	def append(self, loc):
+		if self.length == len(self.data):
+			self.reserve(2 * len(self.data))
+		self.data[self.length] = loc
+		self.length += 1
+
+	def extend(self, locs):
+		locs = np.asarray(locs, dtype=float).reshape(-1, 2)
+		if self.length + len(locs) > len(self.data):
+			self.reserve(max(2 * len(self.data), self.length + len(locs)))
+		self.data[self.length:self.length + len(locs)] = locs
+		self.length += len(locs)
+
+	def clear(self):
+		self.length = 0
+
+	# Drops all but the latest count locations
+	def keep_last(self, count):
+		if self.length > count:
+			self.data[:count] = self.data[self.length - count:self.length]
+			self.length = count
+
+
+# Moves of the lattice random walk, indexed by direction (1: right, 2: left, 3: up, anything else: down)
+LATTICE_MOVES = np.array([[0.0, -1.0], [1.0, 0.0], [-1.0, 0.0], [0.0, 1.0], [0.0, -1.0]])
+
+# Returns an (number_of_points,2) lattice random walk starting at start, using one vectorized draw of directions from
+# rng (a numpy.random.Generator or a seed) and a cumulative sum of the moves. A fixed_dir walks in one direction only.
+def lattice_walk(start, number_of_points, step, fixed_dir=None, rng=None):
+	if fixed_dir is None:
+		directions = np.random.default_rng(rng).integers(1, 5, size=number_of_points - 1)
+	else:
+		directions = np.full(number_of_points - 1, fixed_dir if fixed_dir in (1, 2, 3) else 4)
+
+	path = np.empty((number_of_points, 2))
+	path[0] = start
+	path[1:] = LATTICE_MOVES[directions] * step
+	return np.cumsum(path, axis=0, out=path)
+
+
 class User:
-	def __init__(self, initial_loc, initial_speed, identity):
-		if type(initial_loc) == list:
-			initial_loc = np.array(initial_loc)
+	def __init__(self, initial_loc, initial_speed, identity, capacity=1024):
 		self.identity = identity
-		self.initial_loc = initial_loc
+		self.initial_loc = np.array(initial_loc, dtype=float)
 		self.speed = initial_speed
-		self.phy_locations = [initial_loc]
-		self.virt_locations = []
+		self.phy_locations = Trajectory(capacity)
+		self.phy_locations.append(self.initial_loc)
+		self.virt_locations = Trajectory(capacity)
+		self.virt_stream = None
+		self.keep_virt_history = True
 
 
 	def get_phy_loc(self, offset=0):
@@ -36,7 +112,17 @@ class User:
 		return self.virt_locations[-1 + offset]
 
 
-	def fill_virtual_path(self, number_of_points, step, fixed_dir=None):
+	# Fills the virtual trajectory with a 4-direction lattice random walk (or a walk in the fixed direction fixed_dir,
+	# 1: right, 2: left, 3: up, 4: down). If rng (a numpy.random.Generator or a seed) is given, the whole walk is drawn
+	# at once and accumulated with a single cumulative sum, otherwise the directions are drawn one by one from the
+	# random module as before. The vectorized walk is fully determined by the seed.
+	def fill_virtual_path(self, number_of_points, step, fixed_dir=None, rng=None):
+		self.virt_locations.reserve(len(self.virt_locations) + number_of_points)
+
+		if rng is not None:
+			self.virt_locations.extend(lattice_walk(self.initial_loc, number_of_points, step, fixed_dir, rng))
+			return
+
 		self.virt_locations.append(self.initial_loc)
 
 		# Filling the coordinates with random variables
@@ -57,18 +143,32 @@ class User:
 				newloc[1] -= step
 			self.virt_locations.append(newloc)
 
-	# The goal is to return a 1-dimensional list to be reshaped later on for short-term predictions
+	# Attaches a trajectory model (see trajectory_models) as the source of the virtual locations. Instead of precomputing
+	# the path, the positions are generated lazily in chunks and pulled one at a time by advance_virtual_path. The first
+	# step is pulled right away, since the simulation kick-starts on it. Without keep_history only the latest virtual
+	# location is kept, so that unbounded sessions run in constant memory.
+	def follow_virtual_model(self, model, step, rng=None, chunk_size=1024, keep_history=True):
+		self.virt_stream = model.stream(self.initial_loc, step, rng, chunk_size)
+		self.keep_virt_history = keep_history
+		self.virt_locations.append(self.initial_loc)
+		self.virt_locations.append(self.virt_stream.next_loc())
+
+	# Pulls the next virtual location from the attached model. Returns None if the user has no model attached or if the
+	# model is exhausted.
+	def advance_virtual_path(self):
+		if self.virt_stream is None:
+			return None
+		loc = self.virt_stream.next_loc()
+		if loc is not None:
+			if not self.keep_virt_history:
+				self.virt_locations.clear()
+			self.virt_locations.append(loc)
+		return loc
+
+	# The goal is to return an (N,2) array of physical locations to be reshaped later on for short-term predictions.
+	# This is a view into the user's trajectory buffer, copy it if it has to outlive further appends.
 	def get_phy_path(self):
+		return self.phy_locations.array
 
-		dataset = {}
-		dataset['phy_x'] = []
-		dataset['phy_y'] = []
-
-		for i in self.phy_locations:
-			
-			dataset['phy_x'].append(i[0])
-			dataset['phy_y'].append(i[1])
-
-		return dataset
-
-
+	def get_virt_path(self):
+		return self.virt_locations.array
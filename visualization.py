@@ -31,7 +31,7 @@ def visualize_paths(number_of_points, users):
 		plt.figure(1) 
 		plt.grid(True)
 		plt.title("Virtual paths: random walk ($n = " + str(number_of_points) + "$ steps)")
-		virt_path = np.array(user.virt_locations)
+		virt_path = user.get_virt_path()
 		plt.plot(virt_path[:,0], virt_path[:,1], '.', color=color_codes[iter_temp], label="User" + str(flag_temp))
 		
 		if flag_temp <= len(users):
@@ -41,7 +41,7 @@ def visualize_paths(number_of_points, users):
 		plt.figure(2)
 		plt.grid(True)
 		plt.title("Physical paths")
-		phy_path = np.array(user.phy_locations)
+		phy_path = user.get_phy_path()
 
 		# Fade in the color  https://stackoverflow.com/a/61758419
 		cmap = colors.LinearSegmentedColormap.from_list(